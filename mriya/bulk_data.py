@@ -19,13 +19,19 @@ along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
 """
 __author__ = "Yaroslav Litvinov"
 
+import csv
 from StringIO import StringIO
+from itertools import groupby
 from opcsv import CsvWriter
 from opcsv import CsvReader
 from collections import namedtuple
 
 BulkData = namedtuple('BulkData', ['fields', 'rows'])
 
+# Bulk API limit of batch data size: 10MB and 10M chars,
+# chars count never exceeds bytes count
+MAX_BATCH_BYTES = 10000000
+
 def get_stream_from_csv_rows_list(csv_rows_list):
     istream = StringIO()
     # put data into stream for handling
@@ -86,6 +92,117 @@ def prepare_sf_data_to_send(data_to_send):
     repls = ('<RN CR>', '\r\n'), ('<N CR>', '\n')
     return reduce(lambda a, kv: a.replace(*kv), repls, data_to_send)
 
+def iter_csv_records(csv_lines):
+    """ Generator of csv records, lines of multiline quoted record
+    are joined into single record """
+    record = ''
+    quotes_count = 0
+    for line in csv_lines:
+        record += line
+        quotes_count += line.count('"')
+        if not quotes_count % 2:
+            yield record
+            record = ''
+            quotes_count = 0
+    if record:
+        yield record
+
+def sf_data_size(record):
+    """ Size of record as it will be sent by prepare_sf_data_to_send """
+    if record.find('<') == -1:
+        return len(record)
+    return len(prepare_sf_data_to_send(record))
+
+def csv_record_values(record):
+    return next(csv.reader([record]))
+
+def sort_csv_records(csv_lines, field):
+    """ Return list of header and records sorted by value of field,
+    and original positions of sorted records. Raise ValueError if
+    field is missing."""
+    records = iter_csv_records(csv_lines)
+    header = next(records)
+    idx = csv_record_values(header).index(field)
+    keyed = sorted([(csv_record_values(x)[idx], pos, x)
+                    for pos, x in enumerate(records)])
+    return ([header] + [x[2] for x in keyed], [x[1] for x in keyed])
+
+def restore_results_order(res, positions):
+    """ Put result lines of sorted records into original records order """
+    lines = [x for x in res if x]
+    ordered = [None] * len(positions)
+    for pos, line in zip(positions, lines[1:]):
+        ordered[pos] = line
+    return lines[:1] + ordered + ['']
+
+class CsvBatchesReader(object):
+    """ Reads csv records by batches of variable size, every batch is
+    a list of header record followed by records. Lines are read lazily.
+    Batch is limited by records count and by size of data to be sent,
+    the record not fitting into batch starts the next one.
+    If group_field is set then sequent records having the same value
+    of field are put into the same batch, group is splitted only if it
+    doesn't fit into batch alone."""
+    def __init__(self, csv_lines, max_bytes=MAX_BATCH_BYTES,
+                 group_field=None):
+        self.records = iter_csv_records(csv_lines)
+        self.header = next(self.records, None)
+        self.max_bytes = max_bytes
+        self.groups = self.iter_groups(group_field)
+        self.pending = None
+
+    def iter_groups(self, group_field):
+        if group_field is None or self.header is None:
+            return ([x] for x in self.records)
+        idx = csv_record_values(self.header).index(group_field)
+        return (list(x[1]) for x in groupby(
+            self.records, key=lambda x: csv_record_values(x)[idx]))
+
+    def read_batch(self, batch_size):
+        """ Return next batch or None if no records left """
+        batch = [self.header]
+        batch_bytes = sf_data_size(self.header or '')
+        while True:
+            group = self.pending or next(self.groups, None)
+            if not group:
+                break
+            self.pending = None
+            group_bytes = sum([sf_data_size(x) for x in group])
+            if len(batch) - 1 + len(group) <= batch_size and \
+               batch_bytes + group_bytes <= self.max_bytes:
+                batch.extend(group)
+                batch_bytes += group_bytes
+                continue
+            if len(batch) == 1:
+                # group doesn't fit into empty batch, split it
+                for record in group:
+                    record_bytes = sf_data_size(record)
+                    if len(batch) > 1 and \
+                       (len(batch) > batch_size or
+                        batch_bytes + record_bytes > self.max_bytes):
+                        break
+                    batch.append(record)
+                    batch_bytes += record_bytes
+                group = group[len(batch) - 1:]
+            self.pending = group
+            break
+        if len(batch) > 1:
+            return batch
+        return None
+
+def iter_csv_batches(csv_lines, batch_size, max_bytes=MAX_BATCH_BYTES,
+                     group_field=None):
+    """ Generator of batches, every batch is a list of header record
+    followed by max batch_size records. Lines are read lazily."""
+    reader = CsvBatchesReader(csv_lines, max_bytes, group_field)
+    return iter(lambda: reader.read_batch(batch_size), None)
+
+def csv_records_count(csvfname):
+    """ Count of records in csv file, header is not counted """
+    with open(csvfname) as csv_f:
+        count = sum(1 for _ in iter_csv_records(csv_f))
+    return max(count - 1, 0)
+
 def save_escape_csv_lines_as_csv_file(csvfname_w, csv_lines):
     with open(csvfname_w, 'w') as csv_f:
         #join incomplete lines and then write complete line
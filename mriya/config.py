@@ -27,6 +27,8 @@ DEFAULT_SETTINGS_SECTION = 'DEFAULT'
 SESSIONS_SETTING = 'sessions_file'
 LOGDIR_SETTING = 'logdir'
 DATADIR_SETTING = 'datadir'
+SQLITE_ENGINE_SETTING = 'sqlite_engine'
+WORKERS_SETTING = 'workers'
 
 # connection endpoint setting
 USERNAME_SETTING = 'username'
@@ -35,3 +37,26 @@ HOST_PREFIX_SETTING = 'host_prefix'
 CONSUMER_KEY_SETTING = 'consumer_key'
 CONSUMER_SECRET_SETTING = 'consumer_secret'
 PRODUCTION_SETTING = 'production'
+# max count of concurrent http requests to endpoint
+CONCURRENT_REQUESTS_SETTING = 'concurrent_requests'
+DEFAULT_CONCURRENT_REQUESTS = 4
+# keep dml job opened across statements using the same object and operation
+JOB_SESSION_SETTING = 'job_session'
+# max count of kept alive http connections to endpoint, equal to
+# concurrent_requests by default
+POOL_SIZE_SETTING = 'pool_size'
+# timeout of http requests to endpoint, seconds
+TIMEOUT_SETTING = 'timeout'
+DEFAULT_TIMEOUT = 300
+# gzip request data and responses of endpoint, enabled by default
+COMPRESSION_SETTING = 'compression'
+# salesforce bulk api version used by endpoint
+BULK_API_SETTING = 'bulk_api'
+BULK_API_1 = '1.0' # by default
+BULK_API_2 = '2.0'
+# dml statements having less records are sent by sObject Collections
+# REST API instead of bulk job, 0 - disabled
+REST_DML_THRESHOLD_SETTING = 'rest_dml_threshold'
+# queries limited to this count of records are sent by REST API query
+# instead of bulk job, 0 - disabled
+REST_QUERY_MAX_ROWS_SETTING = 'rest_query_max_rows'
@@ -23,50 +23,72 @@ __author__ = 'Volodymyr Varchuk, Yaroslav Litvinov'
 from collections import namedtuple
 import os
 import requests
-from json import loads, load, dump
+from json import loads
+from sfbulk.callout import http_session
 from mriya.sf_bulk_connector import SfBulkConnector
+from mriya.sf_bulk2_connector import SfBulk2Connector
+from mriya.sessions_cache import SessionsCache
 from mriya.config import *
 
 ConnectorParam = namedtuple('ConnectorParam',
                          ['username', 'password', 'url_prefix',
                           'production', 'consumer_key',
-                          'consumer_secret', 'token'])
+                          'consumer_secret', 'token',
+                          'concurrent_requests', 'job_session',
+                          'rest_dml_threshold', 'rest_query_max_rows',
+                          'pool_size', 'timeout',
+                          'compression'])
 
 def get_conn_param(conf_dict):
+    concurrent_requests = conf_dict.getint(CONCURRENT_REQUESTS_SETTING,
+                                           DEFAULT_CONCURRENT_REQUESTS)
     param = ConnectorParam(conf_dict[USERNAME_SETTING].encode('utf-8'),
                            conf_dict[PASSWORD_SETTING].encode('utf-8'),
                            conf_dict[HOST_PREFIX_SETTING].encode('utf-8'),
                            conf_dict.getboolean(PRODUCTION_SETTING),
                            conf_dict[CONSUMER_KEY_SETTING].encode('utf-8'),
                            conf_dict[CONSUMER_SECRET_SETTING].encode('utf-8'),
-                           '')
+                           '',
+                           concurrent_requests,
+                           conf_dict.getboolean(JOB_SESSION_SETTING, False),
+                           conf_dict.getint(REST_DML_THRESHOLD_SETTING, 0),
+                           conf_dict.getint(REST_QUERY_MAX_ROWS_SETTING, 0),
+                           conf_dict.getint(POOL_SIZE_SETTING,
+                                            concurrent_requests),
+                           conf_dict.getfloat(TIMEOUT_SETTING,
+                                              DEFAULT_TIMEOUT),
+                           conf_dict.getboolean(COMPRESSION_SETTING, True))
     return param
 
 def conn_param_set_token(conn_param, access_token):
-    assert len(conn_param) == 7
-    new_conn_param_list = list(conn_param)
-    new_conn_param_list[6] = access_token
-    return ConnectorParam._make(new_conn_param_list)
+    return conn_param._replace(token=access_token)
 
 def create_bulk_connector(config, setting_name):
     sessions_file_name = config[DEFAULT_SETTINGS_SECTION][SESSIONS_SETTING]
+    sessions_cache = SessionsCache(sessions_file_name)
     conn_param = get_conn_param(config[setting_name])
-    auth_token = AuthToken(conn_param, sessions_file_name)
+    # connections are kept alive and shared by all requests to endpoint
+    session = http_session(conn_param.pool_size)
+    auth_token = AuthToken(conn_param, sessions_cache, session)
     conn_param = auth_token.conn_param_with_token()
-    conn = SfBulkConnector(conn_param)
+    if config[setting_name].get(BULK_API_SETTING, BULK_API_1) == BULK_API_2:
+        conn = SfBulk2Connector(conn_param, session, sessions_cache)
+    else:
+        conn = SfBulkConnector(conn_param, session, sessions_cache)
     return conn
 
 class AuthToken(object):
-    def __init__(self, conn_param, sessions_file):
+    def __init__(self, conn_param, sessions_cache, session=requests):
         self.conn_param = conn_param
-        self.sessions_file = sessions_file
+        self.sessions_cache = sessions_cache
+        self.session = session
         self.conn_param = conn_param_set_token(conn_param, self.get_token())
 
     def conn_param_with_token(self):
         return self.conn_param
 
     @staticmethod
-    def oauth2_token(conn_param):
+    def oauth2_token(conn_param, session=requests):
         req_param = {
             'grant_type': 'password',
             'client_id': conn_param.consumer_key,
@@ -78,10 +100,10 @@ class AuthToken(object):
         token_url_fmt = 'https://{url_prefix}salesforce.com/services/oauth2/token'
         token_url = token_url_fmt.format(url_prefix=conn_param.url_prefix)
 
-        result = requests.post(
+        result = session.post(
             token_url,
             headers={"Content-Type":"application/x-www-form-urlencoded"},
-            data=req_param)
+            data=req_param, timeout=conn_param.timeout)
 
         result_dict = loads(result.content)
         if 'access_token' in result_dict.keys():
@@ -90,30 +112,6 @@ class AuthToken(object):
             Exception("Can't obtain oauth token", result_dict)
 
     def get_token(self):
-        token = self.get_cached_token()
-        if not token:
-            token = AuthToken.oauth2_token(self.conn_param)
-            self.save_token(token)
-        return token
-
-    def get_cached_token(self):
-        try:
-            tokens_dict = load(open(self.sessions_file, 'r'))
-        except:
-            return None
-        if self.conn_param.username in tokens_dict.keys():
-            return tokens_dict[self.conn_param.username]
-        else:
-            return None
-
-    def save_token(self, token):
-        tokens_dict = {}
-        try:
-            tokens_dict = load(open(self.sessions_file, 'r'))
-        except:
-            pass
-        tokens_dict[self.conn_param.username] = token
-        dump(tokens_dict, open(self.sessions_file, 'w'))
-        
-
-
+        return self.sessions_cache.token(
+            self.conn_param.username,
+            lambda: AuthToken.oauth2_token(self.conn_param, self.session))
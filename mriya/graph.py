@@ -55,14 +55,24 @@ def get_href_info(item_x, node_name, csvdir, aggregated_csvs):
     return (csvhref, nodeinfo)
 
 
-def add_item_to_graph(item_x, idx, graph_nodes, csvdir, aggregated_csvs):
+def get_item_edges(item_x):
+    """ Return names of csv tables, salesforce objects and variables
+    which are used by job syntax item """
     edges = []
     # get csv relations
     if CSVLIST_KEY in item_x:
         edges.extend(item_x[CSVLIST_KEY])
     elif OBJNAME_KEY in item_x:
+        edges.append(item_x[FROM_KEY] + '.' + item_x[OBJNAME_KEY])
+    # get var relations
+    if QUERY_KEY in item_x:
+        edges.extend(SqlExecutor.get_query_var_names(item_x[QUERY_KEY]))
+    return edges
+
+def add_item_to_graph(item_x, idx, graph_nodes, csvdir, aggregated_csvs):
+    edges = get_item_edges(item_x)
+    if CSVLIST_KEY not in item_x and OBJNAME_KEY in item_x:
         node_name = item_x[FROM_KEY] + '.' + item_x[OBJNAME_KEY]
-        edges.append(node_name)
         graph_nodes[node_name] = GraphNodeData(id=idx, edges=[],
                                                shape=SHAPE_BOX,
                                                color=COLOR_GREEN,
@@ -70,9 +80,6 @@ def add_item_to_graph(item_x, idx, graph_nodes, csvdir, aggregated_csvs):
                                                info=EXTERNAL_OBJECT_READ,
                                                href='')
         idx = idx + 1
-    # get var relations
-    if QUERY_KEY in item_x:
-        edges.extend(SqlExecutor.get_query_var_names(item_x[QUERY_KEY]))
 
     csvhref, nodeinfo = ('','')
 
@@ -25,6 +25,7 @@ __author__ = "Yaroslav Litvinov"
 import os
 import time
 import os.path
+import threading
 from logging import getLogger
 from configparser import ConfigParser
 from mriya import sql_executor
@@ -33,10 +34,14 @@ from mriya.job_syntax import *
 from mriya.opexecutor import Executor
 from mriya.sql_executor import SqlExecutor, var_replaced
 from mriya.sqlite_executor import SqliteExecutor
+from mriya.sqlite_engine import SqliteEngine
+from mriya.sqlite_engine import SQLITE_ENGINE_SHELL, SQLITE_ENGINE_INPROCESS
+from mriya.job_scheduler import JobScheduler
 from mriya.salesforce_executor import SalesforceExecutor
 from mriya.data_connector import create_bulk_connector
 from mriya.bulk_data import csv_from_bulk_data, parse_batch_res_data
-from mriya.bulk_data import BulkData
+from mriya.bulk_data import BulkData, csv_records_count
+from mriya.bulk_data import sort_csv_records, restore_results_order
 from mriya.job_syntax_extended import BATCH_KEY
 from mriya.sf_merge import SoapMerge
 from mriya.config import *
@@ -48,6 +53,7 @@ class Endpoints(object):
         self.config = config
         self.endpoint_names = endpoint_names
         self.endpoints = {}
+        self.lock = threading.Lock()
 
     def __del__(self):
         del self.endpoints
@@ -55,18 +61,24 @@ class Endpoints(object):
     def ensure_endpoint_exist(self, endpoint_name):
         setting_name = self.endpoint_names[endpoint_name]
         # create endpoint if not created yet
-        if endpoint_name not in self.endpoints:
-            self.endpoints[endpoint_name] = create_bulk_connector(
-                self.config, setting_name)
+        with self.lock:
+            if endpoint_name not in self.endpoints:
+                self.endpoints[endpoint_name] = create_bulk_connector(
+                    self.config, setting_name)
 
     def endpoint(self, name):
         self.ensure_endpoint_exist(name)
         return self.endpoints[name]
 
+    def close_job_sessions(self):
+        for conn in self.endpoints.values():
+            conn.close_job_session()
+
 class JobController(object):
 
     def __init__(self, config_filename, endpoint_names,
-                 job_syntax, variables, debug_steps):
+                 job_syntax, variables, debug_steps, sqlite_engine=None,
+                 endpoints=None):
         #loginit(__name__)
         self.config = None
         if config_filename:
@@ -74,9 +86,27 @@ class JobController(object):
             self.config = ConfigParser()
             self.config.read_file(self.config_file)
         self.job_syntax = job_syntax
-        self.endpoints = Endpoints(self.config, endpoint_names)
+        # nested jobs are sharing endpoints of parent job, so jobs
+        # opened by job session are closed only by parent job
+        self.own_endpoints = endpoints is None
+        self.endpoints = endpoints or Endpoints(self.config, endpoint_names)
         self.variables = variables
         self.debug_steps = debug_steps
+        self.workers = 1
+        if self.config:
+            self.workers = self.config[DEFAULT_SETTINGS_SECTION].getint(
+                WORKERS_SETTING, 1)
+        # nested jobs are sharing engine of parent job
+        self.sqlite_engine = sqlite_engine
+        if not self.sqlite_engine and self.config:
+            engine_type = self.config[DEFAULT_SETTINGS_SECTION].get(
+                SQLITE_ENGINE_SETTING, SQLITE_ENGINE_SHELL)
+            if engine_type == SQLITE_ENGINE_INPROCESS:
+                self.sqlite_engine = SqliteEngine()
+            elif engine_type != SQLITE_ENGINE_SHELL:
+                getLogger(STDERR).error('Unknown sqlite engine: %s',
+                                        engine_type)
+                exit(1)
         # create csv file for an internal batch purpose
         ints1000_csv = SqlExecutor.csv_name(INTS_TABLE)
         with open(ints1000_csv, 'w') as ints:
@@ -93,7 +123,8 @@ class JobController(object):
         sqltype = JobSyntax.sqltype(job_syntax_item)
         getLogger(LOG).debug(job_syntax_item)
         if sqltype == SQL_TYPE_SQLITE:
-            sql_exec = SqliteExecutor(job_syntax_item, self.variables)
+            sql_exec = SqliteExecutor(job_syntax_item, self.variables,
+                                      self.sqlite_engine)
         elif sqltype == SQL_TYPE_SF:
             key_from = job_syntax_item[FROM_KEY]
             conn = self.endpoints.endpoint(key_from)
@@ -144,9 +175,25 @@ class JobController(object):
             else:
                 print "Please respond with 'yes' or 'no'"
 
+    def run_job_item(self, job_syntax_item):
+        if BATCH_KEY in job_syntax_item:
+            self.run_in_loop(job_syntax_item)
+        else:
+            self.handle_job_item_(job_syntax_item)
+
     def run_job(self):
-        batch_items = None
-        batch = None
+        try:
+            self.run_job_items()
+        finally:
+            if self.own_endpoints:
+                self.endpoints.close_job_sessions()
+
+    def run_job_items(self):
+        # step by step debugging is possible only for sequential run
+        if self.workers > 1 and not self.debug_steps:
+            scheduler = JobScheduler(self, self.workers)
+            scheduler.run()
+            return
         for job_syntax_item in self.job_syntax:
             if self.debug_steps:
                 print "NEXT SQL:", SqlExecutor.prepare_query_put_vars(
@@ -154,10 +201,7 @@ class JobController(object):
                 print "continue execution? y/n"
                 if not self.step_by_step():
                     exit(0)
-            if BATCH_KEY in job_syntax_item:
-                self.run_in_loop(job_syntax_item)
-            else:
-                self.handle_job_item_(job_syntax_item)
+            self.run_job_item(job_syntax_item)
 
     def run_in_loop(self, job_syntax_item):
         # run batch_begin query and save list of batches to var
@@ -195,16 +239,12 @@ class JobController(object):
                                   self.endpoints.endpoint_names,
                                   job_syntax_items,
                                   variables,
-                                  self.debug_steps)
+                                  self.debug_steps,
+                                  self.sqlite_engine,
+                                  self.endpoints)
         batch_job.run_job()
         del batch_job
 
-    def csvdata(self, filename):
-        csv_data = None
-        with open(filename) as csv_f:
-            csv_data = csv_f.readlines()
-        return csv_data
-
     def handle_transmitter_op(self, job_syntax_item, endpoint):
         opname = job_syntax_item[OP_KEY]
         # run batches sequentially / parallel
@@ -218,35 +258,76 @@ class JobController(object):
                 exit(1)
         else:
             batch_seq = False # parallel by default
+        retries = int(job_syntax_item.get(RETRY_KEY, 0))
+        retry_type = job_syntax_item.get(RETRY_TYPE_KEY,
+                                         BATCH_TYPE_PARALLEL_KEY)
+        if retry_type not in (BATCH_TYPE_PARALLEL_KEY,
+                              BATCH_TYPE_SEQUENTIAL_KEY):
+            getLogger(STDERR).error('Unknown retry type: %s', retry_type)
+            exit(1)
+        retry_seq = retry_type == BATCH_TYPE_SEQUENTIAL_KEY
         csv_key_val = var_replaced(self.variables, job_syntax_item, CSV_KEY)
         csv_filename = SqlExecutor.csv_name(csv_key_val)
-        csv_data = self.csvdata(csv_filename)
-        num_lines = len(csv_data)
+        num_lines = csv_records_count(csv_filename)
         # do nothing for empty data set
-        if num_lines <= 1:
+        if not num_lines:
             getLogger(LOG).info('skip empty csv')
             stub = ['"Id","Success","Created","Error"\n']
             result_ids = parse_batch_res_data(stub)
         else:
             objname = job_syntax_item[endpoint]
             conn = self.endpoints.endpoint(endpoint)
-            max_batch_size = int(job_syntax_item[BATCH_SIZE_KEY])
+            max_batch_size = job_syntax_item[BATCH_SIZE_KEY]
+            if max_batch_size != BATCH_SIZE_AUTO:
+                max_batch_size = int(max_batch_size)
             getLogger(STDOUT).info('EXECUTE: %s %s, lines count=%d',
-                                     opname, objname, num_lines-1)
+                                     opname, objname, num_lines)
             t_before = time.time()
-            if len(csv_data):
+            group_field = job_syntax_item.get(GROUPBY_KEY)
+            # csv file is read by connector one batch at a time
+            with open(csv_filename) as csv_file:
+                csv_data = csv_file
+                if group_field:
+                    # records of the same group are put into one batch
+                    try:
+                        csv_data, positions = sort_csv_records(csv_file,
+                                                               group_field)
+                    except ValueError:
+                        getLogger(STDERR).error(
+                            "groupby field '%s' not found in %s",
+                            group_field, csv_filename)
+                        exit(1)
                 if opname == OP_UPDATE:
                     res = conn.bulk_update(objname, csv_data,
-                                           max_batch_size, batch_seq)
+                                           max_batch_size, batch_seq,
+                                           retries, retry_seq,
+                                           group_field)
                 elif opname == OP_DELETE:
                     res = conn.bulk_delete(objname, csv_data,
-                                           max_batch_size, batch_seq)
+                                           max_batch_size, batch_seq,
+                                           retries, retry_seq,
+                                           group_field)
                 elif opname == OP_INSERT:
                     res = conn.bulk_insert(objname, csv_data,
-                                           max_batch_size, batch_seq)
+                                           max_batch_size, batch_seq,
+                                           retries, retry_seq,
+                                           group_field)
+                elif opname == OP_UPSERT:
+                    res = conn.bulk_upsert(objname, csv_data,
+                                           max_batch_size, batch_seq,
+                                           job_syntax_item[UPSERT_FIELD_KEY],
+                                           retries, retry_seq,
+                                           group_field)
+                elif opname == OP_HARD_DELETE:
+                    res = conn.bulk_hard_delete(objname, csv_data,
+                                                max_batch_size, batch_seq,
+                                                retries, retry_seq,
+                                                group_field)
                 else:
                     getLogger(STDERR).error("Operation '%s' isn't supported" % opname)
                     exit(1)
+                if group_field:
+                    res = restore_results_order(res, positions)
 
                 result_ids = parse_batch_res_data(res)
                
@@ -267,10 +348,9 @@ class JobController(object):
         opname = job_syntax_item[OP_KEY]
         csv_key_val = var_replaced(self.variables, job_syntax_item, CSV_KEY)        
         csv_filename = SqlExecutor.csv_name(csv_key_val)
-        csv_data = self.csvdata(csv_filename)
-        num_lines = len(csv_data)
+        num_lines = csv_records_count(csv_filename)
         # do nothing for empty data set
-        if num_lines <= 1:
+        if not num_lines:
             getLogger(LOG).info('skip empty csv')
             from mriya.sf_merge_wrapper import HEADER
             result_ids = BulkData(HEADER, [])
@@ -279,10 +359,9 @@ class JobController(object):
             conn = self.endpoints.endpoint(endpoint)
             max_batch_size = int(job_syntax_item[BATCH_SIZE_KEY])
             getLogger(STDOUT).info('EXECUTE: %s %s, lines count=%d',
-                                     opname, objname, num_lines-1)
+                                     opname, objname, num_lines)
             t_before = time.time()
-            if len(csv_data):
-
+            with open(csv_filename) as csv_data:
                 result_ids = conn.soap_merge(objname, csv_data, max_batch_size)
             t_after = time.time()
             getLogger(STDOUT).info('SF %s Took time: %.2f' \
@@ -309,6 +388,7 @@ class JobController(object):
             if opname == OP_UPSERT or \
                opname == OP_INSERT or \
                opname == OP_DELETE or \
+               opname == OP_HARD_DELETE or \
                opname == OP_UPDATE:
                 self.handle_transmitter_op(job_syntax_item, endpoint)
             elif opname == OP_MERGE:
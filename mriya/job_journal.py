@@ -0,0 +1,138 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+""" Journal of running bulk jobs. Id of job is saved in datadir as
+soon as job is created and id of every batch as soon as batch is
+created, until statement results are received. So rerun of statement
+after crash is attached to already running job and sends only batches
+which weren't created yet. Statement is identified by endpoint,
+operation and fingerprint of its data."""
+
+__author__ = "Yaroslav Litvinov"
+
+import os
+import hashlib
+import threading
+from mriya.json_file import load_json, save_json
+
+JOURNAL_FILE = 'jobs_journal.json'
+READ_CHUNK_SIZE = 1024 * 1024
+
+def data_fingerprint(data):
+    """ md5 of opened csv file, list of csv lines or query """
+    md5 = hashlib.md5()
+    if isinstance(data, file):
+        for chunk in iter(lambda: data.read(READ_CHUNK_SIZE), ''):
+            md5.update(chunk)
+        data.seek(0)
+    elif type(data) is list:
+        for line in data:
+            md5.update(line)
+    else:
+        md5.update(data)
+    return md5.hexdigest()
+
+def journal_key(*values):
+    return hashlib.md5('\n'.join([str(x) for x in values])).hexdigest()
+
+
+class JobJournal(object):
+    """ Journal file shared by all connectors of process, journal is
+    disabled if datadir is not set """
+    lock = threading.Lock()
+
+    def __init__(self, dirname):
+        self.filename = None
+        if dirname:
+            self.filename = os.path.join(dirname, JOURNAL_FILE)
+
+    def load(self):
+        return load_json(self.filename)
+
+    def save(self, journal):
+        save_json(self.filename, journal)
+
+    def get(self, key):
+        if not self.filename:
+            return None
+        with JobJournal.lock:
+            return self.load().get(key)
+
+    def put(self, key, value):
+        if not self.filename:
+            return
+        with JobJournal.lock:
+            journal = self.load()
+            journal[key] = value
+            self.save(journal)
+
+    def remove(self, key):
+        if not self.filename:
+            return
+        with JobJournal.lock:
+            journal = self.load()
+            if key in journal:
+                del journal[key]
+                self.save(journal)
+
+
+class JournalEntry(object):
+    """ Job of single statement in journal. Batches are identified
+    by their index in statement data, which is the same on rerun. """
+
+    def __init__(self, journal, key):
+        self.journal = journal
+        self.key = key
+        self.lock = threading.Lock()
+        self.entry = journal.get(key) or {}
+
+    def __nonzero__(self):
+        return bool(self.entry)
+
+    def get(self, name, default=None):
+        return self.entry.get(name, default)
+
+    def put(self, **values):
+        with self.lock:
+            self.entry.update(values)
+            self.journal.put(self.key, self.entry)
+
+    def add_batch(self, idx, batch_id, records=None):
+        """ Save batch created for data batch number idx """
+        with self.lock:
+            self.entry.setdefault('batches', {})[str(idx)] = batch_id
+            if records is not None:
+                self.entry.setdefault('batch_records', {})[batch_id] = records
+            self.journal.put(self.key, self.entry)
+
+    def batch_id(self, idx):
+        return self.entry.get('batches', {}).get(str(idx))
+
+    def batch_ids(self):
+        """ Ids of created batches in order of data """
+        batches = self.entry.get('batches', {})
+        return [batches[x] for x in sorted(batches, key=int)]
+
+    def remove(self):
+        with self.lock:
+            self.entry = {}
+            self.journal.remove(self.key)
@@ -0,0 +1,162 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+""" Run job syntax items in parallel, respecting dependencies between
+items. Dependencies are the same csv / var relations which are used
+for graph creation, plus salesforce endpoint used by item."""
+
+__author__ = "Yaroslav Litvinov"
+
+import sys
+import threading
+from Queue import Queue
+from collections import namedtuple
+from logging import getLogger
+from mriya.graph import get_item_edges
+from mriya.sql_executor import SqlExecutor
+from mriya.job_syntax_extended import BATCH_KEY
+from mriya.job_syntax import *
+from mriya.log import LOG
+
+SchedulerNode = namedtuple('SchedulerNode',
+                           ['idx', 'item', 'reads', 'writes', 'barrier'])
+
+ENDPOINT_RESOURCE_FMT = 'endpoint:%s'
+
+def get_const_vars(items):
+    """ Return names of variables which may have csv table names inside """
+    return [x[VAR_KEY] for x in items if VAR_KEY in x and CONST_KEY in x]
+
+def get_defined_names(items):
+    names = []
+    for item_x in items:
+        for key in (VAR_KEY, CSV_KEY, NEW_IDS_TABLE):
+            if key in item_x:
+                names.append(item_x[key])
+    return names
+
+def create_scheduler_node(idx, item_x, endpoint_names, variables,
+                          const_vars):
+    """ Create node containing names of resources read and written
+    by item. Item can't be analysed statically if it's a batch loop,
+    uses variable with table name inside or some of item's resource
+    names are variable dependent. Such an item is a barrier. """
+    reads = set(get_item_edges(item_x))
+    writes = set()
+    for key in (VAR_KEY, CSV_KEY, NEW_IDS_TABLE):
+        if key in item_x:
+            writes.add(item_x[key])
+    # salesforce endpoint is exclusive resource
+    endpoints = []
+    if item_x.get(FROM_KEY) in (DST_KEY, SRC_KEY):
+        endpoints.append(item_x[FROM_KEY])
+    for key in (DST_KEY, SRC_KEY):
+        if key in item_x:
+            endpoints.append(key)
+    for endpoint in endpoints:
+        section = endpoint_names.get(endpoint, endpoint)
+        writes.add(ENDPOINT_RESOURCE_FMT % section)
+    # names having variables inside are resolved by known values
+    reads = set([SqlExecutor.prepare_query_put_vars(x, variables)
+                 for x in reads])
+    writes = set([SqlExecutor.prepare_query_put_vars(x, variables)
+                  for x in writes])
+    barrier = BATCH_KEY in item_x or BATCH_BEGIN_KEY in item_x
+    for name in reads | writes:
+        if name in const_vars or name.find('{') != -1:
+            barrier = True
+    return SchedulerNode(idx=idx, item=item_x, reads=reads,
+                         writes=writes, barrier=barrier)
+
+def node_depends_on(node, prev_node):
+    if node.barrier or prev_node.barrier:
+        return True
+    return bool(node.writes & (prev_node.reads | prev_node.writes)) or \
+        bool(node.reads & prev_node.writes)
+
+
+class JobScheduler(object):
+    """ Runs items of job controller by pool of worker threads.
+    Item is started only when all the items it depends on are completed,
+    independent items are running in file order as workers are available."""
+
+    def __init__(self, job_controller, workers):
+        self.job_controller = job_controller
+        self.workers = workers
+        self.completed = Queue()
+        items = [x for x in job_controller.job_syntax]
+        # variables which are assigned by job are not known beforehand
+        known_vars = dict(job_controller.variables)
+        for name in get_defined_names(items):
+            if name in known_vars:
+                del known_vars[name]
+        const_vars = get_const_vars(items)
+        self.nodes = [create_scheduler_node(
+            idx, item_x, job_controller.endpoints.endpoint_names,
+            known_vars, const_vars)
+                      for idx, item_x in enumerate(items)]
+        self.dependencies = {}
+        self.dependants = {}
+        for node in self.nodes:
+            self.dependencies[node.idx] = set()
+            self.dependants[node.idx] = set()
+            for prev_node in self.nodes[:node.idx]:
+                if node_depends_on(node, prev_node):
+                    self.dependencies[node.idx].add(prev_node.idx)
+                    self.dependants[prev_node.idx].add(node.idx)
+            getLogger(LOG).info('schedule item %d depends on %s',
+                                node.idx, sorted(self.dependencies[node.idx]))
+
+    def _run_node(self, node):
+        try:
+            self.job_controller.run_job_item(node.item)
+            self.completed.put((node.idx, None))
+        except:
+            self.completed.put((node.idx, sys.exc_info()))
+
+    def run(self):
+        waiting = [x.idx for x in self.nodes]
+        running = 0
+        error = None
+        while waiting or running:
+            if not error:
+                for idx in list(waiting):
+                    if running >= self.workers:
+                        break
+                    if self.dependencies[idx]:
+                        continue
+                    waiting.remove(idx)
+                    running += 1
+                    worker = threading.Thread(target=self._run_node,
+                                              args=(self.nodes[idx],))
+                    worker.daemon = True
+                    worker.start()
+            if not running:
+                break
+            idx, exc_info = self.completed.get()
+            running -= 1
+            if exc_info and not error:
+                error = exc_info
+            for dependant in self.dependants[idx]:
+                self.dependencies[dependant].discard(idx)
+        if error:
+            raise error[0], error[1], error[2]
@@ -51,15 +51,23 @@ OP_INSERT = 'insert'
 OP_UPSERT = 'upsert'
 OP_UPDATE = 'update'
 OP_DELETE = 'delete'
+OP_HARD_DELETE = 'hardDelete'
 OP_MERGE = 'merge'
 BATCH_TYPE_KEY = 'type'
 BATCH_TYPE_PARALLEL_KEY = 'parallel' #by default
 BATCH_TYPE_SEQUENTIAL_KEY = 'sequential'
 OBJNAME_KEY = 'objname'
 NEW_IDS_TABLE = 'new_ids_table'
+UPSERT_FIELD_KEY = 'upsert_field' # external id field of upsert
 CACHE_KEY = 'cache'
 REPLACE_KEY = 'replace'
 BATCH_SIZE_KEY = 'batch_size'
+BATCH_SIZE_AUTO = 'auto' # batch size is estimated by probe batch
+PKCHUNK_KEY = 'pkchunk' # value is chunk size or '' for default size
+RETRY_KEY = 'retry' # value is max count of retries of failed records
+RETRY_TYPE_KEY = 'retry_type' # 'sequential' \ 'parallel'
+GROUPBY_KEY = 'groupby' # records with same field value go to same batch
+REST_KEY = 'rest' # query is sent by REST API instead of Bulk API
 
 # only sqlite related
 CSVLIST_KEY = 'csvlist'
@@ -201,8 +209,9 @@ class JobSyntax(object):
             del values[CSVLIST_KEY]
         values[LINE_KEY] = line
         values[QUERY_KEY] = query
-        # var only supported by csv
-        if VAR_KEY in values:
+        # var is supported by csv and salesforce queries
+        if VAR_KEY in values and (CONST_KEY in values or
+                                  values.get(FROM_KEY) not in (DST_KEY, SRC_KEY)):
             values[FROM_KEY] = CSV_KEY
         return values
     
@@ -219,18 +228,32 @@ class JobSyntax(object):
             exit(1)
         if key == CSV_KEY:
             values[key] = val
-            if len(key_vals) > 2:
-                cache_flag = key_vals[2]
-                if cache_flag == CACHE_KEY:
+            flags = key_vals[2:]
+            while flags:
+                flag = flags.pop(0)
+                if flag == CACHE_KEY:
                     values[CACHE_KEY] = ''
+                elif flag == PKCHUNK_KEY:
+                    values[PKCHUNK_KEY] = ''
+                    # chunk size is optional
+                    if flags and flags[0].isdigit():
+                        values[PKCHUNK_KEY] = flags.pop(0)
         elif key == VAR_KEY:
             values[key] = val
             if len(key_vals) > 2:
                 flag = key_vals[2]
                 if flag == PUBLISH_KEY:
                     values[PUBLISH_KEY] = ''
-        elif key == NOPE_KEY or key == CONST_KEY or key == BATCH_TYPE_KEY:
+        elif key == NOPE_KEY or key == CONST_KEY or key == BATCH_TYPE_KEY \
+             or key == GROUPBY_KEY or key == REST_KEY:
+            values[key] = val
+        elif key == RETRY_KEY:
+            if not val.isdigit():
+                getLogger(STDERR).error('Bad retries count => retry:%s' % val)
+                exit(1)
             values[key] = val
+            if len(key_vals) > 2:
+                values[RETRY_TYPE_KEY] = key_vals[2]
         elif key == ASSERT_KEY:
             values[key] = val
             if val != ASSERT_ZERO and val != ASSERT_NONZERO:
@@ -240,6 +263,15 @@ class JobSyntax(object):
             objname_val = key_vals[2]
             values[OP_KEY] = val
             values[key] = objname_val
+            if val == OP_UPSERT:
+                # external id field goes after object name
+                if len(key_vals) < 6:
+                    getLogger(STDERR).error(
+                        "Upsert requires external id field: \
+%s:upsert:Object:ExtIdField:batch_size:result_table", key)
+                    exit(1)
+                values[UPSERT_FIELD_KEY] = key_vals[3]
+                key_vals = key_vals[:3] + key_vals[4:]
             if len(key_vals) >= 5:
                 values[BATCH_SIZE_KEY] = key_vals[3]
                 values[NEW_IDS_TABLE] = key_vals[4]
@@ -249,7 +281,7 @@ class JobSyntax(object):
                 assert(0)
             if not (val == OP_INSERT or val == OP_UPSERT or \
                     val == OP_DELETE or val == OP_UPDATE or \
-                    val == OP_MERGE):
+                    val == OP_HARD_DELETE or val == OP_MERGE):
                 getLogger(STDOUT).error("Bad operation %s" %val)
         elif key == BATCH_BEGIN_KEY:
             val2 = key_vals[2]
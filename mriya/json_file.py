@@ -0,0 +1,45 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+""" Json files shared by threads and processes, file is replaced at
+once by save, so readers never get it half written."""
+
+__author__ = "Yaroslav Litvinov"
+
+import os
+import json
+
+TMP_FILE_FMT = '%s.tmp'
+
+def load_json(filename):
+    """ Return data of json file, {} if file is absent or broken """
+    try:
+        with open(filename) as json_f:
+            return json.load(json_f)
+    except (IOError, ValueError):
+        return {}
+
+def save_json(filename, data):
+    tmp_filename = TMP_FILE_FMT % filename
+    with open(tmp_filename, 'w') as json_f:
+        json.dump(data, json_f)
+    os.rename(tmp_filename, filename)
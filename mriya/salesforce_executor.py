@@ -23,11 +23,14 @@ along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
 __author__ = "Yaroslav Litvinov"
 
 import time
+import itertools
 from logging import getLogger
 from mriya.sql_executor import SqlExecutor
 from mriya.job_syntax import QUERY_KEY, OBJNAME_KEY, CSV_KEY, VAR_KEY
 from mriya.job_syntax import CONST_KEY, DST_KEY, SRC_KEY, FROM_KEY
+from mriya.job_syntax import PKCHUNK_KEY, REST_KEY
 from mriya import bulk_data
+from mriya import sf_rest_query
 from mriya.log import loginit, STDOUT
 from mriya.sql_executor import var_replaced
 
@@ -67,23 +70,38 @@ class SalesforceExecutor(SqlExecutor):
         getLogger(STDOUT).info("Execute [%s.%s]: %s",
                                  instname, objname,
                                  self.get_query())
-        bulk_res = self.conn.bulk_load(objname, self.get_query())
-        self.handle_result(bulk_res)
+        if self.is_rest_query():
+            getLogger(STDOUT).info("Query by REST API")
+            self.conn.rest_load_stream(self.get_query(), self.handle_result)
+        else:
+            self.conn.bulk_load_stream(objname, self.get_query(),
+                                       self.handle_result,
+                                       self.job_syntax_item.get(PKCHUNK_KEY))
         t_after = time.time()
         getLogger(STDOUT).info('SF Took time: %.2f' % (t_after-t_before))
         retcode = 0
         return retcode
  
+    def is_rest_query(self):
+        """ Aggregate queries and queries limited to rest_query_max_rows
+        of endpoint are sent by REST API, unless PK chunking is requested """
+        if REST_KEY in self.job_syntax_item:
+            return True
+        return PKCHUNK_KEY not in self.job_syntax_item and \
+            sf_rest_query.is_small_query(
+                self.get_query(), self.conn.conn_param.rest_query_max_rows)
+
     def handle_result(self, bulk_res):
+        """ bulk_res -- iterable of result lines, w/o trailing newlines """
+        bulk_res = iter(bulk_res)
+        first_line = next(bulk_res, None)
         # handle empty result - fix it by adding column names
-        if bulk_res and bulk_res[0] == EMPTY_SF_RESPONSE:
+        if first_line is None or first_line == EMPTY_SF_RESPONSE:
             cols = SqlExecutor.get_query_columns(self.get_query())
             header = ','.join(cols)
             bulk_res = [header]
-
-        if len(bulk_res) > 1:
-            #ignore last empty results
-            bulk_res = bulk_res[:-1]
+        else:
+            bulk_res = itertools.chain([first_line], bulk_res)
 
         # handle result
         if CSV_KEY in self.job_syntax_item:
@@ -91,8 +109,7 @@ class SalesforceExecutor(SqlExecutor):
             csvfname = SqlExecutor.csv_name(csv_key_val)
             bulk_data.save_escape_csv_lines_as_csv_file(csvfname, bulk_res)
         elif VAR_KEY in self.job_syntax_item:
-            res = bulk_data.parse_batch_res_data(bulk_res)
+            res = bulk_data.parse_batch_res_data(list(bulk_res))
             if res.rows:
                 self.save_var(self.job_syntax_item[VAR_KEY],
                               res.rows[0][0])
-
@@ -0,0 +1,104 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+""" Cache of oauth tokens and logged in sessions shared by all
+connectors of the process and by concurrent processes. Cache file is
+locked while it's read and updated, login is done under the lock too,
+so endpoint is logged in only once and others are waiting to reuse
+its session."""
+
+__author__ = "Yaroslav Litvinov"
+
+import fcntl
+import threading
+from time import time
+from contextlib import contextmanager
+from mriya.json_file import load_json, save_json
+
+LOCK_FILE_FMT = '%s.lock'
+TOKEN_KEY = 'token'
+SESSIONID_KEY = 'sessionid'
+SERVER_URL_KEY = 'server_url'
+EXPIRES_KEY = 'expires'
+# session is not reused if it's expiring sooner, seconds
+EXPIRY_MARGIN = 300
+
+
+class SessionsCache(object):
+    """ Json file {username: {token, sessionid, server_url, expires}},
+    older format {username: token} is supported as well """
+    lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    @contextmanager
+    def locked(self):
+        """ Exclusive access to cache by threads and processes """
+        with SessionsCache.lock:
+            with open(LOCK_FILE_FMT % self.filename, 'a') as lock_f:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def load(self):
+        cache = load_json(self.filename)
+        if type(cache) is not dict:
+            return {}
+        for key, value in cache.items():
+            if type(value) is not dict:
+                cache[key] = {TOKEN_KEY: value}
+        return cache
+
+    def save(self, cache):
+        save_json(self.filename, cache)
+
+    def token(self, key, get_token):
+        """ Return cached token, get_token() is called if it's absent """
+        with self.locked():
+            cache = self.load()
+            entry = cache.setdefault(key, {})
+            if not entry.get(TOKEN_KEY):
+                entry[TOKEN_KEY] = get_token()
+                self.save(cache)
+            return entry[TOKEN_KEY]
+
+    def session(self, key, login, expired_sessionid=None):
+        """ Return (sessionid, server_url) of valid cached session.
+        If it's absent, expired or it's expired_sessionid then
+        login() is called, it returns (sessionid, server_url, seconds
+        valid) which are cached."""
+        with self.locked():
+            cache = self.load()
+            entry = cache.setdefault(key, {})
+            if entry.get(SESSIONID_KEY) and \
+               entry[SESSIONID_KEY] != expired_sessionid and \
+               entry.get(EXPIRES_KEY, 0) > time() + EXPIRY_MARGIN:
+                return entry[SESSIONID_KEY], entry[SERVER_URL_KEY]
+            sessionid, server_url, seconds_valid = login()
+            entry[SESSIONID_KEY] = sessionid
+            entry[SERVER_URL_KEY] = server_url
+            entry[EXPIRES_KEY] = time() + seconds_valid
+            self.save(cache)
+            return sessionid, server_url
@@ -0,0 +1,260 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+""" Salesforce connector using Bulk API 2.0. Salesforce splits
+uploaded data into batches itself, so all the data is sent by single
+request, query results are read by pages. Urls of statement jobs are
+kept in jobs journal until results are received, so rerun of
+interrupted statement reuses jobs which got all their data."""
+
+__author__ = "Yaroslav Litvinov"
+
+import sys
+import csv
+import json
+from StringIO import StringIO
+from logging import getLogger
+from time import sleep
+from sfbulk import BulkException
+from sfbulk.callout import StreamResponse
+from mriya import bulk_data
+from mriya import sf_bulk_connector
+from mriya.job_journal import JobJournal, JournalEntry
+from mriya.sql_executor import datadir
+from mriya.sf_bulk_connector import SfBulkConnector, is_csv_data
+from mriya.sf_bulk_connector import RESULT_HEADER, CONTENT_CSV
+from mriya.log import STDERR, LOG
+
+# query jobs, maxRecords and Sforce-Locator paging of Bulk API 2.0
+# are available since 47.0
+BULK2_API_VERSION = '47.0'
+# Bulk API 2.0 limit of uploaded data is 150MB after base64 encoding,
+# bigger data is uploaded by several jobs
+MAX_UPLOAD_BYTES = 100000000
+# max count of records in page of query result
+QUERY_PAGE_SIZE = 50000
+
+JOB_COMPLETE = 'JobComplete'
+JOB_DONE_STATES = (JOB_COMPLETE, 'Failed', 'Aborted')
+LOCATOR_HEADER = 'Sforce-Locator'
+NOT_PROCESSED_ERROR = 'Record was not processed'
+
+
+class SfBulk2Connector(SfBulkConnector):
+    """ Implements the same interface as Bulk API 1.0 connector.
+    Login and soap merge are done the same way. Batch size and
+    sequential type are ignored as salesforce is batching data itself."""
+
+    def __init__(self, conn_param, session=None, sessions_cache=None):
+        super(SfBulk2Connector, self).__init__(conn_param, session,
+                                               sessions_cache)
+        self.jobs_url = '%s/services/data/v%s/jobs' % (self.bulk.bulk_server,
+                                                       BULK2_API_VERSION)
+
+    def create_job(self, job_type, job):
+        resp = self.request('POST', '%s/%s' % (self.jobs_url, job_type),
+                            json.dumps(job))
+        job_url = '%s/%s/%s' % (self.jobs_url, job_type, resp.json()['id'])
+        getLogger(LOG).info('Bulk API 2.0 job created: %s', job_url)
+        return job_url
+
+    def abort_job(self, job_url):
+        try:
+            self.request('PATCH', job_url, json.dumps({'state': 'Aborted'}))
+        except BulkException:
+            pass
+
+    def wait_job2_completed(self, job_url):
+        """ Return job info of completed job """
+        timer = min(sf_bulk_connector.JOB_CHECK_TIMER_MIN,
+                    sf_bulk_connector.JOB_CHECK_TIMER)
+        while True:
+            info = self.request('GET', job_url).json()
+            if info['state'] in JOB_DONE_STATES:
+                return info
+            sleep(timer)
+            timer = min(timer * sf_bulk_connector.JOB_CHECK_TIMER_FACTOR,
+                        sf_bulk_connector.JOB_CHECK_TIMER)
+
+    def statement_entry(self, op, objname, soql_or_csv, *params):
+        """ Journal entry of statement, every job of statement is saved
+        as batch of entry by its index """
+        return JournalEntry(JobJournal(datadir()),
+                            self.statement_key(op, objname, soql_or_csv,
+                                               BULK2_API_VERSION, *params))
+
+    def bulk_common_(self, op, objname, soql_or_csv, max_batch_size,
+                     upsert_external_field=None, sequential=False,
+                     group_field=None):
+        job_entry = self.statement_entry(op, objname, soql_or_csv,
+                                         upsert_external_field)
+        try:
+            if not is_csv_data(soql_or_csv):
+                res = list(self.iter_query_lines(soql_or_csv, job_entry))
+            else:
+                res = [RESULT_HEADER]
+                reader = bulk_data.CsvBatchesReader(soql_or_csv,
+                                                    MAX_UPLOAD_BYTES)
+                uploads = iter(lambda: reader.read_batch(sys.maxint), None)
+                for idx, upload in enumerate(uploads):
+                    res.extend(self.ingest(op, objname, upload,
+                                           upsert_external_field,
+                                           job_entry, idx))
+            res.append('')
+            job_entry.remove()
+            return res
+        except:
+            # jobs are kept in journal only if process is interrupted
+            if isinstance(sys.exc_info()[1], Exception):
+                job_entry.remove()
+            raise
+
+    def ingest(self, op, objname, records, upsert_external_field,
+               job_entry, idx):
+        """ Run ingest job for list of header and records, job which got
+        all the records before interrupt is reused from journal entry.
+        Return result lines of records without header.
+        idx -- index of records upload in statement data"""
+        job_url = job_entry.batch_id(idx)
+        if job_url and idx not in job_entry.get('uploaded', []):
+            # upload of interrupted job could be incomplete
+            self.abort_job(job_url)
+            job_url = None
+        try:
+            if not job_url:
+                job = {'object': objname, 'operation': op,
+                       'contentType': 'CSV', 'lineEnding': 'LF'}
+                if upsert_external_field:
+                    job['externalIdFieldName'] = upsert_external_field
+                job_url = self.create_job('ingest', job)
+                job_entry.add_batch(idx, job_url)
+                self.request('PUT', '%s/batches' % job_url,
+                             ''.join([bulk_data.prepare_sf_data_to_send(x)
+                                      for x in records]),
+                             content_type=CONTENT_CSV)
+                self.request('PATCH', job_url,
+                             json.dumps({'state': 'UploadComplete'}))
+                job_entry.put(uploaded=job_entry.get('uploaded', []) + [idx])
+            else:
+                getLogger(LOG).info('Attach to job %s started before',
+                                    job_url)
+            info = self.wait_job2_completed(job_url)
+        except:
+            # job of interrupted process is left running
+            if job_url and isinstance(sys.exc_info()[1], Exception):
+                self.abort_job(job_url)
+            raise
+        error = NOT_PROCESSED_ERROR
+        if info['state'] != JOB_COMPLETE:
+            error = info.get('errorMessage') or info['state']
+            getLogger(STDERR).error('Job %s failed: %s', job_url, error)
+        return self.ingest_results(job_url, records, error)
+
+    @staticmethod
+    def result_line(sf_id, success, created, error):
+        return ','.join(['"%s"' % x.replace('"', '""') for x in
+                         (sf_id, success, created, error)])
+
+    def ingest_results(self, job_url, records, error):
+        """ Return result lines in order of records. Results order
+        isn't guaranteed by salesforce, so records are matched by
+        values which are returned along with results. Records without
+        result get an error."""
+        positions = {}
+        for pos, record in enumerate(records[1:]):
+            values = bulk_data.csv_record_values(
+                bulk_data.prepare_sf_data_to_send(record))
+            positions.setdefault(tuple(values), []).append(pos)
+        results = [None] * (len(records) - 1)
+        for results_name in ('successfulResults', 'failedResults'):
+            resp = self.request('GET', '%s/%s/' % (job_url, results_name),
+                                accept=CONTENT_CSV)
+            rows = csv.reader(StringIO(resp.content))
+            next(rows, None)
+            for row in rows:
+                matched = positions.get(tuple(row[2:]))
+                if not matched:
+                    getLogger(STDERR).error('Unknown result: %s', row)
+                    continue
+                if results_name == 'successfulResults':
+                    line = SfBulk2Connector.result_line(row[0], 'true',
+                                                        row[1], '')
+                else:
+                    line = SfBulk2Connector.result_line(row[0], 'false',
+                                                        'false', row[1])
+                results[matched.pop(0)] = line
+        not_processed = SfBulk2Connector.result_line('', 'false', 'false',
+                                                     error)
+        return [x or not_processed for x in results]
+
+    def iter_query_lines(self, soql, job_entry):
+        """ Generator of query result lines, pages of result are
+        requested one by one as lines are consumed. Query job is reused
+        from journal entry if it's there. """
+        job_url = job_entry.batch_id(0)
+        if job_url:
+            getLogger(LOG).info('Attach to job %s started before', job_url)
+        else:
+            job_url = self.create_job('query', {'operation': 'query',
+                                                'query': soql})
+            job_entry.add_batch(0, job_url)
+        info = self.wait_job2_completed(job_url)
+        if info['state'] != JOB_COMPLETE:
+            getLogger(STDERR).error('Job %s failed: %s', job_url,
+                                    info.get('errorMessage'))
+            raise BulkException('Bulk API 2.0 query failed')
+        locator = None
+        header = None
+        while True:
+            url = '%s/results?maxRecords=%d' % (job_url, QUERY_PAGE_SIZE)
+            if locator:
+                url += '&locator=%s' % locator
+            resp = self.request('GET', url, accept=CONTENT_CSV, stream=True)
+            # split by '\n' only, '\r' is a part of multiline values
+            lines = (x[:-1] if x.endswith('\n') else x
+                     for x in StreamResponse(resp))
+            # every page has header
+            page_header = next(lines, None)
+            if header is None and page_header:
+                header = page_header
+                yield header
+            for line in lines:
+                yield line
+            locator = resp.headers.get(LOCATOR_HEADER)
+            if not locator or locator == 'null':
+                break
+
+    def bulk_load_stream(self, objname, soql, handle_lines,
+                         pk_chunk_size=None):
+        """ Run query and pass iterator over result lines to handle_lines.
+        pk_chunk_size is ignored, as query is splitted by salesforce."""
+        if pk_chunk_size is not None:
+            getLogger(LOG).info('pkchunk is ignored by Bulk API 2.0')
+        job_entry = self.statement_entry('query', objname, soql)
+        try:
+            res = handle_lines(self.iter_query_lines(soql, job_entry))
+            job_entry.remove()
+            return res
+        except:
+            if isinstance(sys.exc_info()[1], Exception):
+                job_entry.remove()
+            raise
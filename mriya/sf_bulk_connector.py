@@ -20,27 +20,157 @@ along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
 
 __author__ = "Yaroslav Litvinov"
 
+import sys
+import json
+from itertools import islice
+from urllib import urlencode
+from Queue import Queue
+from threading import Thread
 from mriya import bulk_data
-from sfbulk import Bulk
+from mriya import sf_rest_query
+from mriya import sf_collections
+from sfbulk import Bulk, BulkException
+from sfbulk.callout import http_session, encoding_headers
 from logging import getLogger
 from time import sleep
 from mriya.base_connector import BaseBulkConnector
 from mriya.log import loginit, STDERR, STDOUT, LOG
+from mriya.job_syntax import BATCH_SIZE_AUTO
+from mriya.sql_executor import datadir
+from mriya.job_journal import JobJournal, JournalEntry
+from mriya.job_journal import journal_key, data_fingerprint
 from mriya.sf_merge_wrapper import SfSoapMergeWrapper
 from mriya.bulk_data import get_stream_from_csv_rows_list, get_bulk_data_from_csv_stream
 from mriya.bulk_data import csv_from_bulk_data
 
+# job status is checked with growing interval, starting from minimal
+# one for small jobs, up to JOB_CHECK_TIMER seconds
 JOB_CHECK_TIMER = 5
+JOB_CHECK_TIMER_MIN = 0.5
+JOB_CHECK_TIMER_FACTOR = 1.5
+# Bulk API limit of records count in batch
+MAX_BATCH_SIZE = 10000
+# auto batch size: size of probe batch, limits of estimated batch size
+# and target batch processing time, ms.
+AUTO_PROBE_SIZE = 200
+AUTO_MIN_BATCH_SIZE = 200
+AUTO_TARGET_BATCH_TIME = 60000
+LOCK_ERROR = 'UNABLE_TO_LOCK_ROW'
+# errors of records which may succeed being sent again
+RETRYABLE_ERRORS = [LOCK_ERROR, 'timeout', 'timed out']
+# failed records are retried after growing interval, seconds
+RETRY_TIMER = 5
+RETRY_TIMER_FACTOR = 2
+RESULT_HEADER = '"Id","Success","Created","Error"'
+# max count of batches results / query result chunks downloaded
+# concurrently
+RESULT_DOWNLOAD_THREADS = 4
+REST_API_VERSION = '41.0'
+CONTENT_JSON = 'application/json'
+CONTENT_CSV = 'text/csv'
+SESSION_EXPIRED_STATUS = 401
+
+def is_csv_data(data):
+    """ csv data is list of lines or opened csv file, query is a string """
+    return type(data) is list or isinstance(data, file)
 
 class SfBulkConnector(BaseBulkConnector):
 
-    def __init__(self, conn_param):
+    def __init__(self, conn_param, session=None, sessions_cache=None):
         super(SfBulkConnector, self).__init__(conn_param)
-        self.bulk = Bulk(self.instance_url)
+        self.bulk = Bulk(self.instance_url,
+                         max_requests=self.conn_param.concurrent_requests,
+                         session=session or http_session(conn_param.pool_size),
+                         timeout=self.conn_param.timeout,
+                         compress=self.conn_param.compression)
+        self.sessions_cache = sessions_cache
+        if sessions_cache:
+            self.bulk.login_handler = self.login
+        self.login()
+        # {batch_id: records count} of dml batches of current job
+        self.batch_records = {}
+        # (operation, object, external id field, concurrency mode) of
+        # job kept opened across statements in job session mode
+        self.session_job = None
+
+    def bulk_login(self):
         self.bulk.login(username=self.conn_param.username,
                         password=self.conn_param.password,
                         security_token=self.conn_param.token,
                         sandbox=not self.conn_param.production)
+        return (self.bulk.sessionid, self.bulk.soap_server,
+                self.bulk.session_seconds_valid)
+
+    def login(self, expired_sessionid=None):
+        """ Use valid session of endpoint shared by connectors,
+        log in only if it's absent or expired_sessionid is cached """
+        if not self.sessions_cache:
+            self.bulk_login()
+            return
+        sessionid, server_url = self.sessions_cache.session(
+            self.conn_param.username, self.bulk_login, expired_sessionid)
+        self.bulk.set_session(sessionid, server_url)
+
+    def request(self, method, url, data=None, content_type=CONTENT_JSON,
+                accept=CONTENT_JSON, stream=False):
+        """ Request to REST API authorized by session id of bulk.
+        Request is sent again after login if session is expired."""
+        data, encoding = encoding_headers(data, self.conn_param.compression)
+        for attempt in xrange(2):
+            sessionid = self.bulk.sessionid
+            headers = {'Authorization': 'Bearer %s' % sessionid,
+                       'Content-Type': content_type,
+                       'Accept': accept}
+            headers.update(encoding)
+            resp = self.bulk.session.request(method, url, data=data,
+                                             headers=headers, stream=stream,
+                                             timeout=self.conn_param.timeout)
+            if resp.status_code != SESSION_EXPIRED_STATUS or attempt:
+                break
+            self.bulk.relogin(sessionid)
+        if resp.status_code >= 300:
+            getLogger(STDERR).error('%s %s: %d %s', method, url,
+                                    resp.status_code, resp.content)
+            raise BulkException('Salesforce request failed: %d' %
+                                resp.status_code)
+        return resp
+
+    def close_job(self):
+        # job attached from journal could be closed before crash
+        if self.bulk.jobinfo.state == Bulk.CLOSED:
+            self.bulk.jobinfo = None
+        else:
+            self.bulk.job_close()
+
+    def statement_key(self, op, objname, soql_or_csv, *params):
+        """ Key of statement in jobs journal """
+        return journal_key(self.instance_url, self.conn_param.username,
+                           op, objname, data_fingerprint(soql_or_csv),
+                           *params)
+
+    def attach_job(self, op, objname, job_entry, pk_chunk_size=None):
+        """ Attach to job of journal entry and its created batches """
+        self.close_job_session()
+        getLogger(STDOUT).info('Attach to job %s started before',
+                               job_entry.get('job_id'))
+        self.bulk.job_attach(op, objname, job_entry.get('job_id'),
+                             job_entry.batch_ids(), pk_chunk_size)
+        self.batch_records = dict(job_entry.get('batch_records', {}))
+
+    def interrupted_job(self, job_entry):
+        """ Finish job of failed statement. Job of interrupted process
+        is kept running in journal to be attached by rerun."""
+        self.session_job = None
+        if isinstance(sys.exc_info()[1], Exception):
+            job_entry.remove()
+            if self.bulk.jobinfo and self.bulk.jobinfo.id:
+                self.close_job()
+
+    def close_job_session(self):
+        """ Close job kept opened by job session """
+        if self.session_job:
+            self.session_job = None
+            self.bulk.job_close()
 
     def handle_batch_error(self, batch_id):
         """ Handle bulk error, when no records processed """
@@ -55,6 +185,12 @@ class SfBulkConnector(BaseBulkConnector):
                 getLogger(STDERR).error('%s bachFailed %s',
                                         batch_id, errmes)
 
+    def wait_job_completed(self):
+        timer = min(JOB_CHECK_TIMER_MIN, JOB_CHECK_TIMER)
+        while not self.bulk.job_is_completed():
+            sleep(timer)
+            timer = min(timer * JOB_CHECK_TIMER_FACTOR, JOB_CHECK_TIMER)
+
     def handle_op_returning_ids(self, opname, objname, res, merge=False):
         if not merge:
             result_ids = bulk_data.parse_batch_res_data(res)
@@ -90,22 +226,160 @@ class SfBulkConnector(BaseBulkConnector):
             batches.append((batch_begin,batch_end))
         return batches
 
-    def dispatch_batch(self, batch_range, whole_data):
-        header = whole_data[0]
-        batch_data = [header]
-        one_batch_data = whole_data[batch_range[0]+1:
-                                    batch_range[1]+2]
-        for one_line in one_batch_data:
-            batch_data.append(
+    @staticmethod
+    def iter_batches(csv_data, max_batch_size, group_field=None):
+        """ Generator of batches, every batch is a list of header and
+        data records. Batches are filled up to max_batch_size records
+        or up to Bulk API limit of batch data size. csv_data is either
+        a list of lines or opened csv file, which is read lazily one
+        batch at a time. Records grouped by group_field are kept in
+        the same batch."""
+        return bulk_data.iter_csv_batches(csv_data, max_batch_size,
+                                          group_field=group_field)
+
+    def dispatch_batch(self, batch_data):
+        header = batch_data[0]
+        send_data = [header]
+        for one_line in batch_data[1:]:
+            send_data.append(
                 bulk_data.prepare_sf_data_to_send(one_line))
         # create batch
-        batch_id = self.bulk.batch_create(''.join(batch_data))
+        batch_id = self.bulk.batch_create(''.join(send_data))
+        self.batch_records[batch_id] = len(batch_data) - 1
         return batch_id
-        
+
+    def dispatch_batches(self, batches, threads, dispatch=None):
+        """ Create batches of job concurrently by threads count.
+        Data is read not faster than it's sent.
+        Return batch ids in order of data.
+        dispatch -- function sending batch, dispatch_batch by default"""
+        dispatch = dispatch or self.dispatch_batch
+        if threads <= 1:
+            return [dispatch(x) for x in batches]
+        tasks = Queue(maxsize=threads)
+        batch_ids = {}
+        errors = []
+
+        def upload():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                idx, batch_data = task
+                try:
+                    if not errors:
+                        batch_ids[idx] = dispatch(batch_data)
+                except:
+                    errors.append(sys.exc_info())
+
+        uploaders = [Thread(target=upload) for _ in xrange(threads)]
+        for uploader in uploaders:
+            uploader.daemon = True
+            uploader.start()
+        try:
+            for idx, batch_data in enumerate(batches):
+                if errors:
+                    break
+                tasks.put((idx, batch_data))
+        finally:
+            for _ in uploaders:
+                tasks.put(None)
+            for uploader in uploaders:
+                uploader.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return [batch_ids[x] for x in sorted(batch_ids.keys())]
+
+    def dispatch_journaled(self, batches, threads, job_entry, first_idx=0):
+        """ Create batches which are not in journal entry yet, every
+        batch is journaled as soon as it's created.
+        Return ids of all the batches of entry in order of data.
+        first_idx -- index of first of batches in statement data"""
+        def dispatch(task):
+            idx, batch_data = task
+            batch_id = self.dispatch_batch(batch_data)
+            job_entry.add_batch(idx, batch_id,
+                                self.batch_records.get(batch_id))
+            return batch_id
+        pending = ((idx, x) for idx, x in enumerate(batches, first_idx)
+                   if job_entry.batch_id(idx) is None)
+        self.dispatch_batches(pending, threads, dispatch)
+        return job_entry.batch_ids()
+
+    def dispatch_auto_batches(self, csv_data, threads, group_field=None,
+                              job_entry=None):
+        """ Create probe batch and wait for its completion, then create
+        rest of batches using size estimated by probe batch. Estimated
+        size is journaled, so data is splitted the same way on rerun."""
+        job_entry = job_entry or JournalEntry(JobJournal(None), None)
+        reader = bulk_data.CsvBatchesReader(csv_data,
+                                            group_field=group_field)
+        probe_batch = reader.read_batch(AUTO_PROBE_SIZE)
+        if not probe_batch:
+            return []
+        self.dispatch_journaled([probe_batch], 1, job_entry)
+        batch_size = job_entry.get('batch_size')
+        if not batch_size:
+            probe_id = job_entry.batch_id(0)
+            self.wait_job_completed()
+            # get batch processing time
+            self.bulk.updateBatchStatus(self.bulk.jobinfo, probe_id)
+            probe_info = self.bulk.jobinfo.batch[probe_id]
+            lock_errors = len(
+                [x for x in self.bulk.batch_result_by_id(probe_id)
+                 if x.find(LOCK_ERROR) != -1])
+            batch_size = SfBulkConnector.estimate_batch_size(probe_info,
+                                                             lock_errors)
+            getLogger(LOG).info("Probe batch %s: %s, lock errors: %d, \
+estimated batch size: %d", probe_id, probe_info, lock_errors, batch_size)
+            job_entry.put(batch_size=batch_size)
+        batches = iter(lambda: reader.read_batch(batch_size), None)
+        return self.dispatch_journaled(batches, threads, job_entry, 1)
+
+    @staticmethod
+    def estimate_batch_size(batch_info, lock_errors):
+        """ Estimate size of batch processed by AUTO_TARGET_BATCH_TIME
+        using processing time of completed batch. Failed records are
+        processed quickly, so time is divided by succeeded records only.
+        Size is decreased by rate of records lock errors in batch, as
+        locks contention is growing with batch size. """
+        processed = int(batch_info.get('numberRecordsProcessed', 0))
+        failed = int(batch_info.get('numberRecordsFailed', 0))
+        processing_time = int(batch_info.get('totalProcessingTime', 0))
+        if batch_info.get('state') == Bulk.FAILED or not processed:
+            return AUTO_MIN_BATCH_SIZE
+        succeeded = max(processed - failed, 1)
+        if processing_time:
+            batch_size = AUTO_TARGET_BATCH_TIME * succeeded / processing_time
+        else:
+            batch_size = MAX_BATCH_SIZE
+        if lock_errors:
+            lock_errors = min(lock_errors, processed)
+            batch_size = batch_size * (processed - lock_errors) / processed
+        return max(AUTO_MIN_BATCH_SIZE, min(batch_size, MAX_BATCH_SIZE))
+
+    def failed_batch_result(self, batch_id):
+        """ Result of failed batch, records which weren't processed
+        get the error of batch. So result lines always match data."""
+        info = self.bulk.jobinfo.batch[batch_id]
+        one_res = [RESULT_HEADER]
+        if int(info.get('numberRecordsProcessed', 0)):
+            one_res = [x for x in self.bulk.batch_result_by_id(batch_id) if x]
+        error = '"","false","false","%s"' % \
+            info.get('stateMessage', '').replace('"', '""')
+        unprocessed = self.batch_records[batch_id] - (len(one_res) - 1)
+        return one_res + [error] * unprocessed + ['']
+
+    def is_failed_batch(self, batch_id):
+        return batch_id in self.batch_records and \
+            self.bulk.jobinfo.findBatchState(batch_id) == Bulk.FAILED
 
     def batch_result(self, batch_id, batch_data_is_exist):
         self.handle_batch_error(batch_id)
-        one_res = self.bulk.batch_result()[batch_id]
+        if self.is_failed_batch(batch_id):
+            one_res = self.failed_batch_result(batch_id)
+        else:
+            one_res = self.bulk.batch_result_by_id(batch_id)
         # get rid from empty line, add this at the end
         if one_res[-1] == '':
             one_res = one_res[:-1]
@@ -117,116 +391,263 @@ class SfBulkConnector(BaseBulkConnector):
         else:
             return []
 
-    def bulk_seq_common_(self, op, objname, soql_or_csv, max_batch_size,
-                         upsert_external_field=None):
-        batch_res = []
-        try:
-            # create job
-            self.bulk.job_create(op, objname, upsert_external_field)
-            
-            lines_count = -1
-            if type(soql_or_csv) is list:
-                if len(soql_or_csv) > 1:
-                    lines_count = len(soql_or_csv) - 1
-                    batch_ranges = SfBulkConnector.batch_ranges(lines_count,
-                                                                max_batch_size)
-                    getLogger(LOG).info("Lines: %d, max_batch_size: %s seq batches cnt %d",
-                                        lines_count, str(max_batch_size), len(batch_ranges))
-
-                    for batch_range in batch_ranges:
-                        batch_id = self.dispatch_batch(batch_range, soql_or_csv)
-                        # wait until job is completed
-                        while (not self.bulk.job_is_completed()):
-                            sleep(5)
-                        batch_res.extend(self.batch_result(batch_id,
-                                                           len(batch_res)))
-            else: #query
-                raise Exception('bulk_common_ must be used for op:query')
-
-            # last salesforce result line is always empty
-            if batch_res[-1] != '':
-                batch_res.append('')
-            self.bulk.job_close()
-            return batch_res
-        except:
-            if self.bulk.jobinfo and self.bulk.jobinfo.id:
-                self.bulk.job_close()
-            raise
-
-
     def bulk_common_(self, op, objname, soql_or_csv, max_batch_size,
-                     upsert_external_field=None):
+                     upsert_external_field=None, sequential=False,
+                     group_field=None):
         batch_res = []
+        # batches of serial job are processed by salesforce one by one,
+        # in order of creation
+        concurrency_mode = None
+        if sequential:
+            concurrency_mode = Bulk.SERIAL
+        # in job session mode batches of sequent dml statements are
+        # added to the same job, job is closed by another statement
+        job_key = (op, objname, upsert_external_field, concurrency_mode)
+        session = self.conn_param.job_session and is_csv_data(soql_or_csv)
+        # job of statement is saved into journal until results received
+        job_entry = JournalEntry(JobJournal(datadir()),
+                                 self.statement_key(op, objname, soql_or_csv,
+                                                    upsert_external_field,
+                                                    concurrency_mode))
         try:
-            # create job
-            self.bulk.job_create(op, objname, upsert_external_field)
-            
-            batch_ids = []
-            lines_count = -1
-            if type(soql_or_csv) is list:
-                if len(soql_or_csv) > 1:
-                    lines_count = len(soql_or_csv) - 1
-                    batch_ranges = SfBulkConnector.batch_ranges(lines_count,
-                                                                max_batch_size)
-                    for batch_range in batch_ranges:
-                        batch_id = self.dispatch_batch(batch_range, soql_or_csv)
-                        batch_ids.append(batch_id)
-            else: #query
-                batch_id = self.bulk.batch_create(soql_or_csv)
-                batch_ids.append(batch_id)
-        
-            getLogger(LOG).info("Lines: %d, max_batch_size: %s batches %s",
-                                     lines_count, str(max_batch_size), batch_ids)
-            # wait until job is completed
-            while (not self.bulk.job_is_completed()):
-                sleep(JOB_CHECK_TIMER)
+            if job_entry:
+                session = False
+                self.attach_job(op, objname, job_entry)
+            else:
+                if not session or self.session_job != job_key:
+                    self.close_job_session()
+                    self.batch_records = {}
+                    self.bulk.job_create(op, objname, upsert_external_field,
+                                         concurrency_mode=concurrency_mode)
+                    if session:
+                        self.session_job = job_key
+                job_entry.put(job_id=self.bulk.jobinfo.id)
+            # batches missing in journal are created
+            if not is_csv_data(soql_or_csv): #query
+                if job_entry.batch_id(0) is None:
+                    job_entry.add_batch(0, self.bulk.batch_create(soql_or_csv))
+                batch_ids = job_entry.batch_ids()
+            else:
+                if sequential:
+                    threads = 1
+                else:
+                    threads = self.conn_param.concurrent_requests
+                if max_batch_size == BATCH_SIZE_AUTO:
+                    batch_ids = self.dispatch_auto_batches(
+                        soql_or_csv, threads, group_field, job_entry)
+                else:
+                    batch_ids = self.dispatch_journaled(
+                        SfBulkConnector.iter_batches(
+                            soql_or_csv, max_batch_size, group_field),
+                        threads, job_entry)
+
+            getLogger(LOG).info("max_batch_size: %s batches %s",
+                                str(max_batch_size), batch_ids)
+            # wait until job is completed, batches of previous
+            # statements of job session are completed already
+            self.wait_job_completed()
 
+            # download all results at once, they are cached by bulk
+            self.bulk.batches_result(
+                [x for x in batch_ids if not self.is_failed_batch(x)],
+                RESULT_DOWNLOAD_THREADS)
             for batch_id in batch_ids:
                 batch_res.extend(self.batch_result(batch_id, len(batch_res)))
             # last salesforce result line is always empty
             if batch_res[-1] != '':
                 batch_res.append('')
-            self.bulk.job_close()
+            if session:
+                # don't keep results of statement in opened job
+                for batch_id in batch_ids:
+                    self.bulk.jobinfo.batch_result.pop(batch_id, None)
+            else:
+                self.close_job()
+            job_entry.remove()
             return batch_res
         except:
-            if self.bulk.jobinfo and self.bulk.jobinfo.id:
-                self.bulk.job_close()
+            self.interrupted_job(job_entry)
             raise
 
-    def bulk_common(self, op, objname, soql_or_csv, max_batch_size,
-                    sequential, upsert_external_field=None):
-        if type(soql_or_csv) is list and sequential:
-            return self.bulk_seq_common_(
-                op, objname, soql_or_csv, max_batch_size,
-                upsert_external_field)
+    def small_dml_records(self, csv_data):
+        """ Return list of header and records if count of records
+        is below rest_dml_threshold, otherwise None """
+        threshold = self.conn_param.rest_dml_threshold
+        if not threshold:
+            return None
+        records = list(islice(bulk_data.iter_csv_records(csv_data),
+                              threshold + 1))
+        if isinstance(csv_data, file):
+            csv_data.seek(0)
+        if len(records) <= threshold:
+            return records
+        return None
+
+    def collections_request(self, op, objname, records,
+                            upsert_external_field):
+        """ Send list of header and records by single sObject
+        Collections request, return result lines of records """
+        url = '%s/services/data/v%s/composite/sobjects' % (
+            self.bulk.bulk_server, sf_collections.COLLECTIONS_API_VERSION)
+        data = None
+        if op == 'delete':
+            url += '?' + urlencode(
+                {'ids': ','.join(sf_collections.record_ids(records)),
+                 'allOrNone': 'false'})
         else:
-            return self.bulk_common_(
-                op, objname, soql_or_csv, max_batch_size,
-                upsert_external_field)
+            if op == 'upsert':
+                url += '/%s/%s' % (objname, upsert_external_field)
+            data = json.dumps(
+                {'allOrNone': False,
+                 'records': sf_collections.json_records(objname, records)})
+        results = self.request(sf_collections.OPS_METHODS[op], url,
+                               data).json()
+        return [sf_collections.result_line(op, x) for x in results]
+
+    def collections_dml(self, op, objname, records, upsert_external_field,
+                        sequential, group_field):
+        """ Send records by sObject Collections requests, several
+        requests are running concurrently unless sequential.
+        Return result lines in the same format as bulk has."""
+        getLogger(LOG).info('%s %s: %d records by sObject Collections',
+                            op, objname, len(records) - 1)
+        threads = self.conn_param.concurrent_requests
+        if sequential:
+            threads = 1
+        chunks = bulk_data.iter_csv_batches(
+            records, sf_collections.COLLECTIONS_SIZE,
+            group_field=group_field)
+        res = [RESULT_HEADER]
+        for chunk_res in self.dispatch_batches(
+                chunks, threads,
+                lambda x: self.collections_request(op, objname, x,
+                                                   upsert_external_field)):
+            res.extend(chunk_res)
+        res.append('')
+        return res
 
-    def bulk_insert(self, objname, csv_data, max_batch_size, seq):
+    def dml_common_(self, op, objname, soql_or_csv, max_batch_size,
+                    upsert_external_field=None, sequential=False,
+                    group_field=None):
+        """ Small dml statements are sent by sObject Collections,
+        other statements and queries by bulk job """
+        records = None
+        if is_csv_data(soql_or_csv) and op in sf_collections.OPS_METHODS:
+            records = self.small_dml_records(soql_or_csv)
+        if records:
+            return self.collections_dml(op, objname, records,
+                                        upsert_external_field, sequential,
+                                        group_field)
+        return self.bulk_common_(op, objname, soql_or_csv, max_batch_size,
+                                 upsert_external_field, sequential,
+                                 group_field)
+
+    def bulk_common(self, op, objname, soql_or_csv, max_batch_size,
+                    sequential, upsert_external_field=None,
+                    retries=0, retry_seq=False, group_field=None):
+        sequential = is_csv_data(soql_or_csv) and sequential
+        res = self.dml_common_(op, objname, soql_or_csv, max_batch_size,
+                               upsert_external_field, sequential,
+                               group_field)
+        if retries and is_csv_data(soql_or_csv):
+            res = self.retry_failed_records(
+                op, objname, soql_or_csv, res, max_batch_size,
+                upsert_external_field, sequential or retry_seq, retries,
+                group_field)
+        return res
+
+    @staticmethod
+    def is_retryable(fields, row):
+        if row[fields.index('Success')] == 'true':
+            return False
+        error = row[fields.index('Error')].lower()
+        return bool([x for x in RETRYABLE_ERRORS if x.lower() in error])
+
+    def retry_failed_records(self, op, objname, csv_data, res, max_batch_size,
+                             upsert_external_field, sequential, retries,
+                             group_field=None):
+        """ Send records failed by retryable errors again, up to retries
+        times with growing interval. Only failed records are sent, so
+        they're collected in memory. Return results of all records,
+        every record has result of its last attempt."""
+        if isinstance(csv_data, file):
+            csv_data.seek(0)
+        records = bulk_data.iter_csv_records(csv_data)
+        header = next(records)
+        results = [x for x in res if x]
+        positions = range(len(results) - 1)
+        retry_records = None
+        attempt_res = results
+        timer = RETRY_TIMER
+        for attempt in xrange(retries):
+            attempt_ids = bulk_data.parse_batch_res_data(attempt_res)
+            positions = [pos for pos, row in zip(positions, attempt_ids.rows)
+                         if SfBulkConnector.is_retryable(attempt_ids.fields,
+                                                         row)]
+            if not positions:
+                break
+            if retry_records is None:
+                # read failed records from source data only once
+                positions_set = set(positions)
+                retry_records = dict([x for x in enumerate(records)
+                                      if x[0] in positions_set])
+            getLogger(STDOUT).info('Retry %d of %d: %s %s, %d records',
+                                   attempt + 1, retries, op, objname,
+                                   len(positions))
+            sleep(timer)
+            timer *= RETRY_TIMER_FACTOR
+            retry_data = [header] + [retry_records[x] for x in positions]
+            attempt_res = [x for x in self.dml_common_(
+                op, objname, retry_data, max_batch_size,
+                upsert_external_field, sequential, group_field) if x]
+            for pos, line in zip(positions, attempt_res[1:]):
+                results[pos + 1] = line
+        results.append('')
+        return results
+
+    def bulk_insert(self, objname, csv_data, max_batch_size, seq,
+                    retries=0, retry_seq=False, group_field=None):
         res = self.bulk_common('insert', objname, csv_data,
-                                max_batch_size, seq)
+                               max_batch_size, seq,
+                               retries=retries, retry_seq=retry_seq,
+                               group_field=group_field)
         self.handle_op_returning_ids('insert', objname, res, False)
         return res
 
-    # not supported yet
-    # def bulk_upsert(self, objname, csv_data, max_batch_size, seq,
-    #                 upsert_external_field):
-    #     res = self.bulk_common('upsert', objname, csv_data,
-    #                             upsert_external_field)
-    #     self.handle_op_returning_ids('upsert', objname, res, False)
-    #     return res
+    def bulk_upsert(self, objname, csv_data, max_batch_size, seq,
+                    upsert_external_field, retries=0, retry_seq=False,
+                    group_field=None):
+        res = self.bulk_common('upsert', objname, csv_data,
+                               max_batch_size, seq, upsert_external_field,
+                               retries=retries, retry_seq=retry_seq,
+                               group_field=group_field)
+        self.handle_op_returning_ids('upsert', objname, res, False)
+        return res
 
-    def bulk_delete(self, objname, csv_data, max_batch_size, seq):
+    def bulk_delete(self, objname, csv_data, max_batch_size, seq,
+                    retries=0, retry_seq=False, group_field=None):
         res = self.bulk_common('delete', objname, csv_data,
-                                max_batch_size, seq)
+                               max_batch_size, seq,
+                               retries=retries, retry_seq=retry_seq,
+                               group_field=group_field)
         self.handle_op_returning_ids('delete', objname, res, False)
         return  res
 
-    def bulk_update(self, objname, csv_data, max_batch_size, seq):
+    def bulk_hard_delete(self, objname, csv_data, max_batch_size, seq,
+                         retries=0, retry_seq=False, group_field=None):
+        """ Delete records bypassing recycle bin """
+        res = self.bulk_common('hardDelete', objname, csv_data,
+                               max_batch_size, seq,
+                               retries=retries, retry_seq=retry_seq,
+                               group_field=group_field)
+        self.handle_op_returning_ids('hardDelete', objname, res, False)
+        return  res
+
+    def bulk_update(self, objname, csv_data, max_batch_size, seq,
+                    retries=0, retry_seq=False, group_field=None):
         res = self.bulk_common('update', objname, csv_data,
-                                max_batch_size, seq)
+                               max_batch_size, seq,
+                               retries=retries, retry_seq=retry_seq,
+                               group_field=group_field)
         self.handle_op_returning_ids('update', objname, res, False)
         return res
 
@@ -234,8 +655,75 @@ class SfBulkConnector(BaseBulkConnector):
         res = self.bulk_common('query', objname, soql, None, None)
         return res
 
+    def bulk_load_stream(self, objname, soql, handle_lines,
+                         pk_chunk_size=None):
+        """ Run query and pass iterator over result lines to handle_lines,
+        result lines are read from http response as handler consumes them.
+        Return value of handle_lines is returned.
+        pk_chunk_size -- enable PK chunking, '' means default chunk size"""
+        self.close_job_session()
+        job_entry = JournalEntry(JobJournal(datadir()),
+                                 self.statement_key('query', objname, soql,
+                                                    pk_chunk_size))
+        try:
+            if job_entry:
+                self.attach_job('query', objname, job_entry, pk_chunk_size)
+            else:
+                self.bulk.job_create('query', objname,
+                                     pk_chunk_size=pk_chunk_size)
+                job_entry.put(job_id=self.bulk.jobinfo.id)
+            if job_entry.batch_id(0) is None:
+                batch_id = self.bulk.batch_create(soql)
+                getLogger(LOG).info("Query batch %s", batch_id)
+                job_entry.add_batch(0, batch_id)
+            self.wait_job_completed()
+            # results of PK chunking are in batches created by server
+            batch_ids = self.bulk.processed_batches()
+            if pk_chunk_size is not None:
+                getLogger(LOG).info("PK chunking batches %s", batch_ids)
+            for one_batch_id in batch_ids:
+                self.handle_batch_error(one_batch_id)
+            res = handle_lines(
+                self.bulk.iterBatchesResult(self.bulk.jobinfo, batch_ids,
+                                            RESULT_DOWNLOAD_THREADS))
+            self.close_job()
+            job_entry.remove()
+            return res
+        except:
+            self.interrupted_job(job_entry)
+            raise
+
+    def iter_rest_query_lines(self, soql):
+        """ Generator of query result lines in format of bulk query
+        result, pages of REST query result are requested one by one."""
+        columns = sf_rest_query.query_columns(soql)
+        yield sf_rest_query.csv_line(columns)
+        url = '%s/services/data/v%s/query?%s' % (
+            self.bulk.bulk_server, REST_API_VERSION, urlencode({'q': soql}))
+        while url:
+            page = sf_rest_query.parse_page(self.request('GET', url))
+            if columns == [sf_rest_query.COUNT_COLUMN]:
+                # count() query returns no records, just count
+                yield sf_rest_query.csv_line([page['totalSize']])
+                break
+            for record in page['records']:
+                yield sf_rest_query.csv_line(
+                    [sf_rest_query.record_value(record, x) for x in columns])
+            url = None
+            if not page['done']:
+                url = self.bulk.bulk_server + page['nextRecordsUrl']
+
+    def rest_load_stream(self, soql, handle_lines):
+        """ Run query by REST API, pass iterator over result lines
+        to handle_lines, return value of handle_lines is returned. """
+        self.close_job_session()
+        return handle_lines(self.iter_rest_query_lines(soql))
+
     def soap_merge(self, objname, csv_data, max_chunk_size):
-        istream = get_stream_from_csv_rows_list(csv_data)
+        if type(csv_data) is list:
+            istream = get_stream_from_csv_rows_list(csv_data)
+        else:
+            istream = csv_data
         data = get_bulk_data_from_csv_stream(istream)
         # run
         merge_engine = SfSoapMergeWrapper(self, objname, data, max_chunk_size)
@@ -0,0 +1,84 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+
+""" Helpers of REST API sObject Collections, used for small dml
+statements instead of Bulk API job. Csv records are converted into
+json records, json results are converted into result lines of the
+same format as Bulk API batch results have."""
+
+__author__ = "Yaroslav Litvinov"
+
+from mriya import bulk_data
+
+# max count of records of single sObject Collections request
+COLLECTIONS_SIZE = 200
+# upsert by sObject Collections is available since 46.0
+COLLECTIONS_API_VERSION = '46.0'
+OPS_METHODS = {'insert': 'POST', 'update': 'PATCH', 'upsert': 'PATCH',
+               'delete': 'DELETE'}
+SF_NULL_VALUE = '#N/A'
+
+def json_records(objname, csv_records):
+    """ Convert list of header and csv records into json records.
+    As in bulk data empty value isn't sent, '#N/A' is null and field
+    like 'Account.ExtId__c' is a reference by external id."""
+    fields = bulk_data.csv_record_values(
+        bulk_data.prepare_sf_data_to_send(csv_records[0]))
+    records = []
+    for csv_record in csv_records[1:]:
+        values = bulk_data.csv_record_values(
+            bulk_data.prepare_sf_data_to_send(csv_record))
+        record = {'attributes': {'type': objname}}
+        for field, value in zip(fields, values):
+            if value == '':
+                continue
+            if value == SF_NULL_VALUE:
+                value = None
+            names = field.split('.')
+            parent = record
+            for name in names[:-1]:
+                parent = parent.setdefault(name, {})
+            parent[names[-1]] = value
+        records.append(record)
+    return records
+
+def record_ids(csv_records):
+    """ Ids of records to delete """
+    fields = [x.lower() for x in bulk_data.csv_record_values(csv_records[0])]
+    idx = fields.index('id')
+    return [bulk_data.csv_record_values(x)[idx] for x in csv_records[1:]]
+
+def result_error(result):
+    """ Errors of record in the same format as bulk result has """
+    return ' '.join(['%s:%s:%s --' % (x.get('statusCode'), x.get('message'),
+                                      ','.join(x.get('fields') or []))
+                     for x in result.get('errors') or []])
+
+def result_line(op, result):
+    success = bool(result.get('success'))
+    created = success and (op == 'insert' or bool(result.get('created')))
+    values = [result.get('id') or '', str(success).lower(),
+              str(created).lower(), result_error(result)]
+    values = [x.encode('utf-8') if isinstance(x, unicode) else x
+              for x in values]
+    return ','.join(['"%s"' % x.replace('"', '""') for x in values])
@@ -88,12 +88,16 @@ class SoapMerge(object):
 
     SOAP_URL = u'{instance_url}/services/Soap/c/{sf_version}'
 
-    def __init__(self, instance_url, sessionid, version='37.0'):
+    def __init__(self, instance_url, sessionid, version='37.0',
+                 session=None, timeout=None):
         """
         @instance_url - hostname
-        @sessionid - Id of authenticated session, must be taken from bulk transaport"""
+        @sessionid - Id of authenticated session, must be taken from bulk transaport
+        @session - http session of bulk transport"""
 
         self.sessionid = sessionid
+        self.session = session or requests
+        self.timeout = timeout
         self.soap_url = \
             self.SOAP_URL.format(instance_url=instance_url, sf_version=version)
    
@@ -173,9 +177,10 @@ class SoapMerge(object):
 
     def _send_merge_request(self, soap_url, merge_soap_request_body):
         getLogger(STDERR).debug(soap_url)
-        return requests.post(soap_url,
-                             merge_soap_request_body,
-                             headers=MERGE_SOAP_REQUEST_HEADERS)
+        return self.session.post(soap_url,
+                                 merge_soap_request_body,
+                                 headers=MERGE_SOAP_REQUEST_HEADERS,
+                                 timeout=self.timeout)
         
     def _get_check_result(self,response):
         res = self._result(parseXMLResultList(response.content, RESPONSE_LIST_NAME),
@@ -59,7 +59,9 @@ class SfSoapMergeWrapper(object):
         return self.merge_data
    
     def run_merge(self):
-        merger = SoapMerge(self.instance_url(), self.sessionid())
+        bulk = self.sf_bulk_connector.bulk
+        merger = SoapMerge(self.instance_url(), self.sessionid(),
+                           session=bulk.session, timeout=bulk.timeout)
         rows = []
         current_chunk = {}
         for k,v in self.merge_data.iteritems():
@@ -0,0 +1,140 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+
+""" Helpers of REST API query. Aggregate queries, which are not
+supported by Bulk API, and optionally small queries are sent by
+synchronous REST query. JSON records are converted into csv lines
+of the same format as Bulk API query results have."""
+
+__author__ = "Yaroslav Litvinov"
+
+import re
+from decimal import Decimal
+
+COUNT_COLUMN = 'count'
+
+AGGREGATE_RE = re.compile(r'\b(count|count_distinct|sum|avg|min|max)\s*\(',
+                          re.IGNORECASE)
+SELECT_RE = re.compile(r'^\s*select\s', re.IGNORECASE)
+FROM_RE = re.compile(r'\sfrom\s', re.IGNORECASE)
+GROUPBY_RE = re.compile(r'\sgroup\s+by\s', re.IGNORECASE)
+LIMIT_RE = re.compile(r'\slimit\s+(\d+)\s*(offset\s+\d+\s*)?$',
+                      re.IGNORECASE)
+# REST API returns datetime with '+0000' offset, Bulk API with 'Z'
+DATETIME_RE = re.compile(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d+)?\+0000$')
+
+def select_fields(soql):
+    """ Return list of items of select list, items are separated
+    by commas which are not inside of parentheses """
+    match = SELECT_RE.match(soql)
+    if not match:
+        return []
+    fields = []
+    field = ''
+    depth = 0
+    pos = match.end()
+    while pos < len(soql):
+        char = soql[pos]
+        if not depth and FROM_RE.match(soql, pos - 1):
+            break
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and not depth:
+            fields.append(field.strip())
+            field = ''
+        else:
+            field += char
+        pos += 1
+    fields.append(field.strip())
+    return fields
+
+def is_count_query(soql):
+    return [x.replace(' ', '').lower() for x in select_fields(soql)] == \
+        ['count()']
+
+def is_aggregate_query(soql):
+    return bool([x for x in select_fields(soql) if AGGREGATE_RE.match(x)]) \
+        or bool(GROUPBY_RE.search(soql))
+
+def is_small_query(soql, max_rows=0):
+    """ Aggregate query or query limited to max_rows records,
+    max_rows 0 means only aggregate queries are small """
+    if is_aggregate_query(soql):
+        return True
+    match = LIMIT_RE.search(soql)
+    return bool(match) and int(match.group(1)) <= max_rows
+
+def query_columns(soql):
+    """ Return result columns, it's fields paths, like 'Owner.Name',
+    aliases of aggregated fields or salesforce names 'exprN' of
+    aggregated fields without alias """
+    if is_count_query(soql):
+        return [COUNT_COLUMN]
+    columns = []
+    expr_idx = 0
+    for field in select_fields(soql):
+        if field.find('(') == -1:
+            columns.append(field)
+        elif field[-1] != ')':
+            columns.append(field.split()[-1])
+        else:
+            columns.append('expr%d' % expr_idx)
+            expr_idx += 1
+    return columns
+
+def record_value(record, column):
+    """ Get value of field path from json record, field names of
+    record could have case different from query """
+    value = record
+    for name in column.split('.'):
+        if not isinstance(value, dict):
+            return None
+        names = dict([(x.lower(), x) for x in value])
+        value = value.get(names.get(name.lower()))
+    return value
+
+def parse_page(resp):
+    """ Json of REST query result page, numbers are parsed exactly
+    as they're returned, as float keeps only 12 digits by str() """
+    return resp.json(parse_float=Decimal)
+
+def csv_value(value):
+    """ Quoted value as Bulk API query result has, null is empty """
+    if value is None:
+        text = ''
+    elif value is True or value is False:
+        text = str(value).lower()
+    elif isinstance(value, unicode):
+        text = value.encode('utf-8')
+        if DATETIME_RE.match(text):
+            text = text[:-len('+0000')] + 'Z'
+    elif isinstance(value, float):
+        text = repr(value)
+    else:
+        text = str(value)
+    return '"%s"' % text.replace('"', '""')
+
+def csv_line(values):
+    return ','.join([csv_value(x) for x in values])
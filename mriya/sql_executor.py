@@ -91,7 +91,8 @@ class SqlExecutor(object):
             
     @staticmethod
     def prepare_query_put_vars(query, variables):
-        for var_name, var_value in variables.iteritems():
+        # items() is a copy, as variables can be updated by another thread
+        for var_name, var_value in variables.items():
             if type(var_value) != list:
                 query = query.replace('{%s}' % (var_name), var_value)
         return query
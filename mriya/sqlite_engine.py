@@ -0,0 +1,234 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+""" In-process sqlite engine. Keeps one sqlite3 connection opened
+for the whole job run, so csv tables are imported only once and
+reimported only if backing csv file was changed.
+It mimics sqlite3 shell behaviour: '.import' of csv tables
+and '.mode csv' output with '#N/A' as null value."""
+
+__author__ = "Yaroslav Litvinov"
+
+import os
+import re
+import csv
+import sqlite3
+import threading
+from logging import getLogger
+from mriya.log import LOG
+
+SQLITE_ENGINE_SHELL = 'shell' # by default
+SQLITE_ENGINE_INPROCESS = 'inprocess'
+
+NULLVALUE = '#N/A'
+SAVEPOINT = 'mriya_query'
+
+# same set of chars which is forcing quotation in sqlite3 shell csv mode
+_NEED_QUOTE = re.compile(r'[\x00-\x20"\',\x7f-\xff]')
+
+def csv_value(val):
+    """ Return value formatted like sqlite3 shell does in csv mode """
+    if val is None:
+        return NULLVALUE
+    if type(val) is float:
+        txt = real_text(val)
+    elif type(val) is unicode:
+        txt = val.encode('utf-8')
+    else:
+        txt = str(val)
+    if not txt or _NEED_QUOTE.search(txt):
+        return '"%s"' % txt.replace('"', '""')
+    return txt
+
+def real_text(val):
+    """ Python analog of sqlite's '%!.15g' format """
+    txt = '%.15g' % val
+    mantissa, exp_sep, exp = txt.partition('e')
+    if mantissa.lstrip('-').isdigit():
+        mantissa += '.0'
+    return mantissa + exp_sep + exp
+
+def split_statements(query):
+    """ Split sql script into list of complete statements """
+    statements = []
+    start = 0
+    pos = query.find(';')
+    while pos != -1:
+        candidate = query[start:pos+1]
+        if sqlite3.complete_statement(candidate):
+            if candidate.strip() != ';':
+                statements.append(candidate.strip())
+            start = pos + 1
+        pos = query.find(';', pos + 1)
+    if query[start:].strip():
+        statements.append(query[start:].strip())
+    return statements
+
+def quoted(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class CsvOutput(object):
+    """ Write result rows into file in sqlite3 shell csv format.
+    As sqlite3 shell does, header is written only for non empty result."""
+    def __init__(self, output_file, headers):
+        self.output_file = output_file
+        self.headers = headers
+        self.rows_count = 0
+
+    def write(self, fields, row):
+        if not self.rows_count and self.headers:
+            self.output_file.write(','.join([csv_value(x) for x in fields]))
+            self.output_file.write('\n')
+        self.output_file.write(','.join([csv_value(x) for x in row]))
+        self.output_file.write('\n')
+        self.rows_count += 1
+
+
+class ColumnOutput(object):
+    """ Collect values of single column as they would be in csv output """
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.values = []
+
+    def write(self, fields, row):
+        field_idx = fields.index(self.field_name)
+        val = row[field_idx]
+        if val is None:
+            self.values.append(NULLVALUE)
+        elif type(val) is float:
+            self.values.append(real_text(val))
+        elif type(val) is unicode:
+            self.values.append(val.encode('utf-8'))
+        else:
+            self.values.append(str(val))
+
+
+class SqliteEngine(object):
+    """ Single sqlite3 connection shared by all sqlite executors of job """
+
+    def __init__(self):
+        # empty name is for private temporary on-disk database,
+        # connection can be used by parallel workers one at a time
+        self.conn = sqlite3.connect('', check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.isolation_level = None
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA journal_mode=MEMORY')
+        # {table_name: (csv_filename, st_mtime, st_size)}
+        self.tables = {}
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+            self.tables = {}
+
+    @staticmethod
+    def fingerprint(csv_filename):
+        try:
+            stat = os.stat(csv_filename)
+        except OSError:
+            return None
+        return (csv_filename, stat.st_mtime, stat.st_size)
+
+    def refresh_table(self, table_name, csv_filename):
+        """ (Re)import csv table if it's not loaded yet or csv was changed """
+        fingerprint = SqliteEngine.fingerprint(csv_filename)
+        if fingerprint and self.tables.get(table_name) == fingerprint:
+            return False
+        self.conn.execute('DROP TABLE IF EXISTS %s' % quoted(table_name))
+        if table_name in self.tables:
+            del self.tables[table_name]
+        if fingerprint and self.import_csv(table_name, csv_filename):
+            self.tables[table_name] = fingerprint
+        return True
+
+    def import_csv(self, table_name, csv_filename):
+        """ Analog of sqlite3 shell '.import' into not existing table:
+        1st line is header, all columns are TEXT, short rows are
+        filled by NULLs, extra values are ignored"""
+        with open(csv_filename, 'rb') as csv_f:
+            reader = csv.reader(csv_f)
+            try:
+                fields = reader.next()
+            except StopIteration:
+                return False
+            columns_count = len(fields)
+
+            def rows():
+                for row in reader:
+                    if len(row) < columns_count:
+                        row.extend([None] * (columns_count - len(row)))
+                    yield row[:columns_count]
+
+            columns = ', '.join(['%s TEXT' % quoted(x) for x in fields])
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.execute('CREATE TABLE %s(%s)' % (quoted(table_name),
+                                                           columns))
+                self.conn.executemany(
+                    'INSERT INTO %s VALUES(%s)' % (quoted(table_name),
+                                                   ','.join('?'*columns_count)),
+                    rows())
+                self.conn.execute('COMMIT')
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+        getLogger(LOG).info('sqlite engine: imported %s', csv_filename)
+        return True
+
+    def execute(self, query, tables, output):
+        """ Execute query, every row of resulted data is passed to output.
+        Changes done by query are always rolled back, as each query
+        of sqlite3 shell is running against just imported tables.
+        query -- sql script
+        tables -- {table_name: csv_filename} tables used by query
+        output -- object with write(fields, row) method or None"""
+        with self.lock:
+            self._execute(query, tables, output)
+
+    def _execute(self, query, tables, output):
+        for table_name, csv_filename in tables.iteritems():
+            self.refresh_table(table_name, csv_filename)
+        cursor = self.conn.cursor()
+        cursor.execute('SAVEPOINT %s' % SAVEPOINT)
+        try:
+            for statement in split_statements(query):
+                cursor.execute(statement)
+                if cursor.description is None:
+                    continue
+                fields = [x[0] for x in cursor.description]
+                for row in cursor:
+                    if output:
+                        output.write(fields, row)
+        except sqlite3.Error as err:
+            getLogger(LOG).error('sqlite engine error: %s', err)
+            raise Exception("Sqlite query error", query)
+        finally:
+            cursor.close()
+            self.conn.execute('ROLLBACK TO %s' % SAVEPOINT)
+            self.conn.execute('RELEASE %s' % SAVEPOINT)
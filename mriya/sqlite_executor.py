@@ -22,6 +22,7 @@ along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
 
 __author__ = "Yaroslav Litvinov"
 
+import os
 import time
 import logging
 from StringIO import StringIO
@@ -36,6 +37,7 @@ from mriya.opexecutor import Executor
 from mriya.bulk_data import get_bulk_data_from_csv_stream
 from mriya.log import loginit, ismoreinfo, STDOUT, LOG, MOREINFO
 from mriya.sql_executor import var_replaced
+from mriya.sqlite_engine import CsvOutput, ColumnOutput
 
 SQLITE_SCRIPT_FMT='.mode csv\n\
 .separator ","\n\
@@ -52,9 +54,10 @@ def observer(refname, retcode, output):
 class SqliteExecutor(SqlExecutor):
     table_columns = {}
 
-    def __init__(self, job_syntax_item, variables):
+    def __init__(self, job_syntax_item, variables, engine=None):
         super(SqliteExecutor, self).__init__(job_syntax_item, variables)
         #loginit(__name__)
+        self.engine = engine
         self.query = None
         self.query = self.get_query()
 
@@ -86,15 +89,21 @@ class SqliteExecutor(SqlExecutor):
                 self.query += ';'
         return self.query
 
-    def _create_script(self, variables):
-        imports = ''
+    def _csv_tables(self):
+        tables = []
         if CSVLIST_KEY in self.job_syntax_item :
             for table_name in self.job_syntax_item[CSVLIST_KEY] :
                 #check if table name contain vars
                 table_name = SqlExecutor.prepare_query_put_vars(
                     table_name, self.variables)
-                imports += ".import {csv} {name}\n"\
-                    .format(csv=self.csv_name(table_name), name=table_name)
+                tables.append(table_name)
+        return tables
+
+    def _create_script(self, variables):
+        imports = ''
+        for table_name in self._csv_tables():
+            imports += ".import {csv} {name}\n"\
+                .format(csv=self.csv_name(table_name), name=table_name)
         output = ''
         if CSV_KEY in self.job_syntax_item:
             table_name = var_replaced(variables, self.job_syntax_item, CSV_KEY)
@@ -124,8 +133,7 @@ class SqliteExecutor(SqlExecutor):
             with open(self.csv_name(table_name), 'w') as f:
                 f.write(header)
 
-    def execute(self):
-        t_before = time.time()
+    def _execute_shell(self):
         executor = Executor()
         cmd = 'sqlite3 -batch'
         script = self._create_script(self.variables)
@@ -135,6 +143,51 @@ class SqliteExecutor(SqlExecutor):
                          output_pipe=True)
         res = executor.poll_for_complete(observer)
         del executor
+        return res['refname']
+
+    def _execute_engine(self):
+        """ Run query by in-process engine, return result like
+        shell does: (retcode, output) """
+        tables = {}
+        for table_name in self._csv_tables():
+            tables[table_name] = self.csv_name(table_name)
+        getLogger(MOREINFO).info('EXECUTE [CSV]: %s', self.get_query())
+        output = ''
+        if CSV_KEY in self.job_syntax_item:
+            table_name = var_replaced(self.variables, self.job_syntax_item, CSV_KEY)
+            getLogger(LOG).info('working on table=%s', table_name)
+            csv_name = self.csv_name(table_name)
+            # query could read the same table, so it's replaced only
+            # after query is done, as sqlite3 shell imports it before
+            tmp_name = csv_name + '.tmp'
+            try:
+                with open(tmp_name, 'w') as csv_f:
+                    self.engine.execute(self.get_query(), tables,
+                                        CsvOutput(csv_f, headers=True))
+            except:
+                os.remove(tmp_name)
+                raise
+            os.rename(tmp_name, csv_name)
+        elif VAR_KEY in self.job_syntax_item:
+            var_f = StringIO()
+            self.engine.execute(self.get_query(), tables,
+                                CsvOutput(var_f, headers=False))
+            output = var_f.getvalue()
+        elif BATCH_BEGIN_KEY in self.job_syntax_item:
+            param_field_name = self.job_syntax_item[BATCH_BEGIN_KEY][0]
+            column = ColumnOutput(param_field_name)
+            self.engine.execute(self.get_query(), tables, column)
+            output = column.values
+        else:
+            self.engine.execute(self.get_query(), tables, None)
+        return (0, output)
+
+    def execute(self):
+        t_before = time.time()
+        if self.engine:
+            res = self._execute_engine()
+        else:
+            res = self._execute_shell()
         t_after = time.time()
         csvname = ''
         if CSV_KEY in self.job_syntax_item:
@@ -145,7 +198,6 @@ class SqliteExecutor(SqlExecutor):
                 getLogger(MOREINFO).info('%s.csv - %.2fs' % (csvname, t_after-t_before))
             else:
                 getLogger(STDOUT).info('.')
-        res = res['refname']
         if res[0] != 0:
             raise Exception("Sqlite query error", self.get_query())
         else:
@@ -156,6 +208,10 @@ class SqliteExecutor(SqlExecutor):
     def _handle_var_create(self, res):
         if VAR_KEY in self.job_syntax_item:
             self.save_var(self.job_syntax_item[VAR_KEY], res[1].strip())
+        elif BATCH_BEGIN_KEY in self.job_syntax_item and \
+             type(res[1]) is list:
+            # values are already taken from engine's cursor
+            self.variables[BATCH_PARAMS_KEY] = res[1]
         elif BATCH_BEGIN_KEY in self.job_syntax_item:
             param_field_name = self.job_syntax_item[BATCH_BEGIN_KEY][0]
             stream = StringIO(res[1])
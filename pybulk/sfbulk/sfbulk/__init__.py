@@ -18,4 +18,4 @@ You should have received a copy of the GNU General Public License
 along with sfbulk.  If not, see <http://www.gnu.org/licenses/>.
 """
 from sfbulk.bulk import Bulk
-from sfbulk.exceptions import BulkException
+from sfbulk.exceptions import BulkException, InvalidSessionException
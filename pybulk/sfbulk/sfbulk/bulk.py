@@ -18,18 +18,22 @@ You should have received a copy of the GNU General Public License
 along with sfbulk.  If not, see <http://www.gnu.org/licenses/>.
 """
 import logging
-import time
 import errno
+import shutil
+import tempfile
+import threading
+import requests
 from socket import error as SocketError
+from multiprocessing.pool import ThreadPool
 from logging import getLogger
 from mriya.log import STDERR
 
-from sfbulk.callout import Callout
-from sfbulk.exceptions import BulkException
+from sfbulk.callout import Callout, http_session
+from sfbulk.exceptions import BulkException, InvalidSessionException
 from sfbulk.sf import sf
 from sfbulk.jobinfo import JobInfo
 from sfbulk.utils_csv import loadFromCSVFile
-from sfbulk.utils_xml import parseXMLResult
+from sfbulk.utils_xml import parseXMLResult, parseXMLResultItems
 
 
 #logging.basicConfig(filename='mriya.log')
@@ -59,13 +63,24 @@ class Bulk(sf):
     CLOSED = u'Closed'
     COMPLETED = u'Completed'
     FAILED = u'Failed'
+    QUEUED = u'Queued'
+    NOT_PROCESSED = u'NotProcessed'
+    PARALLEL = u'Parallel'
+    SERIAL = u'Serial'
+    NO_RECORDS = u'Records not found for this query'
+    PK_CHUNKING_HEADER = u'Sforce-Enable-PKChunking'
+    BATCHES_COMPLETED = u'numberBatchesCompleted'
+    BATCHES_FAILED = u'numberBatchesFailed'
+    BATCHES_TOTAL = u'numberBatchesTotal'
 
     # RE-LOGIN SETTINGS
     LOG_BACK_IN = True
-    LOG_BACK_IN_WAIT_TIME = 60*2
+    # callable(expired_sessionid) setting new session instead of login
+    login_handler = None
 
     def __init__(self, bulk_server=u'',
-                 sessionid=None, logger=None):
+                 sessionid=None, logger=None, max_requests=None,
+                 session=None, timeout=None, compress=False):
         """
         Standard constructor.
 
@@ -77,18 +92,60 @@ class Bulk(sf):
                            when you use the login method.
         @type: logger instance
         @param logger: loger instance
+        @type: int
+        @param max_requests: max count of concurrent http requests
+        @type: requests.Session
+        @param session: http session shared by all requests
+        @type: float
+        @param timeout: timeout of http requests, seconds
+        @type: bool
+        @param compress: gzip request data and responses
         """
         self.bulk_server = bulk_server
         self.sessionid = sessionid
         self.callClient = None
         self.logger = logger or LOGGER
+        self.requests_limit = None
+        if max_requests:
+            self.requests_limit = threading.BoundedSemaphore(max_requests)
+            self.session = session or http_session(max_requests)
+        else:
+            self.session = session or http_session()
+        self.timeout = timeout
+        self.compress = compress
+        # only one of threads using expired session logs in again
+        self.login_lock = threading.Lock()
+        # session id used by last request of every thread
+        self.request_session = threading.local()
         if not logger:
             self.logger.disabled = True
 
-    def job_create(self, operation, sf_object, externalidfield=None):
-        self.jobinfo = JobInfo.factory(operation, sf_object, externalidfield)
+    def job_create(self, operation, sf_object, externalidfield=None,
+                   pk_chunk_size=None, concurrency_mode=None):
+        self.jobinfo = JobInfo.factory(operation, sf_object, externalidfield,
+                                       pk_chunk_size, concurrency_mode)
         self.createJob(self.jobinfo)
 
+    def job_attach(self, operation, sf_object, job_id, batch_ids,
+                   pk_chunk_size=None):
+        """
+        Continue work with job created before, state of batches
+        is unknown until it's requested.
+
+        @type: string
+        @param job_id: id of existing job
+        @type: list
+        @param batch_ids: ids of batches created by client
+        """
+        self.jobinfo = JobInfo.factory(operation, sf_object,
+                                       pk_chunk_size=pk_chunk_size)
+        self.jobinfo.id = job_id
+        self.runningJobId = job_id
+        for batch_id in batch_ids:
+            self.jobinfo.batch[batch_id] = {'id': batch_id,
+                                            'state': self.QUEUED}
+        self.updateJobStatus(self.jobinfo)
+
     def job_close(self):
         self.closeJob(self.jobinfo)
         self.jobinfo = None
@@ -125,9 +182,13 @@ class Bulk(sf):
         @type: JobInfo
         @param jobinfo: will be used to populate the job information
         """
+        headers = self.__content_xml
+        if jobinfo.pk_chunk_size is not None:
+            headers[self.PK_CHUNKING_HEADER] = self.__pk_chunking(
+                jobinfo.pk_chunk_size)
         resp = self._bulkHttp(self.JOB,
                               jobinfo.createJob(),
-                              self.__content_xml)
+                              headers)
         getLogger(STDERR).debug(resp)
         dict_result = parseXMLResult(resp)
         if self.__check_result(dict_result):
@@ -189,7 +250,7 @@ class Bulk(sf):
             return dict_result['id']
         else:
             if self._handle_errors(dict_result):
-                return self.closeJob(jobinfo)
+                return self.createBatch(jobinfo, batchdata)
             else:
                 self.__raise('Batch creating failed')
 
@@ -235,12 +296,84 @@ class Bulk(sf):
             else:
                 self.__raise("Batch: %s updateing status failed" % batchId)
 
+    def updateBatchesList(self, jobinfo):
+        """
+        Update status of all batches of job by single request,
+        it includes batches created by server for PK chunking.
+
+        @type: JobInfo
+        @param jobinfo: job information
+        """
+        resp = self._bulkHttp(self.__join((self.JOB, jobinfo.id, self.BATCH)),
+                              None, self.__content_xml, 'GET')
+        getLogger(STDERR).debug(resp)
+        batches = parseXMLResultItems(resp)
+        if [x for x in batches if 'id' not in x]:
+            dict_result = parseXMLResult(resp)
+            if self._handle_errors(dict_result):
+                return self.updateBatchesList(jobinfo)
+            self.__raise("Job: %s batches list failed" % jobinfo.id)
+        jobinfo.batch_ids = []
+        for batch in batches:
+            self.__update_batch_state(jobinfo, batch)
+            jobinfo.batch_ids.append(batch['id'])
+
+    def processed_batches(self):
+        """
+        Ids of batches having results, for PK chunking it's batches
+        created by server instead of not processed original batch.
+        """
+        batch_ids = self.jobinfo.batch_ids or self.jobinfo.batch.keys()
+        return [x for x in batch_ids
+                if self.jobinfo.findBatchState(x) != self.NOT_PROCESSED]
+
     def batch_result(self, only_invalid=False):
-        self.jobinfo.batch_result = dict()
+        batch_result = dict()
         for batch in self.jobinfo.batch:
-            result = self.showBatchResult(self.jobinfo, batch, only_invalid)
-            self.jobinfo.batch_result.update({batch: result})
-        return self.jobinfo.batch_result
+            result = self.batch_result_by_id(batch, only_invalid)
+            batch_result.update({batch: result})
+        return batch_result
+
+    def batch_result_by_id(self, batch_id, only_invalid=False):
+        """
+        Result of single batch of running job.
+        Result is requested only once and cached in jobinfo.
+
+        @type: string
+        @param batch_id: batch id
+        """
+        if batch_id not in self.jobinfo.batch_result:
+            self.jobinfo.batch_result[batch_id] = self.showBatchResult(
+                self.jobinfo, batch_id)
+        results = self.jobinfo.batch_result[batch_id]
+        if only_invalid:
+            results = self.__invalid_results(results)
+        return results
+
+    def batches_result(self, batch_ids, threads=1):
+        """
+        Results of several batches of running job.
+        Not cached yet results are downloaded concurrently.
+
+        @type: list
+        @param batch_ids: batch ids
+        @type: int
+        @param threads: max count of concurrent downloads
+        """
+        missing = [x for x in batch_ids
+                   if x not in self.jobinfo.batch_result]
+        if threads > 1 and len(missing) > 1:
+            jobinfo = self.jobinfo
+            pool = ThreadPool(min(threads, len(missing)))
+            try:
+                results = pool.map(
+                    lambda batch_id: self.showBatchResult(jobinfo, batch_id),
+                    missing)
+            finally:
+                pool.close()
+                pool.join()
+            jobinfo.batch_result.update(zip(missing, results))
+        return [self.batch_result_by_id(x) for x in batch_ids]
 
     def showBatchResult(self, jobinfo, batchId, only_invalid=False):
         """
@@ -251,94 +384,258 @@ class Bulk(sf):
         @type: string
         @param batchId: batch id
         """
-        results = []
+        if jobinfo.operation == 'query':
+            results = list(self.iterBatchResult(jobinfo, batchId))
+            # add trailing empty line to mimic standard behaviour
+            if results:
+                results.append('')
+        else:
+            resp = self._bulkHttp(
+                self.__join((self.JOB, self.runningJobId, self.BATCH,
+                             batchId, self.RESULT)),
+                None, self.__content_csv, 'GET')
+            getLogger(STDERR).debug(resp)
+            results = resp.split('\n')
+
+        if only_invalid:
+            results = self.__invalid_results(results)
+        return results
+
+    def iterBatchResult(self, jobinfo, batchId, threads=1):
+        """
+        Generator of query batch result lines, lines are returned without
+        trailing newline. Result chunks are read one by one from http
+        response, so whole result is never loaded into memory.
+        Header is returned only once, it's skipped for all other chunks.
+        If threads > 1 then chunks are downloaded concurrently into
+        temporary files which are read in chunks order.
+
+        @type JobInfo
+        @param jobinfo: job information
+        @type: string
+        @param batchId: batch id
+        @type: int
+        @param threads: max count of concurrent chunks downloads
+        """
         resp = self._bulkHttp(
             self.__join((self.JOB, self.runningJobId, self.BATCH,
                         batchId, self.RESULT)),
             None, self.__content_csv, 'GET')
         getLogger(STDERR).debug(resp)
-        if jobinfo.operation == 'query':
-            result_ids = parseXMLResult(resp)
-            for chunk_name in sorted(result_ids.keys()):
-                resultid = result_ids[chunk_name]
+        result_ids = parseXMLResult(resp)
+        chunk_urls = [self.__join((self.JOB, self.runningJobId, self.BATCH,
+                                   batchId, self.RESULT, result_ids[x]))
+                      for x in sorted(result_ids.keys())]
+        pool = None
+        if threads > 1 and len(chunk_urls) > 1:
+            pool = ThreadPool(min(threads, len(chunk_urls)))
+            # chunks are returned in order, as soon as downloaded
+            chunks = pool.imap(self.__download_chunk, chunk_urls)
+        else:
+            chunks = (self.__open_chunk(x) for x in chunk_urls)
+        try:
+            header = None
+            for chunk in chunks:
                 try:
-                    resp = self._bulkHttp(
-                        self.__join((self.JOB, self.runningJobId, self.BATCH,
-                                    batchId, self.RESULT, resultid)),
-                        None, self.__content_csv, 'GET')
-                except SocketError as e:
-                    if e.errno != errno.ECONNRESET:
-                        raise # Not error we are looking for
-                    # send request again
-                    resp = self._bulkHttp(
-                        self.__join((self.JOB, self.runningJobId, self.BATCH,
-                                     batchId, self.RESULT, resultid)),
-                        None, self.__content_csv, 'GET')
-                getLogger(STDERR).debug(resp)
-                result_chunk = resp.split('\n')
-                # get rid of last empty line
-                if result_chunk and result_chunk[-1] == '':
-                    result_chunk = result_chunk[:-1]
-                if not results:
-                    results = result_chunk
-                elif result_chunk:
-                    # for other chunks header will not be added
-                    results.extend(result_chunk[1:])
-            # add trailing empty line to mimic standard behaviour
-            if results:
-                results.append('')
+                    first_line = True
+                    for line in chunk:
+                        if line[-1:] == '\n':
+                            line = line[:-1]
+                        if first_line:
+                            first_line = False
+                            # for other chunks header will not be returned
+                            if header is not None:
+                                continue
+                            header = line
+                        yield line
+                finally:
+                    chunk.close()
+        finally:
+            if pool:
+                # not consumed chunks are deleted along with temp files
+                pool.terminate()
+                pool.join()
+
+    def __open_chunk(self, chunk_url):
+        """ Return file-like http response of result chunk """
+        try:
+            return self._bulkHttp(chunk_url, None, self.__content_csv,
+                                  'GET', stream=True)
+        except (SocketError, requests.ConnectionError) as e:
+            if isinstance(e, SocketError) and e.errno != errno.ECONNRESET:
+                raise # Not error we are looking for
+            # send request again
+            return self._bulkHttp(chunk_url, None, self.__content_csv,
+                                  'GET', stream=True)
+
+    def __download_chunk(self, chunk_url):
+        """ Save result chunk into temporary file, return opened file """
+        stream = self.__open_chunk(chunk_url)
+        chunk_file = tempfile.TemporaryFile()
+        try:
+            shutil.copyfileobj(stream, chunk_file)
+        finally:
+            stream.close()
+        chunk_file.seek(0)
+        getLogger(STDERR).debug("Result chunk is downloaded: %s" % chunk_url)
+        return chunk_file
+
+    def iterBatchesResult(self, jobinfo, batchIds, threads=1):
+        """
+        Generator of lines of several query batches results, which are
+        returned as a single result with only one header.
+        If threads > 1 then batches results are downloaded concurrently
+        into temporary files which are read in batches order.
+
+        @type JobInfo
+        @param jobinfo: job information
+        @type: list
+        @param batchIds: batch ids
+        @type: int
+        @param threads: max count of concurrent downloads
+        """
+        pool = None
+        if threads > 1 and len(batchIds) > 1:
+            pool = ThreadPool(min(threads, len(batchIds)))
+            results = pool.imap(
+                lambda batch_id: self.__download_batch_result(jobinfo,
+                                                              batch_id),
+                batchIds)
         else:
-            results = resp.split('\n')                
-        
-        #TODO: improve parsing response
-        if only_invalid:
-            invalid_results = []
-            counter = 0
+            results = (self.iterBatchResult(jobinfo, x, threads)
+                       for x in batchIds)
+        try:
+            header = None
             for result in results:
-                counter += 1
-                result = result.replace('"', '')
-                split = result.split(',')
-                if len(split) > 2 and split[1] == 'false':
-                    invalid_results.append(
-                        "%s - Row number: %s" % (split, counter))
-            results = invalid_results
-        return results
+                try:
+                    first_line = True
+                    for line in result:
+                        if line[-1:] == '\n':
+                            line = line[:-1]
+                        if first_line:
+                            first_line = False
+                            if line == self.NO_RECORDS:
+                                break
+                            # for other batches header will not be returned
+                            if header is not None:
+                                continue
+                            header = line
+                        yield line
+                finally:
+                    result.close()
+            if header is None and batchIds:
+                yield self.NO_RECORDS
+        finally:
+            if pool:
+                # not consumed results are deleted along with temp files
+                pool.terminate()
+                pool.join()
+
+    def __download_batch_result(self, jobinfo, batchId):
+        """ Save query batch result into temporary file, return opened file """
+        result_file = tempfile.TemporaryFile()
+        for line in self.iterBatchResult(jobinfo, batchId):
+            result_file.write(line)
+            result_file.write('\n')
+        result_file.seek(0)
+        getLogger(STDERR).debug("Batch: %s result is downloaded" % batchId)
+        return result_file
+
+    @staticmethod
+    def __invalid_results(results):
+        #TODO: improve parsing response
+        invalid_results = []
+        counter = 0
+        for result in results:
+            counter += 1
+            result = result.replace('"', '')
+            split = result.split(',')
+            if len(split) > 2 and split[1] == 'false':
+                invalid_results.append(
+                    "%s - Row number: %s" % (split, counter))
+        return invalid_results
+
+    def updateJobStatus(self, jobinfo):
+        """
+        Update job status, it includes batches counters of job.
+
+        @type: JobInfo
+        @param jobinfo: job information
+        """
+        resp = self._bulkHttp(self.__join((self.JOB, jobinfo.id)),
+                              None, self.__content_xml, 'GET')
+        getLogger(STDERR).debug(resp)
+        dict_result = parseXMLResult(resp)
+        if self.__check_result(dict_result):
+            self.__update_jobinfo(jobinfo, dict_result)
+        else:
+            if self._handle_errors(dict_result):
+                self.updateJobStatus(jobinfo)
+            else:
+                self.__raise("Job: %s updating status failed" % jobinfo.id)
 
     def is_jobs_completed(self, jobinfo):
         """
         Will check whether all batches in specific jobinfo record
-        is completed/failed.
+        is completed/failed. Single job status request is used for check,
+        status of every batch is requested only if some batches failed.
 
         @type: JobInfo
         @param jobinfo: job information
         """
-        completed = True
-        for batchId in jobinfo.batch:
-            self.updateBatchStatus(jobinfo, batchId)
-            status = jobinfo.findBatchState(batchId)
-            if status != self.COMPLETED and status != self.FAILED:
-                getLogger(STDERR).debug("Batch: %s status is: updateing..." % batchId)
-                completed = False
-
-        if completed == True:
-            for batch in jobinfo.batch:
-                if status != self.FAILED:
-                    getLogger(STDERR).debug("Batch: %s status is: %s" %
-                                    (batch, status))
-                else:
-                    try:
-                        stat = jobinfo.batch[batch]['stateMessage']
-                    except:
-                        stat = 'Exception occured here'
-                    getLogger(STDERR).debug("Batch: %s status is: %s: %s" %
-                                     (batch, status,
-                                     stat
-                                     ))
-
-        return completed
+        if jobinfo.pk_chunk_size is not None:
+            return self.__is_pk_chunking_completed(jobinfo)
+        self.updateJobStatus(jobinfo)
+        completed = int(jobinfo.debug_result.get(
+            self.BATCHES_COMPLETED, 0))
+        failed = int(jobinfo.debug_result.get(self.BATCHES_FAILED, 0))
+        total = int(jobinfo.debug_result.get(self.BATCHES_TOTAL, 0))
+        if completed + failed < max(total, len(jobinfo.batch)):
+            getLogger(STDERR).debug("Job: %s batches completed: %d/%d" %
+                                    (jobinfo.id, completed + failed, total))
+            return False
+
+        if failed:
+            for batchId in jobinfo.batch:
+                self.updateBatchStatus(jobinfo, batchId)
+        else:
+            for batchId in jobinfo.batch:
+                jobinfo.batch[batchId]['state'] = self.COMPLETED
+
+        for batch in jobinfo.batch:
+            status = jobinfo.findBatchState(batch)
+            if status != self.FAILED:
+                getLogger(STDERR).debug("Batch: %s status is: %s" %
+                                        (batch, status))
+            else:
+                try:
+                    stat = jobinfo.batch[batch]['stateMessage']
+                except:
+                    stat = 'Exception occured here'
+                getLogger(STDERR).debug("Batch: %s status is: %s: %s" %
+                                        (batch, status, stat))
+        return True
+
+    def __is_pk_chunking_completed(self, jobinfo):
+        """
+        Batches counters of job can't be used with PK chunking,
+        as original batch is never processed, so list of batches is
+        requested instead.
+        """
+        self.updateBatchesList(jobinfo)
+        states = [jobinfo.findBatchState(x) for x in jobinfo.batch_ids]
+        getLogger(STDERR).debug("Job: %s batches states: %s" %
+                                (jobinfo.id, states))
+        done_states = (self.COMPLETED, self.FAILED, self.NOT_PROCESSED)
+        if [x for x in states if x not in done_states]:
+            return False
+        # batches are not created by server yet
+        if not [x for x in states if x != self.NOT_PROCESSED]:
+            return False
+        return True
 
     def _bulkHttp(self, bulkmethod, submitdata=None, pheaders=None,
-                  httpmethods='POST'):
+                  httpmethods='POST', stream=False):
         """
         Methods to run http callout to salesforce.
 
@@ -350,44 +647,84 @@ class Bulk(sf):
         @param pheaders: HTTP header information
         @type: string
         @param: httpmethods: GET / POST methods to be used in bulk request
+        @type: bool
+        @param: stream: return file-like response object
         """
         #print bulkmethod
         #print submitdata
-        headers = self.__standardHeaders
-        if headers is not None:
-            if type(pheaders) == dict:
-                for keyh, valueh in pheaders.iteritems():
-                    headers[keyh] = valueh
-
         if self.callClient is None:
             if self.sessionid is not None:
-                self.callClient = Callout(logger=self.logger)
+                self.callClient = Callout(logger=self.logger,
+                                          session=self.session,
+                                          timeout=self.timeout,
+                                          compress=self.compress)
             else:
                 self.__raise('Unauthorized Error')
 
+        try:
+            return self.__docall(bulkmethod, submitdata, pheaders,
+                                 httpmethods, stream)
+        except InvalidSessionException:
+            if not self.LOG_BACK_IN:
+                raise
+            # request is sent again with new session id
+            self.relogin(self.request_session.id)
+            return self.__docall(bulkmethod, submitdata, pheaders,
+                                 httpmethods, stream)
+
+    def __docall(self, bulkmethod, submitdata, pheaders, httpmethods, stream):
+        headers = self.__standardHeaders
+        if type(pheaders) == dict:
+            for keyh, valueh in pheaders.iteritems():
+                headers[keyh] = valueh
+        self.request_session.id = headers[u'X-SFDC-Session']
+
         url = self.__constructBulkUrl(bulkmethod)
         getLogger(STDERR).debug("%s url: %s ", httpmethods, url)
         getLogger(STDERR).debug("headers: %s", headers)
         getLogger(STDERR).debug("data: %s", submitdata)
 
-        resp = self.callClient.docall(url, httpmethods, submitdata, headers)
+        if self.requests_limit:
+            with self.requests_limit:
+                resp = self.callClient.docall(url, httpmethods, submitdata,
+                                              headers, stream=stream)
+        else:
+            resp = self.callClient.docall(url, httpmethods, submitdata,
+                                          headers, stream=stream)
 
         return resp
 
+    def relogin(self, expired_sessionid):
+        """
+        Log in again right away. Threads which got error of the same
+        expired session are waiting for single login, then all of them
+        are using new session.
+
+        @type: string
+        @param expired_sessionid: session id rejected by server
+        """
+        with self.login_lock:
+            if self.sessionid != expired_sessionid:
+                return
+            getLogger(STDERR).info('Session expired, log in again')
+            if self.login_handler:
+                self.login_handler(expired_sessionid)
+                return
+            self.login(self.USERNAME,
+                       self.PASSWORD,
+                       self.SECURITY_TOKEN,
+                       self.SF_VERSION,
+                       self.SANDBOX)
+
     def _handle_errors(self, dict_result):
         if 'exceptionCode' in dict_result:
             if dict_result['exceptionCode'] == 'InvalidSessionId':
                 if self.LOG_BACK_IN:
-                    getLogger(STDERR).debug('Invalid session: sleeping and retrying')
-                    time.sleep(self.LOG_BACK_IN_WAIT_TIME)
-                    self.login(self.USERNAME,
-                               self.PASSWORD,
-                               self.SECURITY_TOKEN,
-                               self.SF_VERSION,
-                               self.SANDBOX)
+                    self.relogin(self.request_session.id)
                     return True
         return False
 
+
     @staticmethod
     def __check_result(dict_result):
         if 'id' in dict_result:
@@ -421,6 +758,12 @@ class Bulk(sf):
         return self.__join((self.bulk_server, 'services/async',
                             self.API_VERSION, bulkmethod))
 
+    @staticmethod
+    def __pk_chunking(chunk_size):
+        if chunk_size:
+            return 'chunkSize=%s' % chunk_size
+        return 'true'
+
     @property
     def __standardHeaders(self):
         """
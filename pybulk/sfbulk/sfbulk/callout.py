@@ -18,10 +18,98 @@ You should have received a copy of the GNU General Public License
 along with sfbulk.  If not, see <http://www.gnu.org/licenses/>.
 """
 import urllib
-import urllib2
+import zlib
+import requests
+from requests.adapters import HTTPAdapter
 
 from pprint import pformat
-from sfbulk.exceptions import BulkException
+from sfbulk.exceptions import BulkException, InvalidSessionException
+
+INVALID_SESSION_CODE = u'<exceptionCode>InvalidSessionId</exceptionCode>'
+DEFAULT_POOL_SIZE = 4
+# count of hosts which connections are kept: login and instance hosts
+POOL_HOSTS = 2
+STREAM_CHUNK_SIZE = 64 * 1024
+# smaller request bodies are sent uncompressed
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def http_session(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Create http session keeping alive up to pool_size connections
+    per host, connections are reused by all requests of session.
+
+    @type: int
+    @param pool_size: max count of kept connections per host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS,
+                          pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def gzip_data(data):
+    """
+    Return data compressed into gzip format.
+
+    @type: string
+    @param data: request body
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def encoding_headers(data, compress):
+    """
+    Return data to be sent and encoding headers of request.
+    Response is asked to be gzipped if compression is enabled,
+    it's decompressed by chunks as it's read.
+
+    @type: string
+    @param data: request body or None
+    @type: bool
+    @param compress: use gzip for request and response
+    """
+    if not compress:
+        return data, {u'Accept-Encoding': u'identity'}
+    headers = {u'Accept-Encoding': u'gzip'}
+    if data and len(data) >= GZIP_MIN_SIZE:
+        if type(data) is unicode:
+            data = data.encode('utf-8')
+        data = gzip_data(data)
+        headers[u'Content-Encoding'] = u'gzip'
+    return data, headers
+
+
+class StreamResponse(object):
+    """
+    File-like http response, data is read by chunks.
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def read(self, size=-1):
+        if size < 0:
+            size = None
+        return self.response.raw.read(size, decode_content=True)
+
+    def __iter__(self):
+        pending = ''
+        for chunk in self.response.iter_content(STREAM_CHUNK_SIZE):
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def close(self):
+        self.response.close()
 
 
 class Callout(object):
@@ -33,14 +121,19 @@ class Callout(object):
 
     AUTHORIZATION = u'Authorization'
 
-    def __init__(self, header={}, logger=None):
+    def __init__(self, header={}, logger=None, session=None, timeout=None,
+                 compress=False):
         if self.AUTHORIZATION in header:
             self.headerAuth = header['Authorization']
         self.logger = logger
+        self.session = session or http_session()
+        self.timeout = timeout
+        self.compress = compress
 
-    def docall(self, url, method, tdata=None, headers=None):
+    def docall(self, url, method, tdata=None, headers=None, stream=False):
         """
         Initiate http call (get / post) along with the data.
+        Connection of session is reused if it's available.
 
         @type: string
         @param url: server url information for the callout destination
@@ -50,31 +143,33 @@ class Callout(object):
         @param tdata: data information which will be submitted on the BODY
         @type: headers
         @param headers: header information
+        @type: bool
+        @param stream: return file-like response instead of read data
         """
-        handler = urllib2.HTTPHandler()
-        opener = urllib2.build_opener(handler)
+        data = None
         if tdata is not None:
             if type(tdata) == dict:
                 data = urllib.urlencode(tdata)
             else:
                 data = tdata
-        else:
-            data = urllib.urlencode({})
-        request = urllib2.Request(url, data)
-
-        if headers is not None:
-            for keyh, valueh in headers.iteritems():
-                request.add_header(keyh, valueh)
-        request.get_method = lambda: method
-
-        try:
-            connection = opener.open(request)
-        except urllib2.HTTPError as e:
-            self.logger.info(
-                "Request url: \n %s" % pformat(request.get_full_url()))
-            self.logger.info(
-                "Request headers: \n %s" % pformat(request.headers))
-            self.logger.info("Request data: \n %s" % pformat(request.data))
-            message = "Http error occurred on doing API call: %s" % e
+        data, encoding = encoding_headers(data, self.compress)
+        headers = dict(headers or {})
+        headers.update(encoding)
+
+        response = self.session.request(method, url, data=data,
+                                        headers=headers, stream=stream,
+                                        timeout=self.timeout)
+        if response.status_code >= 400:
+            body = response.content
+            if body.find(INVALID_SESSION_CODE) != -1:
+                raise InvalidSessionException()
+            self.logger.info("Request url: \n %s" % pformat(url))
+            self.logger.info("Request headers: \n %s" % pformat(headers))
+            self.logger.info("Request data: \n %s" % pformat(data))
+            self.logger.info("Response data: \n %s" % body)
+            message = "Http error occurred on doing API call: %d %s" % (
+                response.status_code, response.reason)
             raise BulkException(message)
-        return connection.read()
+        if stream:
+            return StreamResponse(response)
+        return response.content
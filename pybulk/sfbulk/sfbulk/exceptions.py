@@ -36,3 +36,11 @@ class BulkException(Exception):
 
     def __str__(self):
         return self.get_detail()
+
+
+class InvalidSessionException(BulkException):
+    """
+    Session id is expired or invalid, request can be sent again
+    after login.
+    """
+    default_detail = u'Invalid session id'
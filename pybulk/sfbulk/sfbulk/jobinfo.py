@@ -17,8 +17,6 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with sfbulk.  If not, see <http://www.gnu.org/licenses/>.
 """
-import xml.dom.minidom
-
 from sfbulk.exceptions import BulkException
 from sfbulk.utils_xml import createxmlNode
 
@@ -32,6 +30,7 @@ class BulkJobInfo(object):
 
     id = None
     batch = None
+    batch_result = None
     state = None
     debug_result = None
     concurrencyMode = u'Parallel'
@@ -40,6 +39,10 @@ class BulkJobInfo(object):
     _object = None
     externalfieldname = None
     jobstate = None
+    # None - PK chunking disabled, '' - default chunk size
+    pk_chunk_size = None
+    # batch ids in order of creation, are known if all batches listed
+    batch_ids = None
 
     # WORDS
     JOBINFO = u'jobinfo'
@@ -51,9 +54,12 @@ class BulkJobInfo(object):
     EXTERNALIDFIELDNAME = u'externalIdFieldName'
     CONCURRENCYMODE = u'concurrencyMode'
     CONTENTTYPE = u'contentType'
+    JOBINFO_XML = u'<?xml version="1.0" encoding="{encoding}"?>' \
+                  u'<{jobinfo} {xmlns}="{asyncapi}">{nodes}</{jobinfo}>'
 
     def __init__(self, logger=None):
         self.batch = {}
+        self.batch_result = {}
         self.logger = logger
 
     def findBatchState(self, batchId):
@@ -76,47 +82,38 @@ class BulkJobInfo(object):
         This information will correspondent
         to single job information in Salesforce.
         """
-        root, jobinfo = self.__set_headers()
-
+        nodes = []
         if self.operation is not None:
-            jobinfo.appendChild(
-                createxmlNode(self.OPERATION, str(self.operation).lower()))
+            nodes.append(createxmlNode(self.OPERATION, str(self.operation)))
         if self._object is not None:
-            jobinfo.appendChild(createxmlNode(self.OBJECT, self._object))
+            nodes.append(createxmlNode(self.OBJECT, self._object))
         if self.externalfieldname is not None:
-            jobinfo.appendChild(
-                createxmlNode(self.EXTERNALIDFIELDNAME,
-                              self.externalfieldname))
+            nodes.append(createxmlNode(self.EXTERNALIDFIELDNAME,
+                                       self.externalfieldname))
         if self.concurrencyMode is not None:
-            jobinfo.appendChild(
-                createxmlNode(self.CONCURRENCYMODE, self.concurrencyMode))
+            nodes.append(createxmlNode(self.CONCURRENCYMODE,
+                                       self.concurrencyMode))
         if self.contentType is not None:
-            jobinfo.appendChild(
-                createxmlNode(self.CONTENTTYPE, self.contentType))
+            nodes.append(createxmlNode(self.CONTENTTYPE, self.contentType))
 
-        return self.__return_xml(root, jobinfo)
+        return self.__return_xml(nodes)
 
     def closeJob(self):
         """
         Close the individual job information.
         """
-        root, jobinfo = self.__set_headers()
-
+        nodes = []
         if self.state is not None:
-            jobinfo.appendChild(createxmlNode('state', self.state))
-
-        return self.__return_xml(root, jobinfo)
+            nodes.append(createxmlNode('state', self.state))
 
-    def __set_headers(self):
-        root = xml.dom.minidom.Document()
-        jobinfo = root.createElement(self.JOBINFO)
-        jobinfo.setAttribute(
-            self.XMLNS, self.ASYNCAPI)
-        return root, jobinfo
+        return self.__return_xml(nodes)
 
-    def __return_xml(self, root, jobinfo):
-        root.appendChild(jobinfo)
-        return root.toxml(self.UTF8)
+    def __return_xml(self, nodes):
+        return self.JOBINFO_XML.format(jobinfo=self.JOBINFO,
+                                       xmlns=self.XMLNS,
+                                       asyncapi=self.ASYNCAPI,
+                                       encoding=self.UTF8,
+                                       nodes=u''.join(nodes)).encode(self.UTF8)
 
 
 class JobInfo(object):
@@ -125,7 +122,8 @@ class JobInfo(object):
     """
 
     @staticmethod
-    def factory(operation, sf_object, externalidfield=None):
+    def factory(operation, sf_object, externalidfield=None,
+                pk_chunk_size=None, concurrency_mode=None):
         """
         Prepares jobinfo object.
 
@@ -135,6 +133,10 @@ class JobInfo(object):
         @param _object: type of object eg. Account
         @type _object: type of Salesforce object
         @param _object: type of object eg. Account
+        @type pk_chunk_size: string
+        @param pk_chunk_size: enable PK chunking for query
+        @type concurrency_mode: string
+        @param concurrency_mode: Parallel (by default) / Serial
 
         @rtype: JobInfo object
         @return:JobInfo object filled with predefined data
@@ -154,6 +156,9 @@ class JobInfo(object):
         jobinfo = BulkJobInfo()
         jobinfo.operation = operation
         jobinfo._object = sf_object
+        jobinfo.pk_chunk_size = pk_chunk_size
+        if concurrency_mode is not None:
+            jobinfo.concurrencyMode = concurrency_mode
 
         if operation == UPSERT:
             jobinfo.externalfieldname = externalidfield
@@ -55,6 +55,13 @@ class sf(object):
     SOAP_URL = u'https://{domain}.salesforce.com/services/Soap/u/{sf_version}'
     DOMAIN = u'login'
 
+    # http session and timeout of login request
+    session = requests
+    timeout = None
+    # session timeout if it's not returned by login, seconds
+    SESSION_SECONDS_VALID = 900
+    session_seconds_valid = None
+
     def login(self, username=u'', password=u'', security_token=u'',
               sf_version=u'37.0', sandbox=False):
         """
@@ -109,15 +116,29 @@ class sf(object):
     # HELPERS
 
     def _send_login_request(self, soap_url, login_soap_request_body):
-        return requests.post(soap_url,
-                             login_soap_request_body,
-                             headers=LOGIN_SOAP_REQUEST_HEADERS)
+        return self.session.post(soap_url,
+                                 login_soap_request_body,
+                                 headers=LOGIN_SOAP_REQUEST_HEADERS,
+                                 timeout=self.timeout)
 
     def _set_credentials(self, response):
         dict_result = parseXMLResult(response.content)
-        self.sessionid = dict_result['sessionId']
-        self.soap_server = dict_result['serverUrl']
-        self.bulk_server = dict_result['serverUrl'].split('services')[0][:-1]
+        self.session_seconds_valid = int(
+            dict_result.get('sessionSecondsValid', self.SESSION_SECONDS_VALID))
+        self.set_session(dict_result['sessionId'], dict_result['serverUrl'])
+
+    def set_session(self, sessionid, soap_server):
+        """
+        Use session which is already logged in.
+
+        @type sessionid: string
+        @param sessionid: session id
+        @type soap_server: string
+        @param soap_server: server url returned by login
+        """
+        self.sessionid = sessionid
+        self.soap_server = soap_server
+        self.bulk_server = soap_server.split('services')[0][:-1]
 
     @staticmethod
     def _check_response(response):
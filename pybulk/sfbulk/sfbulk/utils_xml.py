@@ -17,26 +17,115 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with sfbulk.  If not, see <http://www.gnu.org/licenses/>.
 """
-import xml.dom.minidom
+import pyexpat
+from xml.sax.saxutils import escape
 
 
-# CONSTANTS FOR XML ELEMENT IDENTIFIER
-ELEMENT_NODE = 1
-TEXT_NODE = 3
+# quotes are escaped in text the same way as minidom does
+XML_ESCAPES = {u'"': u'&quot;'}
 
 
 def createxmlNode(element, value):
     """
-    Utility to create XML Node Element.
+    Utility to create serialized XML Node Element.
 
     @type: string
     @param element: XML Node tag
     @type: string
     @param value: XML node tag value
     """
-    xmls = xml.dom.minidom.Element(element)
-    xmls.appendChild(xml.dom.minidom.Document().createTextNode(value))
-    return xmls
+    return u'<%s>%s</%s>' % (element, escape(value, XML_ESCAPES), element)
+
+
+class _DictBuilder(object):
+    """
+    Expat handlers transforming XML into dicts while it's parsed,
+    no document tree is built. Every text node is stored into dict
+    under name of element having that text, text of root is ignored.
+    Every child of root gets dict returned by child_start, the dict is
+    passed to child_end when child is closed. Element named listname
+    gets list of dicts, one dict per child node of that element.
+    """
+
+    def __init__(self, child_start, child_end=None, listname=None):
+        self.child_start = child_start
+        self.child_end = child_end
+        self.listname = listname
+        self.listname_lower = listname and listname.lower()
+        # (element name, dict or list getting content of element)
+        self.stack = []
+        self.text = []
+        # None - not in cdata section, False - section has no data yet
+        self.cdata = None
+
+    def parse(self, raw_xml):
+        parser = pyexpat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        parser.StartCdataSectionHandler = self.start_cdata
+        parser.EndCdataSectionHandler = self.end_cdata
+        # like in DOM, text is splitted by comments and instructions
+        parser.CommentHandler = self.other_node
+        parser.ProcessingInstructionHandler = self.other_node
+        parser.Parse(raw_xml, True)
+
+    def character_data(self, data):
+        if self.cdata is None:
+            self.text.append(data)
+        elif not self.cdata:
+            # cdata section is node without text, empty one is skipped
+            self.cdata = True
+            self.other_node()
+
+    def start_cdata(self):
+        self.flush_text()
+        self.cdata = False
+
+    def end_cdata(self):
+        self.cdata = None
+
+    def other_node(self, *args):
+        """ Node which is neither text nor element """
+        self.flush_text()
+        if self.stack and type(self.stack[-1][1]) is list:
+            self.stack[-1][1].append({})
+
+    def flush_text(self):
+        if not self.text:
+            return
+        value = u''.join(self.text)
+        self.text = []
+        name, content = self.stack[-1]
+        if type(content) is dict:
+            content[name] = value
+        elif content is not None:
+            content.append({name: value})
+
+    def start_element(self, name, attrs):
+        self.flush_text()
+        depth = len(self.stack)
+        if not depth:
+            content = None
+        elif depth == 1:
+            content = self.child_start()
+        else:
+            content = self.stack[-1][1]
+            if type(content) is list:
+                keyval = {}
+                content.append(keyval)
+                content = keyval
+            if self.listname and name.lower() == self.listname_lower:
+                content[self.listname] = []
+                content = content[self.listname]
+        self.stack.append((name, content))
+
+    def end_element(self, name):
+        self.flush_text()
+        name, content = self.stack.pop()
+        if len(self.stack) == 1 and self.child_end:
+            self.child_end(content)
 
 
 def parseXMLResult(raw_xml):
@@ -47,48 +136,41 @@ def parseXMLResult(raw_xml):
     @param raw_xml: XML which is represented in string
     """
     # parse the job result
-    retval = {}
-
-    parse_resp = xml.dom.minidom.parseString(raw_xml)
-    Root = parse_resp.documentElement
+    retval = [{}]
 
     # items having same key are supported here
-    for child in Root.childNodes:
-        if child.nodeType == ELEMENT_NODE:
-            keyval = {}
-            keyval = _parseElement(child.childNodes, keyval)
-            if keyval:
-                key = keyval.keys()[0]
-                if not retval:
-                    retval = keyval
-                elif key in retval.keys():
-                    number = len(retval) + 1
-                    duplicate_key = '%s-%s' % (key, str(number).zfill(3))
-                    retval[duplicate_key] = keyval[key]
-                else:
-                    retval.update(keyval)
-    return retval
-
-def _parseElement(nodeElement, dataval):
+    def merge(keyval):
+        if not keyval:
+            return
+        key = keyval.keys()[0]
+        if not retval[0]:
+            retval[0] = keyval
+        elif key in retval[0]:
+            number = len(retval[0]) + 1
+            duplicate_key = '%s-%s' % (key, str(number).zfill(3))
+            retval[0][duplicate_key] = keyval[key]
+        else:
+            retval[0].update(keyval)
+
+    _DictBuilder(dict, merge).parse(raw_xml)
+    return retval[0]
+
+def parseXMLResultItems(raw_xml):
     """
-    Helper methods to parse each XML Element.
+    Helper methods to transform XML list of items to list of dicts,
+    e.g. batchInfoList.
 
-    @type: XMLElement
-    @param nodeElement: nodeElement
-    @type: dict
-    @param dataval: dataval
+    @type: string
+    @param raw_xml: XML which is represented in string
     """
-    if type(nodeElement) == xml.dom.minidom.NodeList:
-        for child in nodeElement:
-            _parseElement(child, dataval)
-        return dataval
+    retval = []
+
+    def new_item():
+        retval.append({})
+        return retval[-1]
 
-    if nodeElement.nodeType == TEXT_NODE:
-        dataval[nodeElement.parentNode.nodeName] = nodeElement.nodeValue
-        return dataval
-    else:
-        if nodeElement.nodeType == ELEMENT_NODE:
-            _parseElement(nodeElement.childNodes, dataval)
+    _DictBuilder(new_item).parse(raw_xml)
+    return retval
 
 
 def parseXMLResultList(raw_xml, listname):
@@ -101,41 +183,6 @@ def parseXMLResultList(raw_xml, listname):
     # parse the job result
     retval = {}
 
-    parse_resp = xml.dom.minidom.parseString(raw_xml)
-    Root = parse_resp.documentElement
-
     # items having same key are supported here
-    for child in Root.childNodes:
-        if child.nodeType == ELEMENT_NODE:
-            retval = _parseElementList(child.childNodes, retval, listname)
+    _DictBuilder(lambda: retval, listname=listname).parse(raw_xml)
     return retval
-
-
-def _parseElementList(nodeElement, dataval, listname=None):
-    """
-    Helper methods to parse each XML Element.
-
-    @type: XMLElement
-    @param nodeElement: nodeElement
-    @type: dict
-    @param dataval: dataval
-    """
-    if type(nodeElement) == xml.dom.minidom.NodeList:
-        for child in nodeElement:
-            _parseElementList(child, dataval, listname)
-        return dataval
-
-    if nodeElement.nodeType == TEXT_NODE:
-        if type(dataval) is dict:
-            dataval[nodeElement.parentNode.nodeName] = nodeElement.nodeValue
-        return dataval
-    else:
-        if nodeElement.nodeType == ELEMENT_NODE:
-            if listname  and nodeElement.nodeName.lower() == listname.lower():
-                dataval[listname] = []
-                for child in nodeElement.childNodes:
-                    keyval = {}
-                    _parseElementList(child, keyval, listname)
-                    dataval[listname].append(keyval)
-            else:
-                _parseElementList(nodeElement.childNodes, dataval, listname)
@@ -25,6 +25,7 @@ __author__ = "Yaroslav Litvinov"
 import mock
 import requests
 import requests_mock
+from StringIO import StringIO
 from collections import namedtuple
 
 OATH_RESP = '{"access_token":"someaccesstoken.blablabla30xzbENMJgDaL.eyU0wIUi61Uc41XBgv06CXTrpR5a7iN9abDDIaYVyDundZP35734768NoKW1RMWf.tokeniCs","instance_url":"https://fake-host.salesforce.com","id":"https://test.salesforce.com/id/00Dn00000000YB8EAM/005n00000026666666","token_type":"Bearer","issued_at":"1498150538789","signature":"vc+uz6456234627788845836845848++Rasd43Xop6Q="}'
@@ -34,6 +35,7 @@ LOGIN_RESP = '<?xml version="1.0" encoding="UTF-8"?><soapenv:Envelope xmlns:soap
 #operation=insert/update/query
 #state=Open/Closed
 #jobid=
+#completed=/failed=/total= batches counters
 JOB_INFO_RESP_FMT = """<?xml version="1.0" encoding="UTF-8"?><jobInfo xmlns="http://www.force.com/2009/06/asyncapi/dataload">
  <id>{jobid}</id>
  <operation>{operation}</operation>
@@ -46,9 +48,9 @@ JOB_INFO_RESP_FMT = """<?xml version="1.0" encoding="UTF-8"?><jobInfo xmlns="htt
  <contentType>CSV</contentType>
  <numberBatchesQueued>0</numberBatchesQueued>
  <numberBatchesInProgress>0</numberBatchesInProgress>
- <numberBatchesCompleted>0</numberBatchesCompleted>
- <numberBatchesFailed>0</numberBatchesFailed>
- <numberBatchesTotal>0</numberBatchesTotal>
+ <numberBatchesCompleted>{completed}</numberBatchesCompleted>
+ <numberBatchesFailed>{failed}</numberBatchesFailed>
+ <numberBatchesTotal>{total}</numberBatchesTotal>
  <numberRecordsProcessed>0</numberRecordsProcessed>
  <numberRetries>0</numberRetries>
  <apiVersion>38.0</apiVersion>
@@ -74,12 +76,24 @@ BATCH_INFO_RESP_FMT="""<?xml version="1.0" encoding="UTF-8"?><batchInfo xmlns="h
  <apexProcessingTime>0</apexProcessingTime>
 </batchInfo>"""
 
+BATCH_INFO_LIST_RESP_FMT="""<?xml version="1.0" encoding="UTF-8"?><batchInfoList xmlns="http://www.force.com/2009/06/asyncapi/dataload">{batches}</batchInfoList>"""
+
 def mock_oauth(m):
     m.post(url="https://fake-host.salesforce.com/services/oauth2/token", text = OATH_RESP)
     
 def mock_login(m):
     m.post(url="https://test.salesforce.com/services/Soap/u/37.0", text = LOGIN_RESP)
 
+REST_QUERY_URL = 'https://fake-host.salesforce.com/services/data/v41.0/query'
+
+def mock_rest_query(m, records):
+    """ Single page of REST query result """
+    for record in records:
+        record['attributes'] = {'type': 'Account'}
+    m.get(url=REST_QUERY_URL, json={'totalSize': len(records),
+                                    'done': True,
+                                    'records': records})
+
 MockData = namedtuple('MockData', ['req', 'resp'])
     
 class SFMock(object):
@@ -88,31 +102,78 @@ class SFMock(object):
     def __init__(self, host):
         self.host = host
         self.mocks = []
+        # {(url, request data): response} for requests sent concurrently
+        self.data_mocks = {}
         
     def addmock_insert_update_delete(self, operation, jobid, batchid, resp):
         self._open_job(operation, jobid)
         self._batch_info(state='Queued', batchid=batchid, new=True)
-        self._batch_info(state='InProgress', batchid=batchid)
-        self._batch_info(state='Completed', batchid=batchid)
+        self._job_info(completed=0, failed=0, total=1)
+        self._job_info(completed=1, failed=0, total=1)
         self._batch_simple_result(resp)
         self._close_job()
 
     def addmock_query(self, operation, jobid, batchid, result):
         self._open_job(operation, jobid)
         self._batch_info(state='Queued', batchid=batchid, new=True)
-        self._batch_info(state='Completed', batchid=batchid)
+        self._job_info(completed=1, failed=0, total=1)
         self._batch_chunked_result(result)
         self._close_job()
 
+    def addmock_multi_batch(self, operation, jobid, batches):
+        """ batches -- [(batchid, batch data, result)], batch is
+        created by its data as batches are uploaded in any order """
+        self._open_job(operation, jobid)
+        for batchid, data, _ in batches:
+            self.data_mocks[('%s/job/%s/batch' % (self.baseurl, jobid), data)] = \
+                BATCH_INFO_RESP_FMT.format(state='Queued', jobid=jobid,
+                                           batchid=batchid)
+        self._job_info(completed=len(batches), failed=0, total=len(batches))
+        for batchid, _, resp in batches:
+            self.batchid = batchid
+            self._batch_simple_result(resp)
+        self._close_job()
+
+    def addmock_pkchunk_query(self, operation, jobid, batchid, chunk_batches):
+        self._open_job(operation, jobid)
+        self._batch_info(state='Queued', batchid=batchid, new=True)
+        # server still creating batches
+        self._batch_info_list([(batchid, 'Queued')])
+        self._batch_info_list([(batchid, 'NotProcessed')] +
+                              [(x[0], 'Completed') for x in chunk_batches])
+        for chunk_batchid, result in chunk_batches:
+            self.batchid = chunk_batchid
+            self._batch_chunked_result(result)
+        self._close_job()
+
+    def addmock_failed_batch(self, operation, jobid, batchid):
+        self._open_job(operation, jobid)
+        self._batch_info(state='Queued', batchid=batchid, new=True)
+        self._job_info(completed=0, failed=1, total=1)
+        self._batch_info(state='Failed', batchid=batchid)
+        self._close_job()
+
     def addmock_bad_query(self, operation, jobid, batchid, result):
         self._open_job(operation, jobid)
         self._batch_info(state='Queued', batchid=batchid, new=True)
+        self._job_info(completed=0, failed=1, total=1)
         self._batch_info(state='Failed', batchid=batchid)
-        self._batch_info(state='Closed', batchid=batchid)
         self._close_job()
 
     def side_effect(self):
-        return [x.resp for x in self.mocks]        
+        """ Every url has it's own sequence of responses """
+        responses = {}
+        for mock_data in self.mocks:
+            responses.setdefault(mock_data.req, []).append(mock_data.resp)
+        def docall(url, method, tdata=None, headers=None, stream=False):
+            if (url, tdata) in self.data_mocks:
+                resp = self.data_mocks[(url, tdata)]
+            else:
+                resp = responses[url].pop(0)
+            if stream:
+                return StringIO(resp)
+            return resp
+        return docall
         
     def _batch_simple_result(self, resp):
         self.mocks.append(MockData(
@@ -139,12 +200,32 @@ class SFMock(object):
         self.mocks.append(MockData(req='%s/job' % (self.baseurl),
                                    resp=JOB_INFO_RESP_FMT.format(state='Open',
                                                                  jobid=self.jobid,
-                                                                 operation=self.operation)))
+                                                                 operation=self.operation,
+                                                                 completed=0, failed=0, total=0)))
+    def _job_info(self, completed, failed, total):
+        self.mocks.append(MockData(req='%s/job/%s' % (self.baseurl, self.jobid),
+                                   resp=JOB_INFO_RESP_FMT.format(state='Open',
+                                                                 jobid=self.jobid,
+                                                                 operation=self.operation,
+                                                                 completed=completed,
+                                                                 failed=failed,
+                                                                 total=total)))
     def _close_job(self):
         self.mocks.append(MockData(req='%s/job/%s' % (self.baseurl, self.jobid),
                                    resp=JOB_INFO_RESP_FMT.format(state='Closed',
                                                                  jobid=self.jobid,
-                                                                 operation=self.operation)))
+                                                                 operation=self.operation,
+                                                                 completed=0, failed=0, total=0)))
+    def _batch_info_list(self, states):
+        batches = ''.join([BATCH_INFO_RESP_FMT.format(
+            state=state, jobid=self.jobid, batchid=batchid).replace(
+                '<?xml version="1.0" encoding="UTF-8"?>', '').replace(
+                    ' xmlns="http://www.force.com/2009/06/asyncapi/dataload"', '')
+                           for batchid, state in states])
+        self.mocks.append(
+            MockData(req='%s/job/%s/batch' % (self.baseurl, self.jobid),
+                     resp=BATCH_INFO_LIST_RESP_FMT.format(batches=batches)))
+
     def _batch_info(self, state, batchid, new=False):
         self.batchid = batchid
         if new:
@@ -228,6 +309,170 @@ def mock_bad_response(mock_job_is_completed, mock_docall, m):
     Bulk.job_is_completed()
     mock_job_is_completed.assert_any_call()
     
+def mock_multi_batch_insert(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    insert1_resp='''"Id","Success","Created","Error"
+"001n000000HDYkvAAH","true","true",""
+"001n000000HDYkwAAH","true","true",""
+'''
+    insert2_resp='''"Id","Success","Created","Error"
+"001n000000HDYkxAAH","true","true",""
+'''
+    http_mock.addmock_multi_batch(
+        operation='insert', jobid='750n00000020o33FFF',
+        batches=[('751n00000029qH1AAI', 'Name\na\nb\n', insert1_resp),
+                 ('751n00000029qH2AAI', 'Name\nc\n', insert2_resp)])
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_stream_query(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    query_resp_part1 = '''"Name","Billing_Address__c"
+"mriya","Street_Billing_Address ""PICGZSLC0F"""
+'''
+    query_resp_part2 = '''"Name","Billing_Address__c"
+"mriya","Street_Billing_Address
+2YNSCQEHFX"
+'''
+    http_mock.addmock_query(
+        operation='query', jobid='750n00000020o33GGG', batchid='751n00000029q001AI',
+        result=[('752n0000000yXIn', query_resp_part1), ('752n0000000yYIn', query_resp_part2)])
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_pkchunk_query(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    query_resp_part1 = '''"Id"
+"00Tn000000HDYkvAAH"
+'''
+    query_resp_part2 = '''"Id"
+"00Tn000000HDYkwAAH"
+'''
+    empty_resp = 'Records not found for this query'
+    query_resp_part3 = '''"Id"
+"00Tn000000HDYkxAAH"
+'''
+    http_mock.addmock_pkchunk_query(
+        operation='query', jobid='750n00000020o33HHH', batchid='751n00000029q002AI',
+        chunk_batches=[('751n00000029q003AI', [('752n0000000yXIo', query_resp_part1),
+                                               ('752n0000000yXIp', query_resp_part2)]),
+                       ('751n00000029q004AI', [('752n0000000yXIq', empty_resp)]),
+                       ('751n00000029q005AI', [('752n0000000yXIr', query_resp_part3)])])
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_failed_batch(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    http_mock.addmock_failed_batch(
+        operation='insert', jobid='750n00000020o33EEE', batchid='751n00000029q000AY')
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_upsert_hard_delete(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    upsert_resp = '''"Id","Success","Created","Error"
+"001n000000HDYkvAAH","true","false",""
+"001n000000HDYkwAAH","true","true",""
+'''
+    hard_delete_resp = '''"Id","Success","Created","Error"
+"001n000000HDYkvAAH","true","false",""
+'''
+    http_mock.addmock_insert_update_delete(
+        operation='upsert', jobid='750n00000020o33GGG',
+        batchid='751n00000029qG0AAI', resp=upsert_resp)
+    http_mock.addmock_insert_update_delete(
+        operation='hardDelete', jobid='750n00000020o33HHH',
+        batchid='751n00000029qJ0AAI', resp=hard_delete_resp)
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_job_session(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    # two statements are adding batches to the same job
+    http_mock._open_job('insert', '750n00000020o33KKK')
+    for idx, batchid in enumerate(['751n00000029qK1AAI',
+                                   '751n00000029qK2AAI']):
+        http_mock._batch_info(state='Queued', batchid=batchid, new=True)
+        http_mock._job_info(completed=idx + 1, failed=0, total=idx + 1)
+        http_mock._batch_simple_result('''"Id","Success","Created","Error"
+"001n000000HDYk%dAAH","true","true",""
+''' % idx)
+    http_mock._close_job()
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_job_reattach(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    # 1st run is interrupted after batch is created, job is kept open
+    http_mock._open_job('insert', '750n00000020o44KKK')
+    http_mock._batch_info(state='Queued', batchid='751n00000029qK4AAI',
+                          new=True)
+    # 2nd run is attached to the same job
+    http_mock._job_info(completed=0, failed=0, total=1)
+    http_mock._job_info(completed=1, failed=0, total=1)
+    http_mock._batch_simple_result('''"Id","Success","Created","Error"
+"001n000000HDYk4AAH","true","true",""
+''')
+    http_mock._close_job()
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
+def mock_job_reattach_upload(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = SFMock('fake-host')
+
+    # 1st run is interrupted while batches are uploaded
+    http_mock._open_job('insert', '750n00000020o55LLL')
+    for batchid, data in [('751n00000029qL1AAI', 'Name\na\n'),
+                          ('751n00000029qL2AAI', 'Name\nb\n')]:
+        http_mock.data_mocks[('%s/job/750n00000020o55LLL/batch' %
+                              http_mock.baseurl, data)] = \
+            BATCH_INFO_RESP_FMT.format(state='Queued',
+                                       jobid='750n00000020o55LLL',
+                                       batchid=batchid)
+    # 2nd run is attached to the same job and uploads the rest
+    http_mock._job_info(completed=0, failed=0, total=1)
+    http_mock._job_info(completed=2, failed=0, total=2)
+    for idx, batchid in enumerate(['751n00000029qL1AAI',
+                                   '751n00000029qL2AAI']):
+        http_mock.batchid = batchid
+        http_mock._batch_simple_result('''"Id","Success","Created","Error"
+"001n000000HDYl%dAAH","true","true",""
+''' % idx)
+    http_mock._close_job()
+
+    # mock install
+    mock_docall.side_effect = http_mock.side_effect()
+
 def mock_insert_update(mock_docall, m):
     mock_oauth(m)
     mock_login(m)
@@ -0,0 +1,182 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+__author__ = "Yaroslav Litvinov"
+
+import json
+import mock
+import tempfile
+import requests_mock
+import sfbulk.callout
+from configparser import ConfigParser
+from mockers import mock_oauth, mock_login
+from mriya.log import loginit
+from mriya.config import BULK_API_SETTING, BULK_API_2
+from mriya.data_connector import create_bulk_connector
+from mriya.sf_bulk2_connector import SfBulk2Connector
+from mriya.bulk_data import parse_batch_res_data
+from mriya.job_journal import JobJournal
+from mriya.sql_executor import setdatadir, datadir
+from mriya import sf_bulk_connector
+
+config_file = 'test-config.ini'
+JOBS_URL = 'https://fake-host.salesforce.com/services/data/v47.0/jobs'
+
+def create_bulk2_connector(m):
+    loginit(__name__)
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mock_oauth(m)
+    mock_login(m)
+    config = ConfigParser()
+    with open(config_file, 'r') as conf_file:
+        config.read_file(conf_file)
+    config['test'][BULK_API_SETTING] = BULK_API_2
+    return create_bulk_connector(config, 'test')
+
+def job_info(job_id, state):
+    return json.dumps({'id': job_id, 'state': state})
+
+@requests_mock.Mocker()
+def test_bulk2_insert(m):
+    conn = create_bulk2_connector(m)
+    assert isinstance(conn, SfBulk2Connector)
+    job_url = JOBS_URL + '/ingest/7501'
+    m.post(JOBS_URL + '/ingest', text=job_info('7501', 'Open'))
+    m.put(job_url + '/batches', status_code=201)
+    m.patch(job_url, text=job_info('7501', 'UploadComplete'))
+    m.get(job_url, [{'text': job_info('7501', 'InProgress')},
+                    {'text': job_info('7501', 'JobComplete')}])
+    # results order differs from data order
+    m.get(job_url + '/successfulResults/',
+          text='"sf__Id","sf__Created",Name,Info\n\
+"001n02","true","b","x\ny"\n"001n01","true","a",""\n')
+    m.get(job_url + '/failedResults/',
+          text='"sf__Id","sf__Error",Name,Info\n\
+"","REQUIRED_FIELD_MISSING:Name","",""\n')
+    res = conn.bulk_insert('Account',
+                           ['Name,Info\n', 'a,\n', ',\n', 'b,"x<N CR>y"\n',
+                            'c,\n'], 1, False)
+    # whole data is uploaded at once
+    upload = [x for x in m.request_history if x.method == 'PUT'][0]
+    assert upload.text == 'Name,Info\na,\n,\nb,"x\ny"\nc,\n'
+    assert upload.headers['Authorization'] == 'Bearer fakefake.somesessionid'
+    result_ids = parse_batch_res_data(res)
+    assert result_ids.fields == ['Id', 'Success', 'Created', 'Error']
+    assert result_ids.rows == [
+        ('001n01', 'true', 'true', ''),
+        ('', 'false', 'false', 'REQUIRED_FIELD_MISSING:Name'),
+        ('001n02', 'true', 'true', ''),
+        ('', 'false', 'false', 'Record was not processed')]
+
+@requests_mock.Mocker()
+def test_bulk2_insert_reattach(m):
+    conn = create_bulk2_connector(m)
+    setdatadir(tempfile.mkdtemp())
+    journal = JobJournal(datadir())
+    job_url = JOBS_URL + '/ingest/7504'
+    m.post(JOBS_URL + '/ingest', text=job_info('7504', 'Open'))
+    m.put(job_url + '/batches', status_code=201)
+    m.patch(job_url, text=job_info('7504', 'UploadComplete'))
+    m.get(job_url, exc=KeyboardInterrupt)
+    try:
+        conn.bulk_insert('Account', ['Name\n', 'a\n'], 1, False)
+        assert 0
+    except KeyboardInterrupt:
+        pass
+    # uploaded job is neither aborted nor forgotten by interrupt
+    assert [x.method for x in m.request_history
+            if x.url == job_url] == ['PATCH', 'GET']
+    assert journal.load().values()[0]['batches'] == {'0': job_url}
+
+    conn = create_bulk2_connector(m)
+    m.get(job_url, text=job_info('7504', 'JobComplete'))
+    m.get(job_url + '/successfulResults/',
+          text='"sf__Id","sf__Created",Name\n"001n01","true","a"\n')
+    m.get(job_url + '/failedResults/', text='"sf__Id","sf__Error",Name\n')
+    res = conn.bulk_insert('Account', ['Name\n', 'a\n'], 1, False)
+    assert parse_batch_res_data(res).rows == [('001n01', 'true', 'true', '')]
+    # rerun is attached to the job, data isn't uploaded again
+    assert [x.method for x in m.request_history
+            if x.url.startswith(JOBS_URL + '/ingest')].count('POST') == 1
+    assert [x.method for x in m.request_history].count('PUT') == 1
+    assert journal.load() == {}
+
+@requests_mock.Mocker()
+def test_bulk2_insert_reupload(m):
+    conn = create_bulk2_connector(m)
+    setdatadir(tempfile.mkdtemp())
+    m.post(JOBS_URL + '/ingest', [{'text': job_info('7505', 'Open')},
+                                  {'text': job_info('7506', 'Open')}])
+    m.put(JOBS_URL + '/ingest/7505/batches', exc=KeyboardInterrupt)
+    try:
+        conn.bulk_insert('Account', ['Name\n', 'a\n'], 1, False)
+        assert 0
+    except KeyboardInterrupt:
+        pass
+
+    conn = create_bulk2_connector(m)
+    job_url = JOBS_URL + '/ingest/7506'
+    m.patch(JOBS_URL + '/ingest/7505', text=job_info('7505', 'Aborted'))
+    m.put(job_url + '/batches', status_code=201)
+    m.patch(job_url, text=job_info('7506', 'UploadComplete'))
+    m.get(job_url, text=job_info('7506', 'JobComplete'))
+    m.get(job_url + '/successfulResults/',
+          text='"sf__Id","sf__Created",Name\n"001n01","true","a"\n')
+    m.get(job_url + '/failedResults/', text='"sf__Id","sf__Error",Name\n')
+    res = conn.bulk_insert('Account', ['Name\n', 'a\n'], 1, False)
+    assert parse_batch_res_data(res).rows == [('001n01', 'true', 'true', '')]
+    # job with incomplete upload is aborted by rerun and created again
+    abort = [x for x in m.request_history
+             if x.url == JOBS_URL + '/ingest/7505' and x.method == 'PATCH']
+    assert [json.loads(x.text) for x in abort] == [{'state': 'Aborted'}]
+
+@requests_mock.Mocker()
+def test_bulk2_query_pages(m):
+    conn = create_bulk2_connector(m)
+    job_url = JOBS_URL + '/query/7502'
+    m.post(JOBS_URL + '/query', text=job_info('7502', 'UploadComplete'))
+    m.get(job_url, text=job_info('7502', 'JobComplete'))
+    m.get(job_url + '/results?maxRecords=50000',
+          text='"Id","Name"\n"001n01","a"\n', headers={'Sforce-Locator': 'MTA'})
+    m.get(job_url + '/results?maxRecords=50000&locator=MTA',
+          text='"Id","Name"\n"001n02","b"\n', headers={'Sforce-Locator': 'null'})
+    res = conn.bulk_load('Account', 'SELECT Id, Name FROM Account')
+    assert res == ['"Id","Name"', '"001n01","a"', '"001n02","b"', '']
+    query_job = json.loads([x for x in m.request_history
+                            if x.url == JOBS_URL + '/query'][0].text)
+    assert query_job == {'operation': 'query',
+                         'query': 'SELECT Id, Name FROM Account'}
+
+@requests_mock.Mocker()
+def test_bulk2_query_crlf(m):
+    conn = create_bulk2_connector(m)
+    job_url = JOBS_URL + '/query/7503'
+    m.post(JOBS_URL + '/query', text=job_info('7503', 'UploadComplete'))
+    m.get(job_url, text=job_info('7503', 'JobComplete'))
+    page = '"Id","Info"\n"001","line1\r\nline2"\n'
+    m.get(job_url + '/results?maxRecords=50000', text=page)
+    # every chunk boundary, including one between '\r' and '\n'
+    for chunk_size in xrange(1, len(page) + 1):
+        with mock.patch.object(sfbulk.callout, 'STREAM_CHUNK_SIZE',
+                               chunk_size):
+            res = conn.bulk_load('Account', 'SELECT Id, Info FROM Account')
+        assert res == ['"Id","Info"', '"001","line1\r', 'line2"', '']
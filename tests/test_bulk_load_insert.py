@@ -27,8 +27,11 @@ import requests_mock
 import mockers #local
 import sfbulk
 
+import time
 import tempfile
 import logging
+import zlib
+import json
 import sys
 import pprint
 from os import remove
@@ -36,6 +39,7 @@ from StringIO import StringIO
 from logging import getLogger
 from configparser import ConfigParser
 from mriya.config import DEFAULT_SETTINGS_SECTION, SESSIONS_SETTING
+from mriya.config import JOB_SESSION_SETTING, REST_DML_THRESHOLD_SETTING
 from mriya.data_connector import create_bulk_connector
 from mriya.sf_bulk_connector import SfBulkConnector
 from mriya.bulk_data import parse_batch_res_data
@@ -44,9 +48,14 @@ from mriya.bulk_data import csv_from_bulk_data
 from mriya.bulk_data import BulkData
 from mriya.log import loginit
 from mriya import sf_bulk_connector
+from mriya import sf_rest_query
+from mriya import sf_collections
 from mockers import mock_oauth, mock_login
 from mriya_dmt import run_job_from_file    
-from mriya.sql_executor import setdatadir
+from mriya.sql_executor import setdatadir, datadir, SqlExecutor
+from mriya.job_journal import JobJournal
+from mriya.job_syntax_extended import JobSyntaxExtended
+from mriya.job_controller import JobController
 
 SF_NULL_VALUE = '#N/A'
 config_file = 'test-config.ini'
@@ -150,6 +159,10 @@ def test_insert_load(mock_docall, m):
     expected_del_res = BulkData(fields=['Id', 'Success', 'Created', 'Error'],
                             rows=[(delid, u'true', u'false', u'')])
     assert_equality(expected_del_res, del_ids)
+    # only job status is polled when batches are not failed
+    for call in mock_docall.call_args_list:
+        assert call[0][0].find('/batch/') == -1 or \
+            call[0][0].find('/result') != -1
 
 @mock.patch.object(sfbulk.callout.Callout, 'docall')
 @requests_mock.Mocker()
@@ -204,13 +217,535 @@ def test_insert_update(mock_docall, m):
         raise
 
 
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_multi_batch_results(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_multi_batch_insert(mock_docall, m)
+    conn = create_bulk_connector(setup(), 'test')
+
+    bulk_result_ids = conn.bulk_insert('Account',
+                                       ['Name\n', 'a\n', 'b\n', 'c\n'],
+                                       2, False)
+    result_ids = parse_batch_res_data(bulk_result_ids)
+    # batches are uploaded concurrently, results are in order of data
+    assert [x[0] for x in result_ids.rows] == ['001n000000HDYkvAAH',
+                                               '001n000000HDYkwAAH',
+                                               '001n000000HDYkxAAH']
+    # result of every batch is requested only once
+    urls = [x[0][0] for x in mock_docall.call_args_list]
+    for batch_id in ['751n00000029qH1AAI', '751n00000029qH2AAI']:
+        assert urls.count('%s/job/%s/batch/%s/result' % (
+            mockers.SFMock.baseurl, '750n00000020o33FFF', batch_id)) == 1
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_serial_job(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_multi_batch_insert(mock_docall, m)
+    conn = create_bulk_connector(setup(), 'test')
+
+    bulk_result_ids = conn.bulk_insert('Account',
+                                       ['Name\n', 'a\n', 'b\n', 'c\n'],
+                                       2, True)
+    # all batches are uploaded at once into serial job
+    job_request = mock_docall.call_args_list[0][0][2]
+    assert job_request.find('<concurrencyMode>Serial</concurrencyMode>') != -1
+    urls = [x[0][0] for x in mock_docall.call_args_list]
+    assert urls.index('%s/job/%s' % (mockers.SFMock.baseurl,
+                                     '750n00000020o33FFF')) == 3
+    # batches are created in order of data
+    result_ids = parse_batch_res_data(bulk_result_ids)
+    assert [x[0] for x in result_ids.rows] == ['001n000000HDYkvAAH',
+                                               '001n000000HDYkwAAH',
+                                               '001n000000HDYkxAAH']
+
+@requests_mock.Mocker()
+def test_concurrent_batches_upload(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    uploading = []
+    max_uploading = []
+    def dispatch_batch(batch_data):
+        uploading.append(batch_data)
+        max_uploading.append(len(uploading))
+        # first batches are uploaded slower
+        time.sleep(0.01 * (10 - len(batch_data[1])))
+        uploading.remove(batch_data)
+        return batch_data[1].strip()
+    conn.dispatch_batch = dispatch_batch
+    csv_data = ['Name\n'] + ['%s\n' % ('x' * i) for i in xrange(1, 10)]
+    batch_ids = conn.dispatch_batches(conn.iter_batches(csv_data, 1),
+                                      conn.conn_param.concurrent_requests)
+    # ids are in order of data
+    assert batch_ids == ['x' * i for i in xrange(1, 10)]
+    assert max(max_uploading) <= conn.conn_param.concurrent_requests
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_stream_query_to_csv(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_stream_query(mock_docall, m)
+    setup()
+    setdatadir(tempfile.mkdtemp())
+    job_syntax = JobSyntaxExtended(
+        ['SELECT Name, Billing_Address__c FROM src.Account => csv:streamed'])
+    job_controller = JobController(config_file, {'src':'test', 'dst':'test'},
+                                   job_syntax, {}, False)
+    job_controller.run_job()
+    del job_controller
+    # header of 2nd chunk is skipped, newline is escaped
+    with open(SqlExecutor.csv_name('streamed')) as streamed_f:
+        assert streamed_f.read() == '''"Name","Billing_Address__c"
+"mriya","Street_Billing_Address ""PICGZSLC0F"""
+"mriya","Street_Billing_Address<N CR>2YNSCQEHFX"
+'''
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_parallel_chunks_order(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_stream_query(mock_docall, m)
+    docall = mock_docall.side_effect
+    # 1st chunk is downloaded slower than 2nd
+    def slow_docall(url, *args, **kwargs):
+        if url.endswith('752n0000000yXIn'):
+            time.sleep(0.2)
+        return docall(url, *args, **kwargs)
+    mock_docall.side_effect = slow_docall
+    conn = create_bulk_connector(setup(), 'test')
+
+    lines = conn.bulk_load_stream('Account',
+                                  'SELECT Name, Billing_Address__c FROM Account',
+                                  list)
+    assert lines == ['"Name","Billing_Address__c"',
+                     '"mriya","Street_Billing_Address ""PICGZSLC0F"""',
+                     '"mriya","Street_Billing_Address',
+                     '2YNSCQEHFX"']
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_pkchunk_query(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_pkchunk_query(mock_docall, m)
+    setup()
+    setdatadir(tempfile.mkdtemp())
+    job_syntax = JobSyntaxExtended(
+        ['SELECT Id FROM src.Task => csv:pkchunked:pkchunk:250000'])
+    job_controller = JobController(config_file, {'src':'test', 'dst':'test'},
+                                   job_syntax, {}, False)
+    job_controller.run_job()
+    del job_controller
+    # create job request has PK chunking header
+    headers = mock_docall.call_args_list[0][0][3]
+    assert headers['Sforce-Enable-PKChunking'] == 'chunkSize=250000'
+    # results of all chunk batches are saved, original batch is skipped
+    with open(SqlExecutor.csv_name('pkchunked')) as pkchunked_f:
+        assert pkchunked_f.read() == '''"Id"
+"00Tn000000HDYkvAAH"
+"00Tn000000HDYkwAAH"
+"00Tn000000HDYkxAAH"
+'''
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_failed_batch_status(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_failed_batch(mock_docall, m)
+    conn = create_bulk_connector(setup(), 'test')
+
+    conn.bulk.job_create('insert', 'Account')
+    batch_id = conn.bulk.batch_create('Name\nfoo\n')
+    conn.wait_job_completed()
+    assert conn.bulk.jobinfo.findBatchState(batch_id) == 'Failed'
+    conn.bulk.job_close()
+    # batch status is requested only after job reported failed batch
+    urls = [x[0][0] for x in mock_docall.call_args_list]
+    assert urls.count('%s/job/%s/batch/%s' % (mockers.SFMock.baseurl,
+                                              '750n00000020o33EEE',
+                                              batch_id)) == 1
+    assert len(urls) == 5
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_upsert_hard_delete(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_upsert_hard_delete(mock_docall, m)
+    conn = create_bulk_connector(setup(), 'test')
+
+    res = conn.bulk_upsert('Account', ['ExtId__c,Name\n', '1,a\n', '2,b\n'],
+                           10, False, 'ExtId__c')
+    job_request = mock_docall.call_args_list[0][0][2]
+    assert job_request.find('<operation>upsert</operation>') != -1
+    assert job_request.find(
+        '<externalIdFieldName>ExtId__c</externalIdFieldName>') != -1
+    result_ids = parse_batch_res_data(res)
+    assert [x[2] for x in result_ids.rows] == ['false', 'true']
+
+    res = conn.bulk_hard_delete('Account', ['Id\n', '001n000000HDYkvAAH\n'],
+                                10, False)
+    job_request = [x[0][2] for x in mock_docall.call_args_list
+                   if x[0][0].endswith('/job') and x[0][2]][-1]
+    assert job_request.find('<operation>hardDelete</operation>') != -1
+    assert parse_batch_res_data(res).rows[0][0] == '001n000000HDYkvAAH'
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_job_session(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_job_session(mock_docall, m)
+    config = setup()
+    config['test'][JOB_SESSION_SETTING] = 'true'
+    conn = create_bulk_connector(config, 'test')
+
+    for idx in xrange(2):
+        res = conn.bulk_insert('Account', ['Name\n', 'a\n'], 10, False)
+        # every statement gets results of its own batches
+        assert parse_batch_res_data(res).rows[0][0] == \
+            '001n000000HDYk%dAAH' % idx
+    urls = [x[0][0] for x in mock_docall.call_args_list]
+    assert urls.count('%s/job' % mockers.SFMock.baseurl) == 1
+    conn.close_job_session()
+    job_request = mock_docall.call_args_list[-1][0][2]
+    assert job_request.find('<state>Closed</state>') != -1
+    assert conn.session_job is None
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_job_reattach(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_job_reattach(mock_docall, m)
+    setdatadir(tempfile.mkdtemp())
+    journal = JobJournal(datadir())
+    conn = create_bulk_connector(setup(), 'test')
+    conn.wait_job_completed = mock.Mock(side_effect=KeyboardInterrupt)
+    try:
+        conn.bulk_insert('Account', ['Name\n', 'a\n'], 10, False)
+        assert 0
+    except KeyboardInterrupt:
+        pass
+    # job of interrupted statement is kept in journal
+    assert len(journal.load()) == 1
+
+    conn = create_bulk_connector(setup(), 'test')
+    res = conn.bulk_insert('Account', ['Name\n', 'a\n'], 10, False)
+    assert parse_batch_res_data(res).rows[0][0] == '001n000000HDYk4AAH'
+    urls = [x[0][0] for x in mock_docall.call_args_list]
+    assert urls.count('%s/job' % mockers.SFMock.baseurl) == 1
+    assert journal.load() == {}
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_job_reattach_upload(mock_docall, m):
+    # mock setup
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mockers.mock_job_reattach_upload(mock_docall, m)
+    setdatadir(tempfile.mkdtemp())
+    journal = JobJournal(datadir())
+    conn = create_bulk_connector(setup(), 'test')
+    dispatch_batch = conn.dispatch_batch
+    def interrupted_dispatch(batch_data):
+        if batch_data[1] == 'b\n':
+            raise KeyboardInterrupt()
+        return dispatch_batch(batch_data)
+    conn.dispatch_batch = interrupted_dispatch
+    try:
+        conn.bulk_insert('Account', ['Name\n', 'a\n', 'b\n'], 1, True)
+        assert 0
+    except KeyboardInterrupt:
+        pass
+    # job and its batch created before interrupt are journaled
+    entry = journal.load().values()[0]
+    assert entry['job_id'] == '750n00000020o55LLL'
+    assert entry['batches'] == {'0': '751n00000029qL1AAI'}
+
+    conn = create_bulk_connector(setup(), 'test')
+    res = conn.bulk_insert('Account', ['Name\n', 'a\n', 'b\n'], 1, True)
+    assert [x[0] for x in parse_batch_res_data(res).rows] == \
+        ['001n000000HDYl0AAH', '001n000000HDYl1AAH']
+    # interrupted job is neither closed nor recreated, only batch which
+    # wasn't uploaded yet is created by rerun
+    job_url = '%s/job' % mockers.SFMock.baseurl
+    calls = [x[0] for x in mock_docall.call_args_list]
+    assert [x[0] for x in calls].count(job_url) == 1
+    assert [x[2] for x in calls if x[0].endswith('/batch')] == \
+        ['Name\na\n', 'Name\nb\n']
+    assert journal.load() == {}
+
+@requests_mock.Mocker()
+def test_rest_query(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    m.get(mockers.REST_QUERY_URL, json={
+        'totalSize': 2, 'done': False,
+        'nextRecordsUrl': '/services/data/v41.0/query/01gn-1',
+        'records': [{'attributes': {'type': 'Contact'}, 'Id': '003n01',
+                     'Account': {'attributes': {'type': 'Account'},
+                                 'Name': u'\u043c\u0440\u0456\u044f "1"'},
+                     'HasOptedOutOfEmail': False, 'Title': 'a\nb'}]})
+    m.get(mockers.REST_QUERY_URL + '/01gn-1', json={
+        'totalSize': 2, 'done': True,
+        'records': [{'attributes': {'type': 'Contact'}, 'Id': '003n02',
+                     'Account': None, 'HasOptedOutOfEmail': True,
+                     'Title': None}]})
+    query = 'SELECT Id, account.Name, HasOptedOutOfEmail, Title FROM Contact'
+    lines = conn.rest_load_stream(query, list)
+    assert lines == [
+        '"Id","account.Name","HasOptedOutOfEmail","Title"',
+        '"003n01","\xd0\xbc\xd1\x80\xd1\x96\xd1\x8f ""1""","false","a\nb"',
+        '"003n02","","true",""']
+    assert m.request_history[-2].qs == {'q': [query.lower()]}
+
+@requests_mock.Mocker()
+def test_rest_query_count(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    m.get(mockers.REST_QUERY_URL, [
+        {'json': {'totalSize': 42, 'done': True, 'records': []}},
+        {'json': {'totalSize': 1, 'done': True, 'records': [
+            {'attributes': {'type': 'AggregateResult'},
+             'cnt': 5, 'expr0': 1.5}]}}])
+    assert conn.rest_load_stream('SELECT count() FROM Account', list) == \
+        ['"count"', '"42"']
+    assert conn.rest_load_stream(
+        'SELECT COUNT(Id) cnt, MAX(Amount) FROM Opportunity', list) == \
+        ['"cnt","expr0"', '"5","1.5"']
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_rest_query_same_as_bulk(mock_docall, m):
+    mock_oauth(m)
+    mock_login(m)
+    http_mock = mockers.SFMock('fake-host')
+    http_mock.addmock_query(
+        operation='query', jobid='750n00000021GV7AAM',
+        batchid='751n0000002ABy7AAG', result=[('752n0000000ylj9', '''\
+"Id","Amount","Probability","CloseDate","LastModifiedDate","IsWon","Name"
+"006n01","12345678901.23","0.1","2017-03-01","2017-03-01T12:00:00.000Z",\
+"true",""
+''')])
+    mock_docall.side_effect = http_mock.side_effect()
+    mockers.mock_rest_query(m, [{
+        'Id': '006n01', 'Amount': 12345678901.23, 'Probability': 0.1,
+        'CloseDate': '2017-03-01',
+        'LastModifiedDate': '2017-03-01T12:00:00.000+0000',
+        'IsWon': True, 'Name': None}])
+    conn = create_bulk_connector(setup(), 'test')
+    query = 'SELECT Id, Amount, Probability, CloseDate, LastModifiedDate, \
+IsWon, Name FROM Opportunity'
+    bulk_lines = conn.bulk_load_stream('Opportunity', query, list)
+    assert conn.rest_load_stream(query, list) == bulk_lines
+    assert bulk_lines[1].startswith('"006n01","12345678901.23",')
+
+def test_small_query():
+    assert sf_rest_query.is_small_query('SELECT count() FROM Account')
+    assert sf_rest_query.is_small_query(
+        'SELECT AccountId, SUM(Amount) FROM Opportunity GROUP BY AccountId')
+    # limited queries are sent by REST API only if it's enabled
+    assert not sf_rest_query.is_small_query('SELECT Id FROM Account LIMIT 10')
+    assert sf_rest_query.is_small_query('SELECT Id FROM Account LIMIT 10',
+                                        2000)
+    assert not sf_rest_query.is_small_query(
+        'SELECT Id FROM Account LIMIT 100000', 2000)
+    assert not sf_rest_query.is_small_query(
+        "SELECT Id, (SELECT Id FROM Contacts LIMIT 1) FROM Account \
+WHERE Name = 'count(1)'")
+    assert sf_rest_query.select_fields(
+        "SELECT Id, (SELECT Id, Name FROM Contacts) FROM Account") == \
+        ['Id', '(SELECT Id, Name FROM Contacts)']
+
+@mock.patch.object(sf_collections, 'COLLECTIONS_SIZE', 2)
+@requests_mock.Mocker()
+def test_collections_dml(m):
+    mock_oauth(m)
+    mock_login(m)
+    config = setup()
+    config['test'][REST_DML_THRESHOLD_SETTING] = '5'
+    conn = create_bulk_connector(config, 'test')
+    url = 'https://fake-host.salesforce.com/services/data/v46.0/composite/sobjects'
+
+    def update_results(request, context):
+        results = []
+        for record in request.json()['records']:
+            if record.get('Name'):
+                results.append({'id': record['Id'], 'success': True,
+                                'errors': []})
+            else:
+                results.append({'id': record['Id'], 'success': False,
+                                'errors': [{'statusCode': 'UNABLE_TO_LOCK_ROW',
+                                            'message': 'unable to obtain lock',
+                                            'fields': []}]})
+        return results
+    m.patch(url, json=update_results)
+    # requests are running in parallel
+    res = conn.bulk_update('Account', ['Id,Name,Phone\n', '001n01,a,#N/A\n',
+                                       '001n02,"b<N CR>c",\n', '001n03,,\n',
+                                       '001n04,d,\n'], 10, False)
+    assert res == ['"Id","Success","Created","Error"',
+                   '"001n01","true","false",""',
+                   '"001n02","true","false",""',
+                   '"001n03","false","false","UNABLE_TO_LOCK_ROW:unable to obtain lock: --"',
+                   '"001n04","true","false",""', '']
+    records = sorted([x.json()['records'] for x in m.request_history
+                      if x.method == 'PATCH'], key=lambda x: x[0]['Id'])
+    assert records[0] == [
+        {'attributes': {'type': 'Account'}, 'Id': '001n01', 'Name': 'a',
+         'Phone': None},
+        {'attributes': {'type': 'Account'}, 'Id': '001n02', 'Name': 'b\nc'}]
+
+    m.delete(url + '?ids=001n01&allOrNone=false',
+             json=[{'id': '001n01', 'success': True, 'errors': []}])
+    res = conn.bulk_delete('Account', ['Id\n', '001n01\n'], 10, True)
+    assert parse_batch_res_data(res).rows == [('001n01', 'true', 'false', '')]
+
+    # big statement is sent by bulk job
+    conn.bulk_common_ = mock.Mock(return_value=['"Id","Success","Created","Error"', ''])
+    conn.bulk_insert('Account', ['Name\n'] + ['a\n'] * 5, 10, False)
+    assert conn.bulk_common_.called
+
+@mock.patch.object(sfbulk.callout.Callout, 'docall')
+@requests_mock.Mocker()
+def test_session_expired(mock_docall, m):
+    sf_bulk_connector.JOB_CHECK_TIMER = 0
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    http_mock = mockers.SFMock('fake-host')
+    http_mock.addmock_insert_update_delete(
+        operation='insert', jobid='750n00000020o55KKK',
+        batchid='751n00000029qK5AAI',
+        resp='"Id","Success","Created","Error"\n"001n05","true","true",""\n')
+    docall = http_mock.side_effect()
+    def expiring_docall(url, method, tdata=None, headers=None, stream=False):
+        if headers['X-SFDC-Session'] == 'fakefake.somesessionid' and \
+           url.endswith('/batch'):
+            raise sfbulk.InvalidSessionException()
+        return docall(url, method, tdata, headers, stream)
+    mock_docall.side_effect = expiring_docall
+    login_url = 'https://test.salesforce.com/services/Soap/u/37.0'
+    m.post(login_url, text=mockers.LOGIN_RESP.replace(
+        'fakefake.somesessionid', 'fakefake.newsessionid'))
+    res = conn.bulk_insert('Account', ['Name\n', 'a\n'], 10, False)
+    # batch is created by the same job after login
+    assert parse_batch_res_data(res).rows == [('001n05', 'true', 'true', '')]
+    assert conn.bulk.sessionid == 'fakefake.newsessionid'
+    # session is already renewed by another thread
+    conn.bulk.relogin('fakefake.somesessionid')
+    # initial login and single login after expiration
+    assert len([x for x in m.request_history if x.url == login_url]) == 2
+
+    # REST request is sent again with new session
+    m.post(login_url, text=mockers.LOGIN_RESP)
+    m.get(mockers.REST_QUERY_URL, [
+        {'status_code': 401, 'json': [{'errorCode': 'INVALID_SESSION_ID'}]},
+        {'json': {'totalSize': 3, 'done': True, 'records': []}}])
+    conn.bulk.sessionid = 'fakefake.expiredsessionid'
+    assert conn.rest_load_stream('SELECT count() FROM Account', list) == \
+        ['"count"', '"3"']
+    # session renewed already is taken from sessions cache
+    assert m.request_history[-1].headers['Authorization'] == \
+        'Bearer fakefake.newsessionid'
+    assert len([x for x in m.request_history if x.url == login_url]) == 2
+
 @requests_mock.Mocker()
-def test_upsert_unsupported(m):
+def test_sessions_cache(m):
+    mock_oauth(m)
+    mock_login(m)
+    config = setup()
+    login_url = 'https://test.salesforce.com/services/Soap/u/37.0'
+    conn = create_bulk_connector(config, 'test')
+    conn2 = create_bulk_connector(config, 'test')
+    # oauth token of older sessions file format is kept
+    sessions_file_name = config[DEFAULT_SETTINGS_SECTION][SESSIONS_SETTING]
+    with open(sessions_file_name) as sessions_f:
+        sessions = json.load(sessions_f)
+    assert sessions['someuser'] == {'token': 'someaccesstoken'}
+    # both connectors of endpoint are using single login
+    assert len([x for x in m.request_history if x.url == login_url]) == 1
+    assert conn2.bulk.sessionid == conn.bulk.sessionid
+    assert conn2.bulk.bulk_server == 'https://fake-host.salesforce.com'
+    # expiry of session is known from login response
+    username = conn.conn_param.username
+    assert 28800 - 10 < sessions[username]['expires'] - time.time() <= 28800
+    # expiring session is not reused
+    sessions[username]['expires'] = time.time() + 60
+    with open(sessions_file_name, 'w') as sessions_f:
+        json.dump(sessions, sessions_f)
+    create_bulk_connector(config, 'test')
+    assert len([x for x in m.request_history if x.url == login_url]) == 2
+
+@requests_mock.Mocker()
+def test_callout_session(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    # connections pool is sized by concurrent requests by default
+    adapter = conn.bulk.session.adapters['https://']
+    assert adapter._pool_maxsize == conn.conn_param.concurrent_requests
+    assert conn.bulk.timeout == conn.conn_param.timeout
+    callout = sfbulk.callout.Callout(logger=logging.getLogger(__name__),
+                                     session=conn.bulk.session)
+    url = mockers.SFMock.baseurl + '/job/750n01/batch/751n01/result/752n01'
+    m.get(url, text='"Id","Name"\n"001n01","a\nb"\n"001n02","c"')
+    chunk = callout.docall(url, 'GET', stream=True)
+    assert list(chunk) == ['"Id","Name"\n', '"001n01","a\n', 'b"\n',
+                           '"001n02","c"']
+    chunk.close()
+    m.get(url, status_code=400, text='<?xml version="1.0" encoding="UTF-8"?>\
+<error><exceptionCode>InvalidSessionId</exceptionCode></error>')
+    try:
+        callout.docall(url, 'GET')
+        assert 0
+    except sfbulk.InvalidSessionException:
+        pass
+
+@requests_mock.Mocker()
+def test_callout_gzip(m):
+    callout = sfbulk.callout.Callout(logger=logging.getLogger(__name__),
+                                     compress=True)
+    url = mockers.SFMock.baseurl + '/job/750n01/batch'
+    csv_data = '"Name"\n' + '"a"\n' * sfbulk.callout.GZIP_MIN_SIZE
+    result = '"Id","Name"\n' + '"001n01","a"\n' * 1000
+    m.post(url, content=sfbulk.callout.gzip_data(result),
+           headers={'Content-Encoding': 'gzip'})
+    chunk = callout.docall(url, 'POST', csv_data, stream=True)
+    # response is decompressed as it's read
+    assert ''.join(chunk) == result
+    request = m.request_history[-1]
+    assert request.headers['Accept-Encoding'] == 'gzip'
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert zlib.decompress(request.body, sfbulk.callout.GZIP_WBITS) == csv_data
+    # small data isn't compressed
+    assert callout.docall(url, 'POST', '"Name"\n"a"\n') == result
+    assert 'Content-Encoding' not in m.request_history[-1].headers
+    # compression is disabled
+    callout.compress = False
+    m.post(url, text=result)
+    callout.docall(url, 'POST', csv_data)
+    request = m.request_history[-1]
+    assert request.headers['Accept-Encoding'] == 'identity'
+    assert request.body == csv_data
+
+@requests_mock.Mocker()
+def test_upsert_no_external_id(m):
     mock_oauth(m)
     mock_login(m)
     setdatadir(tempfile.mkdtemp())
     with open(config_file) as conf_file:
-        with open('tests/sql/upsert_unsupported.sql') as job_file:
+        # upsert has no external id field after object name
+        with open('tests/sql/upsert_no_external_id.sql') as job_file:
             try:
                 run_job_from_file(conf_file, job_file,
                                   {'src':'test', 'dst':'test'}, {}, None, None)
@@ -343,7 +878,155 @@ def test_empty_query_res(mock_docall, m):
 #                               {'src':'test', 'dst':'test'}, {}, None, None)
             
             
+
+@mock.patch.object(sf_bulk_connector, 'AUTO_TARGET_BATCH_TIME', 60000)
+def test_estimate_batch_size():
+    estimate = SfBulkConnector.estimate_batch_size
+    # 10ms per record
+    assert estimate({'state': 'Completed', 'numberRecordsProcessed': '200',
+                     'numberRecordsFailed': '0',
+                     'totalProcessingTime': '2000'}, 0) == 6000
+    # fast processing is limited by Bulk API
+    assert estimate({'state': 'Completed', 'numberRecordsProcessed': '200',
+                     'numberRecordsFailed': '0',
+                     'totalProcessingTime': '20'}, 0) == 10000
+    # failed records aren't counted in processing time
+    assert estimate({'state': 'Completed', 'numberRecordsProcessed': '200',
+                     'numberRecordsFailed': '100',
+                     'totalProcessingTime': '2000'}, 0) == 3000
+    # batch size is decreased by lock errors rate
+    assert estimate({'state': 'Completed', 'numberRecordsProcessed': '200',
+                     'numberRecordsFailed': '20',
+                     'totalProcessingTime': '2000'}, 20) == 4860
+    assert estimate({'state': 'Completed', 'numberRecordsProcessed': '200',
+                     'numberRecordsFailed': '100',
+                     'totalProcessingTime': '1200'}, 100) == 2500
+    # all records locked
+    assert estimate({'state': 'Completed', 'numberRecordsProcessed': '200',
+                     'numberRecordsFailed': '200',
+                     'totalProcessingTime': '2000'}, 200) == \
+        sf_bulk_connector.AUTO_MIN_BATCH_SIZE
+    assert estimate({'state': 'Failed', 'numberRecordsProcessed': '0',
+                     'numberRecordsFailed': '0',
+                     'totalProcessingTime': '0'}, 0) == \
+        sf_bulk_connector.AUTO_MIN_BATCH_SIZE
+
+@mock.patch.object(sf_bulk_connector, 'AUTO_TARGET_BATCH_TIME', 60000)
+@mock.patch.object(sf_bulk_connector, 'AUTO_PROBE_SIZE', 2)
+@mock.patch.object(sf_bulk_connector, 'AUTO_MIN_BATCH_SIZE', 3)
+@requests_mock.Mocker()
+def test_auto_batch_size(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    conn.bulk.jobinfo = mock.Mock(batch={})
+    batches = []
+    def dispatch_batch(batch_data):
+        batches.append(batch_data)
+        # 6 records per minute, halved by 1 of 2 records locked
+        conn.bulk.jobinfo.batch[str(len(batches))] = {
+            'state': 'Completed', 'numberRecordsProcessed': '2',
+            'numberRecordsFailed': '0', 'totalProcessingTime': '20000'}
+        return str(len(batches))
+    conn.dispatch_batch = dispatch_batch
+    conn.wait_job_completed = lambda: None
+    conn.bulk.updateBatchStatus = lambda jobinfo, batch_id: None
+    conn.bulk.batch_result_by_id = lambda batch_id: \
+        ['"Id","Success","Created","Error"\n',
+         '"","false","false","UNABLE_TO_LOCK_ROW:unable to obtain lock"\n']
+    csv_data = ['Name\n'] + ['%d\n' % i for i in xrange(10)]
+    batch_ids = conn.dispatch_auto_batches(csv_data, 1)
+    assert batch_ids == ['1', '2', '3', '4']
+    # probe batch, then batches of estimated size
+    assert [len(x) - 1 for x in batches] == [2, 3, 3, 2]
+    assert [x[0] for x in batches] == ['Name\n'] * 4
+
+@mock.patch.object(sf_bulk_connector, 'RETRY_TIMER', 0)
+@requests_mock.Mocker()
+def test_retry_failed_records(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    attempts = []
+    results = [
+        ['"Id","Success","Created","Error"',
+         '"001n000000HDYkvAAH","true","true",""',
+         '"","false","false","UNABLE_TO_LOCK_ROW:unable to obtain lock"',
+         '"","false","false","REQUIRED_FIELD_MISSING:Name"',
+         '"","false","false","InvalidBatch : Request timed out"', ''],
+        ['"Id","Success","Created","Error"',
+         '"001n000000HDYkwAAH","true","true",""',
+         '"","false","false","UNABLE_TO_LOCK_ROW:unable to obtain lock"', ''],
+        ['"Id","Success","Created","Error"',
+         '"001n000000HDYkxAAH","true","true",""', '']]
+    def bulk_common_(op, objname, csv_data, max_batch_size,
+                     upsert_external_field, sequential, group_field):
+        attempts.append((csv_data, sequential))
+        return results[len(attempts) - 1]
+    conn.bulk_common_ = bulk_common_
+    res = conn.bulk_insert('Account', ['Name\n', 'a\n', 'b\n', 'c\n', 'd\n'],
+                           10, False, 3, True)
+    # only records failed by retryable errors are sent again
+    assert attempts == [(['Name\n', 'a\n', 'b\n', 'c\n', 'd\n'], False),
+                        (['Name\n', 'b\n', 'd\n'], True),
+                        (['Name\n', 'd\n'], True)]
+    # result has last attempt of every record
+    assert res == ['"Id","Success","Created","Error"',
+                   '"001n000000HDYkvAAH","true","true",""',
+                   '"001n000000HDYkwAAH","true","true",""',
+                   '"","false","false","REQUIRED_FIELD_MISSING:Name"',
+                   '"001n000000HDYkxAAH","true","true",""', '']
+
+@requests_mock.Mocker()
+def test_failed_batch_result(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    conn.bulk.jobinfo = mock.Mock(batch={
+        '1': {'state': 'Failed', 'numberRecordsProcessed': '0',
+              'stateMessage': 'InvalidBatch : "Timeout"'}})
+    conn.bulk.jobinfo.findBatchState = lambda x: 'Failed'
+    conn.batch_records = {'1': 2}
+    # every not processed record of failed batch gets batch error
+    assert conn.batch_result('1', False) == \
+        ['"Id","Success","Created","Error"',
+         '"","false","false","InvalidBatch : ""Timeout"""',
+         '"","false","false","InvalidBatch : ""Timeout"""']
+
+@mock.patch.object(sf_bulk_connector, 'RETRY_TIMER', 0)
+@requests_mock.Mocker()
+def test_failed_batch_not_retried(m):
+    mock_oauth(m)
+    mock_login(m)
+    conn = create_bulk_connector(setup(), 'test')
+    conn.bulk.jobinfo = mock.Mock(batch={
+        '1': {'state': 'Failed', 'numberRecordsProcessed': '0',
+              'stateMessage': 'InvalidBatch : Field name not found : Foo__c'},
+        '2': {'state': 'Failed', 'numberRecordsProcessed': '0',
+              'stateMessage': 'InvalidBatch : Request timed out'}})
+    conn.bulk.jobinfo.findBatchState = lambda x: 'Failed'
+    conn.batch_records = {'1': 2, '2': 1}
+    attempts = []
+    def bulk_common_(op, objname, csv_data, max_batch_size,
+                     upsert_external_field, sequential, group_field):
+        attempts.append(csv_data)
+        if len(attempts) == 1:
+            return conn.batch_result('1', False) + \
+                conn.batch_result('2', False)[1:] + ['']
+        return ['"Id","Success","Created","Error"',
+                '"001n000000HDYkvAAH","true","true",""', '']
+    conn.bulk_common_ = bulk_common_
+    res = conn.bulk_insert('Account', ['Foo__c\n', 'a\n', 'b\n', 'c\n'],
+                           2, False, 3)
+    # records of failed batch are retried only if batch error is retryable
+    assert attempts == [['Foo__c\n', 'a\n', 'b\n', 'c\n'],
+                        ['Foo__c\n', 'c\n']]
+    assert res == [
+        '"Id","Success","Created","Error"',
+        '"","false","false","InvalidBatch : Field name not found : Foo__c"',
+        '"","false","false","InvalidBatch : Field name not found : Foo__c"',
+        '"001n000000HDYkvAAH","true","true",""', '']
+
 if __name__ == '__main__':
     test_insert_update()
     test_insert_load()
-    
@@ -121,7 +121,19 @@ csv.one_ten, 9; => csv:final:cache => dst:insert:foo:1:res => type:sequential',
              'SELECT 1 as test, 2 as test2; => csv:foo:cache \
 => dst:insert:test_table:1:new_ids',
              'SELECT 1 as test, 2 as test2; => csv:foo \
-=> dst:insert:test_table:1:res']
+=> dst:insert:test_table:1:res',
+             'SELECT Id FROM src.Task => csv:tasks:pkchunk:250000',
+             'SELECT Id FROM src.Task => csv:tasks:cache:pkchunk',
+             'SELECT 1 as test => csv:foo => dst:insert:test_table:auto:res',
+             'SELECT 1 as test => csv:foo => dst:update:test_table:10:res \
+=> retry:3:sequential',
+             'SELECT 1 as test => csv:foo => dst:update:test_table:10:res \
+=> groupby:AccountId',
+             'SELECT 1 as test => csv:foo \
+=> dst:upsert:test_table:ExtId__c:10:res',
+             'SELECT 1 as Id => csv:foo => dst:hardDelete:test_table:10:res',
+             'SELECT count() FROM dst.Account => var:COUNT',
+             'SELECT Id FROM src.Account => csv:accounts => rest:']
     expected = [
         {'query': 'SELECT 1', 'csv': 'const1'},
         {'from': 'csv', 'query': 'SELECT 1', 'var': 'MIN'},
@@ -142,7 +154,32 @@ csv.one_ten, 9; => csv:final:cache => dst:insert:foo:1:res => type:sequential',
          'batch_size': '1'},
         {'query': 'SELECT 1 as test, 2 as test2;', 'csv': 'foo',
          'op': 'insert', 'dst' : 'test_table',
-         'batch_size': '1', 'new_ids_table': 'res'}
+         'batch_size': '1', 'new_ids_table': 'res'},
+        {'query': 'SELECT Id FROM Task', 'csv': 'tasks', 'from': 'src',
+         'objname': 'Task', 'pkchunk': '250000'},
+        {'query': 'SELECT Id FROM Task', 'csv': 'tasks', 'from': 'src',
+         'objname': 'Task', 'cache': '', 'pkchunk': ''},
+        {'query': 'SELECT 1 as test', 'csv': 'foo',
+         'op': 'insert', 'dst' : 'test_table',
+         'batch_size': 'auto', 'new_ids_table': 'res'},
+        {'query': 'SELECT 1 as test', 'csv': 'foo',
+         'op': 'update', 'dst' : 'test_table',
+         'batch_size': '10', 'new_ids_table': 'res',
+         'retry': '3', 'retry_type': 'sequential'},
+        {'query': 'SELECT 1 as test', 'csv': 'foo',
+         'op': 'update', 'dst' : 'test_table',
+         'batch_size': '10', 'new_ids_table': 'res',
+         'groupby': 'AccountId'},
+        {'query': 'SELECT 1 as test', 'csv': 'foo',
+         'op': 'upsert', 'dst' : 'test_table', 'upsert_field': 'ExtId__c',
+         'batch_size': '10', 'new_ids_table': 'res'},
+        {'query': 'SELECT 1 as Id', 'csv': 'foo',
+         'op': 'hardDelete', 'dst' : 'test_table',
+         'batch_size': '10', 'new_ids_table': 'res'},
+        {'query': 'SELECT count() FROM Account', 'var': 'COUNT',
+         'from': 'dst', 'objname': 'Account'},
+        {'query': 'SELECT Id FROM Account', 'csv': 'accounts',
+         'from': 'src', 'objname': 'Account', 'rest': ''}
     ]
 
     job_syntax = JobSyntax(lines)
@@ -307,6 +344,45 @@ def test_batch_splitter():
     print batch_ranges
     assert(batch_ranges == [(0,2), (3,5), (6,8), (9,9)])
 
+def test_csv_batches_reader():
+    csv_lines = StringIO('Id,Name\n1,"a\nb"\n2,c\n3,"d\n\ne"\n')
+    batches = list(bulk_data.iter_csv_batches(csv_lines, 2))
+    assert batches == [['Id,Name\n', '1,"a\nb"\n', '2,c\n'],
+                       ['Id,Name\n', '3,"d\n\ne"\n']]
+    # connector reads not list data lazily by the same way
+    csv_lines.seek(0)
+    assert list(SfBulkConnector.iter_batches(csv_lines, 2)) == batches
+
+def test_csv_batches_size_limit():
+    csv_lines = ['Id,Name\n', '1,aaaa\n', '2,b\n', '3,c\n',
+                 '4,<N CR>dd<N CR>\n', '5,eeeeeeeeeeee\n', '6,f\n']
+    batches = list(bulk_data.iter_csv_batches(csv_lines, 3, 20))
+    # batches are filled up to records count or data size limit,
+    # record bigger than limit is sent in separate batch
+    assert batches == [['Id,Name\n', '1,aaaa\n', '2,b\n'],
+                       ['Id,Name\n', '3,c\n', '4,<N CR>dd<N CR>\n'],
+                       ['Id,Name\n', '5,eeeeeeeeeeee\n'],
+                       ['Id,Name\n', '6,f\n']]
+
+def test_csv_batches_groupby():
+    csv_lines = ['Id,ParentId\n', '1,b\n', '2,a\n', '3,b\n', '4,c\n',
+                 '5,a\n', '6,c\n', '7,c\n', '8,c\n', '9,d\n']
+    sorted_lines, positions = bulk_data.sort_csv_records(csv_lines,
+                                                         'ParentId')
+    assert sorted_lines == ['Id,ParentId\n', '2,a\n', '5,a\n', '1,b\n',
+                            '3,b\n', '4,c\n', '6,c\n', '7,c\n', '8,c\n',
+                            '9,d\n']
+    batches = list(bulk_data.iter_csv_batches(sorted_lines, 3,
+                                              group_field='ParentId'))
+    # group is splitted only if it's bigger than batch
+    assert [[x[:1] for x in batch[1:]] for batch in batches] == \
+        [['2', '5'], ['1', '3'], ['4', '6', '7'], ['8', '9']]
+    res = ['"Id","Success","Created","Error"'] + \
+          ['"%s","true","true",""' % x[0] for x in sorted_lines[1:]] + ['']
+    assert bulk_data.restore_results_order(res, positions) == \
+        ['"Id","Success","Created","Error"'] + \
+        ['"%s","true","true",""' % x[0] for x in csv_lines[1:]] + ['']
+
 if __name__ == '__main__':
     loginit(__name__)
     # test_batch_splitter()
@@ -0,0 +1,99 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+__author__ = "Yaroslav Litvinov"
+
+import tempfile
+from mriya.log import loginit
+from mriya.job_syntax_extended import JobSyntaxExtended
+from mriya.job_controller import JobController
+from mriya.job_scheduler import JobScheduler
+from mriya.sql_executor import SqlExecutor, setdatadir
+from mriya.sqlite_engine import SqliteEngine
+
+config_filename = 'test-config.ini'
+endpoint_names = {'dst': 'test', 'src': 'test'}
+
+JOB_LINES = [
+    "SELECT 1 as a => csv:sched_a",
+    "SELECT 2 as b => csv:sched_b",
+    "SELECT 'sched_b' => var:TABLE_NAME",
+    "SELECT a FROM csv.sched_a => var:VAR_A",
+    "SELECT a, b, '{VAR_A}' as v FROM csv.sched_a, csv.sched_b \
+=> csv:sched_ab",
+    "SELECT count() FROM csv.sched_ab => var:COUNT",
+    "SELECT Id FROM Account LIMIT 1 => csv:sched_sf",
+    "SELECT i FROM csv.ints10000 WHERE i < 3 => batch_begin:i:I",
+    "SELECT '{I}' as i => csv:sched_loop_{I}",
+    "=> batch_end:I",
+    "SELECT * FROM csv.sched_loop_1 => csv:sched_after_loop"]
+
+RESULT_TABLES = ['sched_a', 'sched_b', 'sched_ab', 'sched_loop_0',
+                 'sched_loop_2', 'sched_after_loop']
+
+def create_job_controller(workers):
+    job_syntax = JobSyntaxExtended(JOB_LINES)
+    job_controller = JobController(config_filename, endpoint_names,
+                                   job_syntax, {}, False, SqliteEngine())
+    job_controller.workers = workers
+    return job_controller
+
+def test_scheduler_dependencies():
+    loginit(__name__)
+    setdatadir(tempfile.mkdtemp())
+    scheduler = JobScheduler(create_job_controller(4), 4)
+    deps = scheduler.dependencies
+    # independent items
+    assert deps[0] == set()
+    assert deps[1] == set()
+    assert deps[2] == set()
+    assert deps[3] == set([0])
+    assert deps[4] == set([0, 1, 3])
+    assert deps[5] == set([4])
+    assert deps[6] == set()
+    # batch loop is a barrier
+    assert deps[7] == set(range(7))
+    assert deps[8] == set([7])
+
+def run_job(workers):
+    setdatadir(tempfile.mkdtemp())
+    job_controller = create_job_controller(workers)
+    # salesforce item is not a part of the comparison
+    job_controller.job_syntax = [x for x in job_controller.job_syntax
+                                 if 'Account' not in x['line']]
+    job_controller.run_job()
+    variables = job_controller.variables
+    del job_controller
+    tables = {}
+    for table_name in RESULT_TABLES:
+        with open(SqlExecutor.csv_name(table_name)) as table_f:
+            tables[table_name] = table_f.read()
+    return (variables, tables)
+
+def test_parallel_same_as_sequential():
+    loginit(__name__)
+    seq_vars, seq_tables = run_job(1)
+    par_vars, par_tables = run_job(4)
+    assert seq_tables == par_tables
+    assert seq_vars == par_vars
+    assert par_vars['COUNT'] == '1'
+    assert par_tables['sched_ab'] == 'a,b,v\n1,2,1\n'
@@ -93,6 +93,8 @@ def fast_merge_mock(m, response_list):
                    response_list=response_list)
     sm = SfSoapMergeWrapper(fake_bulk_connector, 'Account', BULK_DATA_IN, 2)
     sm.sf_bulk_connector.bulk.sessionid = 'fake-sessionid'
+    sm.sf_bulk_connector.bulk.session = requests.Session()
+    sm.sf_bulk_connector.bulk.timeout = None
     sm.sf_bulk_connector.instance_url = 'https://fake-localhost'
     res = sm.validate()
     assert res != None
@@ -0,0 +1,120 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+__author__ = "Yaroslav Litvinov"
+
+import os
+import tempfile
+from mriya.log import loginit
+from mriya.job_syntax import BATCH_PARAMS_KEY
+from mriya.job_syntax_extended import JobSyntaxExtended
+from mriya.job_controller import JobController
+from mriya.sql_executor import SqlExecutor, setdatadir
+from mriya.sqlite_engine import SqliteEngine, split_statements, csv_value
+
+config_filename = 'test-config.ini'
+endpoint_names = {'dst': 'test', 'src': 'test'}
+
+TEST_CSV = 'id,field\n\
+1,hi\n\
+2,"hello, man"\n\
+3,"hello ""man"""\n\
+4,"hello\n\
+man"\n\
+5,#N/A\n\
+6,\n'
+
+JOB_LINES = [
+    "SELECT * FROM csv.engine_test => csv:engine_copy",
+    "SELECT id, field, NULL as n, 1.5 as f, 10.0 as g, 0.1+0.2 as ff, \
+'' as e, 'it''s' as a FROM csv.engine_copy => csv:engine_types",
+    "SELECT count() FROM csv.engine_types => var:COUNT",
+    "SELECT field FROM csv.engine_test WHERE id='2' => var:FIELD2",
+    "UPDATE csv.engine_test SET field='changed'; \
+SELECT * FROM csv.engine_test WHERE id='1' => csv:engine_updated",
+    "SELECT * FROM csv.engine_test WHERE id='1' => csv:engine_not_updated",
+    "SELECT * FROM csv.engine_test WHERE id='777' => csv:engine_empty",
+    "SELECT id FROM csv.engine_test WHERE id < '3' => batch_begin:id:ID",
+    "SELECT id, '{ID}' as param FROM csv.engine_test WHERE id='{ID}' \
+=> csv:engine_loop_{ID}",
+    "=> batch_end:ID",
+    "SELECT * FROM csv.ints10000 LIMIT 3 => csv:engine_ints",
+    "SELECT * FROM csv.engine_test => csv:engine_inplace",
+    "SELECT id FROM csv.engine_inplace WHERE id < '3' => csv:engine_inplace"]
+
+RESULT_TABLES = ['engine_copy', 'engine_types', 'engine_updated',
+                 'engine_not_updated', 'engine_empty',
+                 'engine_loop_1', 'engine_loop_2', 'engine_ints',
+                 'engine_inplace']
+
+def run_job(sqlite_engine):
+    setdatadir(tempfile.mkdtemp())
+    with open(SqlExecutor.csv_name('engine_test'), 'w') as test_csv_f:
+        test_csv_f.write(TEST_CSV)
+    job_syntax = JobSyntaxExtended(JOB_LINES)
+    job_controller = JobController(config_filename, endpoint_names,
+                                   job_syntax, {}, False, sqlite_engine)
+    job_controller.run_job()
+    variables = job_controller.variables
+    del job_controller
+    tables = {}
+    for table_name in RESULT_TABLES:
+        with open(SqlExecutor.csv_name(table_name)) as table_f:
+            tables[table_name] = table_f.read()
+    return (variables, tables)
+
+def test_engine_same_as_shell():
+    loginit(__name__)
+    shell_vars, shell_tables = run_job(None)
+    engine_vars, engine_tables = run_job(SqliteEngine())
+    assert shell_tables == engine_tables
+    assert shell_vars == engine_vars
+    assert engine_vars['COUNT'] == '6'
+    assert engine_vars['FIELD2'] == 'hello, man'
+    assert engine_vars[BATCH_PARAMS_KEY] == ['1', '2']
+    assert engine_tables['engine_not_updated'] == 'id,field\n1,hi\n'
+    # table is transformed in place
+    assert engine_tables['engine_inplace'] == 'id\n1\n2\n'
+
+def test_engine_reimport_changed_csv():
+    setdatadir(tempfile.mkdtemp())
+    engine = SqliteEngine()
+    csvname = SqlExecutor.csv_name('reimport')
+    with open(csvname, 'w') as csv_f:
+        csv_f.write('a\n1\n')
+    assert engine.refresh_table('reimport', csvname)
+    assert not engine.refresh_table('reimport', csvname)
+    with open(csvname, 'w') as csv_f:
+        csv_f.write('a\n1\n22\n')
+    assert engine.refresh_table('reimport', csvname)
+    os.remove(csvname)
+    assert engine.refresh_table('reimport', csvname)
+    assert 'reimport' not in engine.tables
+    engine.close()
+
+def test_engine_helpers():
+    assert split_statements("SELECT ';'; SELECT 2") == ["SELECT ';';",
+                                                      'SELECT 2']
+    assert csv_value(None) == '#N/A'
+    assert csv_value(3) == '3'
+    assert csv_value(1e20) == '1.0e+20'
+    assert csv_value('a b') == '"a b"'
@@ -0,0 +1,113 @@
+"""
+Copyright (C) 2016-2017 by Yaroslav Litvinov <yaroslav.litvinov@gmail.com>
+and associates (see AUTHORS).
+
+This file is part of Mriya.
+
+Mriya is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Mriya is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Mriya.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#!/usr/bin/env python
+
+__author__ = "Yaroslav Litvinov"
+
+import timeit
+import xml.dom.minidom
+import mockers #local
+from test_sf_merge import MERGE_HTTP_RESP
+from sfbulk.jobinfo import JobInfo
+from sfbulk.utils_xml import parseXMLResult, parseXMLResultItems
+from sfbulk.utils_xml import parseXMLResultList
+
+BENCH_NUMBER = 200
+
+JOB_INFO_RESP = mockers.JOB_INFO_RESP_FMT.format(
+    jobid='750n01', operation='query', state='Closed',
+    completed=2, failed=0, total=2)
+BATCH_INFO_RESP = mockers.BATCH_INFO_RESP_FMT.format(
+    jobid='750n01', batchid='751n00', state='Completed')
+BATCH_INFO_LIST_RESP = mockers.BATCH_INFO_LIST_RESP_FMT.format(
+    batches=''.join([mockers.BATCH_INFO_RESP_FMT.format(
+        jobid='750n01', batchid='751n%02d' % x, state='Completed')
+                     .split('?>', 1)[1] for x in xrange(10)]))
+
+def test_login_resp():
+    res = parseXMLResult(mockers.LOGIN_RESP)
+    assert res['sessionId'] == u'fakefake.somesessionid'
+    assert res['serverUrl'] == \
+        u'https://fake-host.salesforce.com/services/Soap/u/37.0/00Dn00000000YB8'
+    assert type(res['sessionId']) is unicode
+
+def test_job_batch_info():
+    res = parseXMLResult(JOB_INFO_RESP)
+    assert res['id'] == '750n01'
+    assert res['state'] == 'Closed'
+    assert res['numberBatchesTotal'] == '2'
+    batches = parseXMLResultItems(BATCH_INFO_LIST_RESP)
+    assert [x['id'] for x in batches] == ['751n%02d' % x for x in xrange(10)]
+    # text of item element itself is kept as well
+    assert batches[0].pop('batchInfo').strip() == ''
+    assert batches[0] == parseXMLResult(BATCH_INFO_RESP)
+
+def test_merge_resp():
+    res = parseXMLResultList(MERGE_HTTP_RESP, 'mergeResponse')
+    assert res['mergeResponse'] == [
+        {u'message': u'invalid cross reference id',
+         u'statusCode': u'INVALID_CROSS_REFERENCE_KEY',
+         u'success': u'false'},
+        {u'message': u'...', u'statusCode': u'DELETE_FAILED',
+         u'id': u'000001111122222789', u'success': u'false'},
+        {u'id': u'000001111122222100',
+         u'mergedRecordIds': u'000001111122222733', u'success': u'true'}]
+
+def test_job_request():
+    jobinfo = JobInfo.factory('upsert', 'Account', 'Ext__c')
+    assert jobinfo.createJob() == '<?xml version="1.0" encoding="utf-8"?>\
+<jobinfo xmlns="http://www.force.com/2009/06/asyncapi/dataload">\
+<operation>upsert</operation><object>Account</object>\
+<externalIdFieldName>Ext__c</externalIdFieldName>\
+<concurrencyMode>Parallel</concurrencyMode><contentType>CSV</contentType>\
+</jobinfo>'
+    jobinfo.state = 'Closed'
+    assert jobinfo.closeJob() == '<?xml version="1.0" encoding="utf-8"?>\
+<jobinfo xmlns="http://www.force.com/2009/06/asyncapi/dataload">\
+<state>Closed</state></jobinfo>'
+
+def bench_parsers():
+    """ Return list of (fixture name, parser time, minidom time).
+    Building of minidom document alone is compared, as it's the lower
+    bound of time spent by minidom based parser """
+    fixtures = [
+        ('login', mockers.LOGIN_RESP, parseXMLResult),
+        ('jobInfo', JOB_INFO_RESP, parseXMLResult),
+        ('batchInfo', BATCH_INFO_RESP, parseXMLResult),
+        ('batchInfoList', BATCH_INFO_LIST_RESP, parseXMLResultItems),
+        ('merge', MERGE_HTTP_RESP,
+         lambda x: parseXMLResultList(x, 'mergeResponse'))]
+    res = []
+    for name, raw_xml, parser in fixtures:
+        parser_time = min(timeit.repeat(lambda: parser(raw_xml),
+                                        number=BENCH_NUMBER, repeat=3))
+        minidom_time = min(timeit.repeat(
+            lambda: xml.dom.minidom.parseString(raw_xml),
+            number=BENCH_NUMBER, repeat=3))
+        res.append((name, parser_time, minidom_time))
+    return res
+
+if __name__ == '__main__':
+    # microbenchmark: python tests/test_xml_parser.py
+    for name, parser_time, minidom_time in bench_parsers():
+        print '%-14s parser %.2fms minidom %.2fms speedup x%.1f' % (
+            name, parser_time * 1000 / BENCH_NUMBER,
+            minidom_time * 1000 / BENCH_NUMBER, minidom_time / parser_time)